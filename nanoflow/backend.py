@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import importlib
+import multiprocessing
+import os
+import sys
+from collections import defaultdict
+from collections.abc import Callable, Hashable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from contextvars import ContextVar
+from multiprocessing.connection import Connection
+from typing import TYPE_CHECKING, Any, Literal
+
+from loguru import logger
+
+from .launcher import ForkServer
+
+if TYPE_CHECKING:
+    from multiprocessing.context import ForkServerContext, SpawnContext
+
+TaskBackend = Literal["thread", "process", "async", "warm"]
+
+
+def call_by_reference(module_name: str, qualname: str, *args: Any, **kwargs: Any) -> Any:
+    """Import a function in a worker process and call it.
+
+    The `task` decorator replaces a module level function by its `Task`, so the function itself
+    cannot be pickled by reference. The task found under that name is unwrapped instead.
+    """
+    fn: Any = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        fn = getattr(fn, name)
+    fn = getattr(fn, "fn", fn)
+    return fn(*args, **kwargs)
+
+
+def process_target(fn: Callable[..., Any]) -> Callable[..., Any]:
+    module_name = getattr(fn, "__module__", None)
+    qualname = getattr(fn, "__qualname__", None)
+    if module_name is None or qualname is None or "<" in qualname:
+        return fn
+    return functools.partial(call_by_reference, module_name, qualname)
+
+
+def get_mp_context() -> ForkServerContext | SpawnContext:
+    # The event loop process runs threads, which makes forking it directly unsafe
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def peak_rss() -> int:
+    """Peak resident set size of the current process, in bytes, or 0 where it is not available."""
+    try:
+        from resource import RUSAGE_SELF, getrusage
+    except ImportError:  # pragma: no cover
+        # The module only exists on Unix
+        return 0
+    max_rss = getrusage(RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def warm_worker_main(connection: Connection, environ: dict[str, str]):
+    os.environ.update(environ)
+    while (message := connection.recv()) is not None:
+        fn, args, kwargs = message
+        try:
+            reply = (True, fn(*args, **kwargs), peak_rss())
+        except Exception as e:
+            reply = (False, e, peak_rss())
+        try:
+            connection.send(reply)
+        except Exception as e:
+            # The result or the exception cannot be pickled
+            connection.send((False, RuntimeError(f"Cannot send the result of the task: {e!r}"), peak_rss()))
+
+
+class WarmWorker:
+    """Long-lived process running Python task functions one at a time.
+
+    Modules imported and state loaded by a task stay in memory for the next ones. The process is
+    started with `environ` added to its environment, before any task is run.
+    """
+
+    def __init__(self, environ: dict[str, str]):
+        context = get_mp_context()
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=warm_worker_main, args=(child_connection, environ))
+        self.process.start()
+        child_connection.close()
+        self.lock = asyncio.Lock()
+        self.task_count = 0
+        self.peak_rss = 0
+
+    def call(self, fn: Callable[..., Any], args: tuple[Any, ...], kwargs: dict[str, Any]) -> Any:
+        self.connection.send((fn, args, kwargs))
+        try:
+            succeeded, value, self.peak_rss = self.connection.recv()
+        except EOFError:
+            raise ChildProcessError(f"Warm worker exited with code {self.process.exitcode}") from None
+        self.task_count += 1
+        if not succeeded:
+            raise value
+        return value
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        async with self.lock:
+            try:
+                return await asyncio.to_thread(self.call, process_target(fn), args, kwargs)
+            except asyncio.CancelledError:
+                # The function cannot be interrupted, so the process is killed, for example on timeout
+                self.kill()
+                raise
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+
+    def close(self):
+        if self.alive:
+            self.connection.send(None)
+            self.process.join()
+        self.connection.close()
+
+
+class ExecutionBackends:
+    """Pools that run Python task functions, shared by every task submitted in the same context.
+
+    - `thread`: the default thread pool of the event loop, for blocking IO.
+    - `process`: a shared `ProcessPoolExecutor` with `max_workers` processes, for CPU-bound code.
+    - `async`: the coroutine function is awaited directly on the event loop.
+    - `warm`: a `WarmWorker` kept for each resource, such as a GPU, so that modules and models
+      loaded by a task stay loaded for the next task on that resource. A worker is replaced after
+      `warm_max_tasks` tasks or once its peak RSS passes `warm_max_rss` bytes.
+
+    Command tasks with preloaded modules share a `ForkServer` for each list of modules.
+
+    Example:
+    >>> async def double(x: int) -> int:
+    ...     return x * 2
+    >>> asyncio.run(ExecutionBackends().run("async", double, 21))
+    42
+    >>> asyncio.run(ExecutionBackends().run("thread", abs, -1))
+    1
+    """
+
+    def __init__(
+        self, max_workers: int | None = None, *, warm_max_tasks: int | None = None, warm_max_rss: int | None = None
+    ):
+        self.max_workers = max_workers
+        self.process_pool: ProcessPoolExecutor | None = None
+        self.warm_max_tasks = warm_max_tasks
+        self.warm_max_rss = warm_max_rss
+        self.warm_workers: dict[Hashable, WarmWorker] = {}
+        # Held while a worker of the key is chosen, runs a task and is recycled
+        self.warm_locks: defaultdict[Hashable, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.fork_servers: dict[tuple[str, ...], ForkServer] = {}
+
+    def get_process_pool(self) -> ProcessPoolExecutor:
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=get_mp_context())
+        return self.process_pool
+
+    async def run_warm(
+        self, key: Hashable, environ: dict[str, str], fn: Callable[..., Any], *args: Any, **kwargs: Any
+    ) -> Any:
+        """Run `fn` in the warm worker of `key`, which is started with `environ` if it is not running.
+
+        Tasks of the same key run one at a time, so that a worker is never recycled while another
+        task is using it.
+        """
+        async with self.warm_locks[key]:
+            worker = self.warm_workers.get(key)
+            if worker is None or not worker.alive:
+                worker = self.warm_workers[key] = WarmWorker(environ)
+            try:
+                return await worker.run(fn, *args, **kwargs)
+            finally:
+                if not worker.alive:
+                    await self.recycle(key, worker)
+                elif self.warm_max_tasks is not None and worker.task_count >= self.warm_max_tasks:
+                    logger.info(f"Recycling warm worker {worker.process.pid} after {worker.task_count} tasks")
+                    await self.recycle(key, worker)
+                elif self.warm_max_rss is not None and worker.peak_rss > self.warm_max_rss:
+                    logger.info(f"Recycling warm worker {worker.process.pid}, which used {worker.peak_rss} bytes")
+                    await self.recycle(key, worker)
+
+    def get_fork_server(self, preload: Sequence[str]) -> ForkServer:
+        """Fork server of command tasks that imported `preload`, which is started on first use."""
+        key = tuple(preload)
+        if key not in self.fork_servers:
+            self.fork_servers[key] = ForkServer(preload)
+        return self.fork_servers[key]
+
+    async def recycle(self, key: Hashable, worker: WarmWorker):
+        if self.warm_workers.get(key) is worker:
+            del self.warm_workers[key]
+        # Joining the process blocks, so it is done in a thread
+        await asyncio.to_thread(worker.close)
+
+    async def run(self, backend: TaskBackend, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        if backend == "async":
+            return await fn(*args, **kwargs)
+        if backend == "process":
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.get_process_pool(), functools.partial(process_target(fn), *args, **kwargs)
+            )
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+    def shutdown(self):
+        if self.process_pool is not None:
+            self.process_pool.shutdown(cancel_futures=True)
+            self.process_pool = None
+        for worker in self.warm_workers.values():
+            worker.close()
+        self.warm_workers.clear()
+        for fork_server in self.fork_servers.values():
+            fork_server.close()
+        self.fork_servers.clear()
+
+
+default_backends = ExecutionBackends()
+current_backends: ContextVar[ExecutionBackends] = ContextVar("current_backends", default=default_backends)
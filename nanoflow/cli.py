@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 import asyncio
+import re
+from contextlib import nullcontext
 from logging import Handler
 from pathlib import Path
-from typing import Literal
+from typing import Annotated, Literal
 
 import toml
 import typer
@@ -12,11 +14,18 @@ from rich.highlighter import NullHighlighter
 from rich.logging import RichHandler
 
 from nanoflow import WorkflowConfig
-from nanoflow.executor import Executor
+from nanoflow.config import merge_nodes, namespace_tasks
+from nanoflow.executor import Executor, ExecutorState, SchedulerMode
+from nanoflow.fingerprint import FingerprintIndex
+from nanoflow.history import DurationHistory
+from nanoflow.journal import RunJournal
+from nanoflow.remote import Coordinator, Worker, parse_address
 from nanoflow.utils import layer_nodes
 
 app = typer.Typer()
 
+STATE_DIR = Path(".nanoflow")
+
 
 def init_logger(log_level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], handler: Handler):
     logger.remove()
@@ -25,38 +34,103 @@ def init_logger(log_level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICA
 
 @app.command()
 def run(
-    config_path: Path,
+    config_path: Annotated[list[Path], typer.Argument(help="Workflow configs, run together with shared resources")],
     *,
     use_tui: bool = False,
     try_run: bool = False,
+    scheduler: SchedulerMode = "dependency",
+    resume: bool = False,
+    fail_fast: Annotated[bool, typer.Option("--fail-fast/--keep-going")] = False,
+    speculate: float | None = None,
+    serve: Annotated[str | None, typer.Option(help="Run the tasks on remote workers, listening on host:port")] = None,
+    max_in_flight: Annotated[int | None, typer.Option(min=1, help="Most tasks running at once")] = None,
+    token: Annotated[str | None, typer.Option(envvar="NANOFLOW_TOKEN", help="Token the workers must send")] = None,
 ):
     handler = RichHandler(highlighter=NullHighlighter(), markup=True)
     init_logger("DEBUG", handler)
-    workflow_config = WorkflowConfig.model_validate(toml.load(config_path))
+    workflow_configs = [WorkflowConfig.model_validate(toml.load(path)) for path in config_path]
     if try_run:
         if use_tui:
             logger.warning("[blue bold]use-tui[/] is ignored when try-run is used")
-        layered_nodes = layer_nodes(workflow_config.to_nodes())
-        for i, layer in enumerate(layered_nodes):
+        task_configs = namespace_tasks(workflow_configs)
+        for i, layer in enumerate(layer_nodes(merge_nodes(workflow_configs))):
             logger.info(f"Layer [blue bold]{i}[/]")
             for node in layer:
-                print(workflow_config.tasks[node].get_command())
+                workflow_config, task_name = task_configs[node]
+                print(workflow_config.expanded_tasks[task_name].get_command())
         return
+    history = DurationHistory.load(STATE_DIR / "durations.json")
+    journal_name = re.sub(r"[^\w.-]+", "-", "+".join(workflow_config.name for workflow_config in workflow_configs))
+    journal = RunJournal(STATE_DIR / "journals" / f"{journal_name}.jsonl")
+    fingerprints = FingerprintIndex.load(STATE_DIR / "fingerprints.json")
+    coordinator = Coordinator(*parse_address(serve), token=token) if serve is not None else None
     if use_tui:  # pragma: no cover
         from nanoflow.tui import Nanoflow
 
-        app = Nanoflow(workflow_config)
-        executor = Executor.from_configs(workflow_config, update_hook=app.update_log)
+        app = Nanoflow(*workflow_configs)
+        executor = Executor.from_configs(
+            workflow_configs,
+            update_hook=app.update_log,
+            scheduler=scheduler,
+            history=history,
+            journal=journal,
+            resume=resume,
+            fingerprints=fingerprints,
+            failure_mode="fail-fast" if fail_fast else "keep-going",
+            speculate=speculate,
+            coordinator=coordinator,
+            max_in_flight=max_in_flight,
+        )
 
-        async def start():
-            await asyncio.gather(executor.run_async(), app.run_async())
+        async def start() -> ExecutorState:
+            async with coordinator or nullcontext():
+                state, _ = await asyncio.gather(executor.run_async(), app.run_async())
+            return state
 
-        asyncio.run(start())
+        state = asyncio.run(start())
     else:
-        executor = Executor.from_configs(workflow_config)
-        executor.run()
+        executor = Executor.from_configs(
+            workflow_configs,
+            scheduler=scheduler,
+            history=history,
+            journal=journal,
+            resume=resume,
+            fingerprints=fingerprints,
+            failure_mode="fail-fast" if fail_fast else "keep-going",
+            speculate=speculate,
+            coordinator=coordinator,
+            max_in_flight=max_in_flight,
+        )
+        if coordinator is not None:
+            state = asyncio.run(serve_workers(executor, coordinator))
+        else:
+            state = executor.run()
+    if state.failed_task_count > 0:
+        raise typer.Exit(1)
+
+
+async def serve_workers(executor: Executor, coordinator: Coordinator) -> ExecutorState:
+    async with coordinator:
+        host, port = coordinator.address
+        logger.info(f"Waiting for workers on [blue]{host}:{port}[/blue]")
+        return await executor.run_async()
+
+
+@app.command()
+def worker(
+    connect: Annotated[str, typer.Option(help="Address of the coordinator, as host:port")],
+    *,
+    resources: Annotated[str, typer.Option(help="`gpus` or a comma-separated list of resources")] = "gpus",
+    name: str | None = None,
+    token: Annotated[str | None, typer.Option(envvar="NANOFLOW_TOKEN", help="Token of the coordinator")] = None,
+):
+    handler = RichHandler(highlighter=NullHighlighter(), markup=True)
+    init_logger("DEBUG", handler)
+    host, port = parse_address(connect)
+    worker_resources = "gpus" if resources == "gpus" else [res for res in resources.split(",") if res]
+    asyncio.run(Worker(host, port, resources=worker_resources, name=name, token=token).run())
 
 
 @app.command()
-def try_run(config_path: Path):
+def try_run(config_path: list[Path]):
     run(config_path, try_run=True)
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
-from collections.abc import Generator
-from itertools import product
-from typing import Any, Literal
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Generator, Iterator, Mapping, Sequence
+from operator import itemgetter
+from string import Formatter
+from typing import Any, Literal, NamedTuple, overload
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, NonNegativeFloat, PositiveFloat, PositiveInt, PrivateAttr
+
+from .retry import RetryPolicy
 
 
 class DefaultDict(dict):
@@ -12,11 +16,194 @@ class DefaultDict(dict):
         return f"{{{key}}}"
 
 
-def flatten_matrix(matrix: dict[str, list[str]]) -> Generator[dict[str, str], Any, None]:
-    matrix_keys, matrix_values = zip(*matrix.items(), strict=True)
-    product_matrix = product(*matrix_values)
-    for values in product_matrix:
-        yield DefaultDict(zip(matrix_keys, values, strict=True))
+def format_number(value: float) -> str:
+    return f"{value:.12g}"
+
+
+class MatrixAxis(BaseModel, ABC):
+    """Values of a matrix key computed from their index instead of listed, so that an axis of any
+    length takes no memory."""
+
+    model_config = ConfigDict(extra="forbid")
+
+    @abstractmethod
+    def __len__(self) -> int: ...
+
+    @abstractmethod
+    def value(self, index: int) -> str: ...
+
+    def values(self) -> Iterator[str]:
+        return (self.value(index) for index in range(len(self)))
+
+    def __getitem__(self, index: int) -> str:
+        size = len(self)
+        if not -size <= index < size:
+            raise IndexError(f"Matrix axis index {index} out of range")
+        return self.value(index % size)
+
+
+class RangeAxis(MatrixAxis):
+    """Integers from `start` to `stop` (excluded), like `range(start, stop, step)`.
+
+    Example:
+    >>> axis = RangeAxis(range=(0, 1000))
+    >>> len(axis), axis[0], axis[-1]
+    (1000, '0', '999')
+    >>> list(RangeAxis(range=(10, 0, -4)).values())
+    ['10', '6', '2']
+    """
+
+    range: tuple[int, int] | tuple[int, int, int]
+
+    def model_post_init(self, __context: Any) -> None:
+        if len(self.range) == 3 and self.range[2] == 0:
+            raise ValueError("The step of a matrix range cannot be zero")
+
+    def __len__(self) -> int:
+        return len(range(*self.range))
+
+    def value(self, index: int) -> str:
+        return str(range(*self.range)[index])
+
+
+class LinspaceAxis(MatrixAxis):
+    """`num` evenly spaced numbers from `start` to `stop` (included), like `numpy.linspace`.
+
+    Example:
+    >>> list(LinspaceAxis(linspace=(0, 1, 5)).values())
+    ['0', '0.25', '0.5', '0.75', '1']
+    """
+
+    linspace: tuple[float, float, PositiveInt]
+
+    def __len__(self) -> int:
+        return self.linspace[2]
+
+    def value(self, index: int) -> str:
+        start, stop, num = self.linspace
+        if num == 1:
+            return format_number(start)
+        return format_number(start + (stop - start) * index / (num - 1))
+
+
+class LogspaceAxis(MatrixAxis):
+    """`num` numbers from `base ** start` to `base ** stop` (included), evenly spaced on a log
+    scale, like `numpy.logspace`.
+
+    Example:
+    >>> list(LogspaceAxis(logspace=(-5, -1, 5)).values())
+    ['1e-05', '0.0001', '0.001', '0.01', '0.1']
+    >>> list(LogspaceAxis(logspace=(0, 3, 4), base=2).values())
+    ['1', '2', '4', '8']
+    """
+
+    logspace: tuple[float, float, PositiveInt]
+    base: float = 10
+
+    def __len__(self) -> int:
+        return self.logspace[2]
+
+    def value(self, index: int) -> str:
+        start, stop, num = self.logspace
+        exponent = start if num == 1 else start + (stop - start) * index / (num - 1)
+        return format_number(self.base**exponent)
+
+
+# Values of a matrix key, listed or generated
+MatrixValues = list[str] | RangeAxis | LinspaceAxis | LogspaceAxis
+
+
+class MatrixCombinations(Sequence[DefaultDict]):
+    """Combinations of a matrix in the order of `itertools.product`, computed from their index.
+
+    Example:
+    >>> combinations = MatrixCombinations({"a": ["1", "2"], "b": RangeAxis(range=(0, 3))})
+    >>> len(combinations)
+    6
+    >>> combinations[4]
+    {'a': '2', 'b': '1'}
+    """
+
+    def __init__(self, matrix: Mapping[str, MatrixValues]):
+        # Key, value getter, stride and size of each axis; the last axis changes the fastest
+        self.axes: list[tuple[str, Callable[[int], str], int, int]] = []
+        stride = 1
+        for key, axis in reversed(list(matrix.items())):
+            value = axis.value if isinstance(axis, MatrixAxis) else axis.__getitem__
+            self.axes.append((key, value, stride, len(axis)))
+            stride *= len(axis)
+        self.axes.reverse()
+        self.size = stride
+
+    def __len__(self) -> int:
+        return self.size
+
+    @overload
+    def __getitem__(self, index: int) -> DefaultDict: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[DefaultDict]: ...
+
+    def __getitem__(self, index: int | slice) -> DefaultDict | list[DefaultDict]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.size))]
+        if not 0 <= index < self.size:
+            raise IndexError(f"Matrix combination {index} out of range")
+        return DefaultDict({key: value(index // stride % size) for key, value, stride, size in self.axes})
+
+
+def flatten_matrix(matrix: Mapping[str, MatrixValues]) -> Generator[dict[str, str], Any, None]:
+    if not matrix:
+        raise ValueError("Matrix must have at least one key")
+    yield from MatrixCombinations(matrix)
+
+
+class CompiledTemplate:
+    """A `str.format_map` template parsed once into its literal text and fields.
+
+    The fields become `%s` in a pattern, so that rendering fills them with their values in a single
+    `%` formatting, which gives the same string as `format_map` without parsing the template again.
+    Fields with a conversion, a format spec or an attribute are rendered with `format_map` on their own.
+
+    Example:
+    >>> template = CompiledTemplate("train --seed {seed:>3} --lr {lr} --out {{out}} 100%")
+    >>> template.pattern
+    'train --seed %s --lr %s --out {out} 100%%'
+    >>> template.render(DefaultDict(seed="7", lr="0.1"))
+    'train --seed   7 --lr 0.1 --out {out} 100%'
+    >>> template.render(DefaultDict(seed="7"))
+    'train --seed   7 --lr {lr} --out {out} 100%'
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.pattern = ""
+        # Key of each field if it is a plain name, and the field to format on its own otherwise
+        self.fields: list[tuple[str | None, str]] = []
+        for literal, field_name, format_spec, conversion in Formatter().parse(source):
+            self.pattern += literal.replace("%", "%%")
+            if field_name is None:
+                continue
+            self.pattern += "%s"
+            field = field_name + (f"!{conversion}" if conversion else "") + (f":{format_spec}" if format_spec else "")
+            key = field_name if field_name.isidentifier() and not format_spec and conversion is None else None
+            self.fields.append((key, f"{{{field}}}"))
+        keys = [key for key, _ in self.fields]
+        self.getter = itemgetter(*keys) if keys and None not in keys else None
+
+    def __repr__(self) -> str:
+        return f"CompiledTemplate({self.source!r})"
+
+    def render(self, values: Mapping[str, Any]) -> str:
+        if self.getter is None:
+            field_values = tuple(
+                values[key] if key is not None else field.format_map(values) for key, field in self.fields
+            )
+        elif len(self.fields) == 1:
+            field_values = (self.getter(values),)
+        else:
+            field_values = self.getter(values)
+        return self.pattern % field_values
 
 
 class TaskConfig(BaseModel):
@@ -31,8 +218,8 @@ class TaskConfig(BaseModel):
     'echo task1'
     >>> config.get_command()
     'echo {task}'
-    >>> config.format({"task": "task1"}, inplace=True)
-    TaskConfig(command='echo', matrix=None, args=['task1'], deps=[])
+    >>> config.format({"task": "task1"}, inplace=True).args
+    ['task1']
     >>> config.get_command()
     'echo task1'
     >>> config = TaskConfig(command="echo", args=["{task}"], matrix={"task": ["task1", "task2"]})
@@ -43,9 +230,17 @@ class TaskConfig(BaseModel):
     """
 
     command: str
-    matrix: dict[str, list[str]] | None = None
+    matrix: dict[str, MatrixValues] | None = None
     args: list[str] = []
     deps: list[str] = []
+    group: str | None = None
+    inputs: list[str] = []
+    outputs: list[str] = []
+    retry: RetryPolicy | None = None
+    timeout: PositiveFloat | None = None
+    kill_grace: NonNegativeFloat = 5.0
+    # Number of matrix combinations run back to back on one resource acquisition
+    chunk_size: PositiveInt | None = None
 
     def get_command(self) -> str:
         assert self.matrix is None, "Matrix is not None, you must run wrap_matrix first"
@@ -54,16 +249,19 @@ class TaskConfig(BaseModel):
     def format(
         self, template_values: dict[str, str], *, format_deps: bool = False, inplace: bool = False
     ) -> TaskConfig:
+        fields = {
+            "command": self.command.format_map(template_values),
+            "args": [arg.format_map(template_values) for arg in self.args],
+            "inputs": [pattern.format_map(template_values) for pattern in self.inputs],
+            "outputs": [pattern.format_map(template_values) for pattern in self.outputs],
+            "deps": [dep.format_map(template_values) if format_deps else dep for dep in self.deps],
+        }
         if inplace:
-            task = self
-        else:
-            task = self.model_copy(deep=True)
-
-        task.command = task.command.format_map(template_values)
-        task.args = [arg.format_map(template_values) for arg in task.args]
-        if format_deps:
-            task.deps = [dep.format_map(template_values) for dep in task.deps]
-        return task
+            for field, value in fields.items():
+                setattr(self, field, value)
+            return self
+        # The other fields are not modified once loaded, so the copy can share them instead of a deep copy
+        return self.model_copy(update=fields)
 
     def wrap_matrix(self, name: str) -> dict[str, TaskConfig]:
         assert self.matrix is not None, "You cannot run wrap_matrix without matrix"
@@ -78,6 +276,139 @@ class TaskConfig(BaseModel):
         return tasks
 
 
+class TaskSpec(NamedTuple):
+    """Task expanded from a `TaskConfig`, with its command and files formatted."""
+
+    command: str
+    deps: list[str]
+    group: str | None
+    inputs: list[str]
+    outputs: list[str]
+    retry: RetryPolicy | None
+    timeout: float | None
+    kill_grace: float
+    # Name of the config task this task was expanded from; tasks sharing it are siblings in a sweep
+    origin: str
+    # Name of the chunk running this task, set when it was expanded from a matrix with `chunk_size`
+    chunk: str | None
+
+    def get_command(self) -> str:
+        return self.command
+
+
+class MatrixTasks(Mapping[str, TaskSpec]):
+    """Tasks of a workflow expanded from its matrices, rendered each time they are looked up.
+
+    Task `{i}_{name}` is task `name` formatted with combination `i` of the workflow matrix, and
+    tasks with a matrix of their own are named like in `TaskConfig.wrap_matrix`. Only the names of
+    one combination of the workflow matrix are kept, so that expanding a large sweep costs the
+    memory of the tasks that are looked up rather than of every combination. The first combination
+    of each task is rendered up front, so that errors in its templates are raised early.
+
+    The templates of each config task are compiled once, and a task is rendered in a single pass
+    with the values of both matrices.
+
+    Example:
+    >>> tasks = MatrixTasks(
+    ...     {"train": TaskConfig(command="train --seed {seed} --lr {lr}", matrix={"lr": ["0.1", "0.01"]})},
+    ...     {"seed": RangeAxis(range=(0, 1000))},
+    ... )
+    >>> len(tasks)
+    2000
+    >>> list(tasks)[:3]
+    ['0_train', '0_train_1', '1_train']
+    >>> tasks["999_train_1"].get_command()
+    'train --seed 999 --lr 0.01 '
+    >>> "1000_train" in tasks
+    False
+    """
+
+    def __init__(self, templates: Mapping[str, TaskConfig], matrix: Mapping[str, MatrixValues] | None):
+        self.templates = dict(templates)
+        self.matrix = matrix
+        self.combinations = None if matrix is None else MatrixCombinations(matrix)
+        self.size = 1 if self.combinations is None else len(self.combinations)
+        # Task names within one combination of the workflow matrix, with their config task, the
+        # combination of its own matrix and their position among the tasks expanded from it
+        self.names: dict[str, tuple[str, int | None, int]] = {}
+        # Combinations of the matrix of each config task that has one
+        self.task_combinations: dict[str, MatrixCombinations] = {}
+        # Templates of the command, inputs and outputs of each config task, parsed once
+        self.compiled: dict[str, tuple[CompiledTemplate, list[CompiledTemplate], list[CompiledTemplate]]] = {}
+        for task_name, task_config in self.templates.items():
+            self.compiled[task_name] = (
+                CompiledTemplate(f"{task_config.command} {' '.join(task_config.args)}"),
+                [CompiledTemplate(pattern) for pattern in task_config.inputs],
+                [CompiledTemplate(pattern) for pattern in task_config.outputs],
+            )
+            if task_config.matrix is None:
+                self.names[task_name] = (task_name, None, 0)
+                continue
+            self.task_combinations[task_name] = MatrixCombinations(task_config.matrix)
+            wrapped: dict[str, int] = {}
+            for i, template_values in enumerate(self.task_combinations[task_name]):
+                wrapped_name = task_name.format(**template_values)
+                if wrapped_name in wrapped:
+                    wrapped_name = f"{wrapped_name}_{i}"
+                wrapped[wrapped_name] = i
+            for position, (wrapped_name, i) in enumerate(wrapped.items()):
+                self.names[wrapped_name] = (task_name, i, position)
+        if self.size > 0:
+            for task_name in self.names:
+                self[f"0_{task_name}"]
+
+    def locate(self, name: str) -> tuple[int, str]:
+        """Combination of the workflow matrix and name within it of the task `name`."""
+        prefix, _, task_name = name.partition("_")
+        if not prefix.isdecimal() or str(index := int(prefix)) != prefix:
+            raise KeyError(name)
+        if index >= self.size or task_name not in self.names:
+            raise KeyError(name)
+        return index, task_name
+
+    def __getitem__(self, name: str) -> TaskSpec:
+        index, wrapped_name = self.locate(name)
+        task_name, combination, position = self.names[wrapped_name]
+        task_config = self.templates[task_name]
+        command, inputs, outputs = self.compiled[task_name]
+        template_values = {} if self.combinations is None else self.combinations[index]
+        chunk = None
+        if combination is not None:
+            # Values of the task matrix take precedence over the ones of the workflow matrix
+            template_values.update(self.task_combinations[task_name][combination])
+            if task_config.chunk_size is not None:
+                chunk = f"{index}_{task_name}_chunk_{position // task_config.chunk_size}"
+        return TaskSpec(
+            command=command.render(template_values),
+            deps=[f"{index}_{dep}" for dep in task_config.deps],
+            group=task_config.group,
+            inputs=[pattern.render(template_values) for pattern in inputs],
+            outputs=[pattern.render(template_values) for pattern in outputs],
+            retry=task_config.retry,
+            timeout=task_config.timeout,
+            kill_grace=task_config.kill_grace,
+            origin=task_name,
+            chunk=chunk,
+        )
+
+    def __contains__(self, name: object) -> bool:
+        if not isinstance(name, str):
+            return False
+        try:
+            self.locate(name)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self.size):
+            for task_name in self.names:
+                yield f"{index}_{task_name}"
+
+    def __len__(self) -> int:
+        return self.size * len(self.names)
+
+
 class WorkflowConfig(BaseModel):
     """
     Workflow config.
@@ -104,40 +435,85 @@ class WorkflowConfig(BaseModel):
     ... )
     >>> sorted(config.to_nodes().items())
     [('0_task1', []), ('0_task2', ['0_task1']), ('1_task1', []), ('1_task2', ['1_task1'])]
+    >>> config = WorkflowConfig(
+    ...     name="test",
+    ...     concurrency={"db": 1},
+    ...     tasks={"task1": TaskConfig(command="echo 'task1'", group="db")},
+    ... )
+    >>> config.expanded_tasks["0_task1"].group
+    'db'
     """
 
     name: str
     tasks: dict[str, TaskConfig]
-    matrix: dict[str, list[str]] | None = None
+    matrix: dict[str, MatrixValues] | None = None
     resources: Literal["gpus"] | list[str] | None = None
+    concurrency: dict[str, PositiveInt] = {}
+    # Modules imported by a fork server launching the `python -m` commands, which is off if None
+    preload: list[str] | None = None
+    # Most tasks of the run submitted at once, the smallest of the workflows run together applies
+    max_in_flight: PositiveInt | None = None
+    _expanded_tasks: MatrixTasks = PrivateAttr()
 
     def model_post_init(self, __context: Any) -> None:
-        if self.matrix is None:
-            flattened_matrix = [{}]
-        else:
-            flattened_matrix = flatten_matrix(self.matrix)
+        for task_name, task_config in self.tasks.items():
+            if task_config.group is not None and task_config.group not in self.concurrency:
+                raise ValueError(f"Task `{task_name}` uses undefined concurrency group `{task_config.group}`")
 
-        tasks: dict[str, TaskConfig] = {}
-        for i, template_values in enumerate(flattened_matrix):
-            for task_name, task_config in self.tasks.items():
-                if task_config.matrix is not None:
-                    wrapped_tasks = task_config.wrap_matrix(task_name)
-                    for wrapped_name, wrapped_task in wrapped_tasks.items():
-                        wrapped_task_name = f"{i}_{wrapped_name}"
-                        task = wrapped_task.format(template_values, inplace=False)
-                        task.deps = [f"{i}_{dep}" for dep in task.deps]
-                        tasks[wrapped_task_name] = task
-                else:
-                    task_name = f"{i}_{task_name}"
-                    task = task_config.format(template_values, inplace=False)
-                    task.deps = [f"{i}_{dep}" for dep in task.deps]
-                    tasks[task_name] = task
-
-        self.tasks = tasks
+        self._expanded_tasks = MatrixTasks(self.tasks, self.matrix)
+
+    @property
+    def expanded_tasks(self) -> MatrixTasks:
+        """Tasks expanded from `tasks` and the matrices, named like `0_task`."""
+        return self._expanded_tasks
 
     def to_nodes(self) -> dict[str, list[str]]:
         nodes: dict[str, list[str]] = {}
-        for task_name, task_config in self.tasks.items():
+        for task_name, task_config in self.expanded_tasks.items():
             nodes[task_name] = task_config.deps
 
         return nodes
+
+
+def namespace_tasks(configs: Sequence[WorkflowConfig]) -> dict[str, tuple[WorkflowConfig, str]]:
+    """Name the tasks of several workflows sharing one executor.
+
+    A single workflow keeps its task names, otherwise they are prefixed with their workflow name.
+    Each name maps to the workflow and the name of the task within it.
+
+    Example:
+    >>> first = WorkflowConfig(name="first", tasks={"a": TaskConfig(command="echo")})
+    >>> second = WorkflowConfig(name="second", tasks={"a": TaskConfig(command="echo")})
+    >>> list(namespace_tasks([first]))
+    ['0_a']
+    >>> list(namespace_tasks([first, second]))
+    ['first/0_a', 'second/0_a']
+    """
+    names = [config.name for config in configs]
+    for name in names:
+        if names.count(name) > 1:
+            raise ValueError(f"Workflow `{name}` is given more than once")
+    tasks: dict[str, tuple[WorkflowConfig, str]] = {}
+    for config in configs:
+        prefix = f"{config.name}/" if len(configs) > 1 else ""
+        for task_name in config.expanded_tasks:
+            tasks[f"{prefix}{task_name}"] = (config, task_name)
+    return tasks
+
+
+def merge_nodes(configs: Sequence[WorkflowConfig]) -> dict[str, list[str]]:
+    """Dependencies of the tasks of several workflows, named like in `namespace_tasks`.
+
+    Example:
+    >>> first = WorkflowConfig(name="first", tasks={"a": TaskConfig(command="echo")})
+    >>> second = WorkflowConfig(
+    ...     name="second", tasks={"a": TaskConfig(command="echo"), "b": TaskConfig(command="echo", deps=["a"])}
+    ... )
+    >>> merge_nodes([first, second])
+    {'first/0_a': [], 'second/0_a': [], 'second/0_b': ['second/0_a']}
+    """
+    nodes: dict[str, list[str]] = {}
+    for node, (config, task_name) in namespace_tasks(configs).items():
+        prefix = node.removesuffix(task_name)
+        nodes[node] = [f"{prefix}{dep}" for dep in config.expanded_tasks[task_name].deps]
+    return nodes
@@ -1,17 +1,59 @@
 from __future__ import annotations
 
 import asyncio
+import concurrent.futures
 import datetime
-from collections.abc import Callable
+import functools
+import heapq
+import itertools
+import threading
+from collections import Counter, defaultdict
+from collections.abc import Callable, Hashable, Sequence
+from statistics import median
+from typing import Any, Literal
 
 import humanize
 from loguru import logger
 from pydantic import BaseModel
 
-from .config import WorkflowConfig
-from .resource_pool import GPUResourcePool, ResourcePool
-from .task import Task
-from .utils import create_gpu_task, create_task, layer_nodes
+from .backend import ExecutionBackends, current_backends
+from .config import WorkflowConfig, namespace_tasks
+from .fingerprint import FingerprintIndex
+from .history import DurationHistory
+from .journal import RunJournal, TaskStatus
+from .remote import Coordinator, create_remote_task
+from .resource_pool import ConcurrencyGroup, GPUResourcePool, ResourcePool, UnlimitedPool
+from .speculation import MIN_SIBLING_SAMPLES, SpeculativeRun
+from .task import Task, TaskTimeoutError
+from .utils import (
+    create_chunk_task,
+    create_gpu_task,
+    create_task,
+    critical_path_priorities,
+    hash_command,
+    layer_nodes,
+)
+
+SchedulerMode = Literal["dependency", "layered"]
+FailureMode = Literal["keep-going", "fail-fast"]
+
+# Most command tasks submitted at once when neither the caller nor the workflows set a limit
+DEFAULT_MAX_IN_FLIGHT = 64
+
+
+def task_name(entry: Task[..., None] | str) -> str:
+    return entry if isinstance(entry, str) else entry.name
+
+
+def gate_key(task: Task[..., None]) -> Hashable:
+    """Tasks with the same key compete for the same resources, tasks without one never wait."""
+    pool = task.resource_pool
+    if not isinstance(pool, ResourcePool) or isinstance(pool, UnlimitedPool):
+        pool = None
+    group = task.concurrency_group if isinstance(task.concurrency_group, ConcurrencyGroup) else None
+    if pool is None and group is None:
+        return None
+    return (id(pool), id(group))
 
 
 class ExecutorState(BaseModel):
@@ -19,10 +61,11 @@ class ExecutorState(BaseModel):
     running_task_count: int = 0
     completed_task_count: int = 0
     failed_task_count: int = 0
+    skipped_task_count: int = 0
 
     @property
     def remaining_task_count(self) -> int:
-        return self.total_task_count - self.completed_task_count - self.failed_task_count
+        return self.total_task_count - self.completed_task_count - self.failed_task_count - self.skipped_task_count
 
     @property
     def progress(self) -> str:
@@ -30,63 +73,723 @@ class ExecutorState(BaseModel):
 
 
 class Executor:
-    def __init__(self, tasks: list[list[Task[..., None]]]):
-        self.tasks = tasks
+    """Execute the tasks of a workflow.
+
+    With the `dependency` scheduler, a task is submitted as soon as all of its own dependencies
+    have finished. The `layered` scheduler runs one layer at a time and waits for the whole layer
+    before starting the next one. When no `dependencies` are given, the layers are the only
+    ordering information available, so the `layered` scheduler is used.
+
+    With a `history`, tasks waiting for resources are served by their critical path: the longest
+    remaining path to a sink, weighted by the durations measured in previous runs.
+
+    With a `journal`, the start and finish of every task are recorded on disk. When `resume` is
+    set, tasks that succeeded since the last fresh run in that journal are skipped.
+
+    With `fingerprints`, tasks that declare `inputs` or `outputs` are skipped when their outputs
+    exist and their inputs did not change since their last successful run.
+
+    When a task fails, its transitive dependents are skipped without being submitted. With the
+    `keep-going` failure mode, independent tasks keep running; with `fail-fast`, the tasks in flight
+    are cancelled and nothing else is submitted. Without `dependencies`, every later layer depends
+    on the failed one, so the run stops after the current layer in both modes.
+
+    With `speculate`, tasks expanded from the same config task are expected to take similar time.
+    A task running longer than `speculate` times the median duration of its finished `siblings` gets
+    a duplicate on another free resource, and whichever finishes first wins.
+
+    Python tasks submitted while the executor runs share its execution backends, which own the
+    process pool used by tasks with the `process` backend and the warm workers used by tasks with the
+    `warm` backend, which are recycled after `warm_max_tasks` tasks or `warm_max_rss` bytes of peak
+    RSS. They are shut down after the run.
+
+    With the `dependency` scheduler, `add_task` inserts tasks into the graph while it runs. The run
+    ends once no task is left, unless `keep_open` is set, in which case it waits for more tasks
+    until `close` is called.
+
+    The layers may name their tasks instead, which `task_factory` creates once they are ready to run
+    and which are dropped once they are done; their `config_hashes` are then needed for the history.
+    Ready tasks sharing a resource pool and concurrency group are submitted one at a time, each once
+    the previous one has acquired its resource, so that they do not all wait in the pool. At most
+    `max_in_flight` tasks are submitted at once if it is set.
+    """
+
+    speculation_interval: float = 1.0
+
+    def __init__(
+        self,
+        tasks: Sequence[Sequence[Task[..., None] | str]],
+        *,
+        dependencies: dict[str, list[str]] | None = None,
+        scheduler: SchedulerMode | None = None,
+        history: DurationHistory | None = None,
+        journal: RunJournal | None = None,
+        resume: bool = False,
+        fingerprints: FingerprintIndex | None = None,
+        process_workers: int | None = None,
+        warm_max_tasks: int | None = None,
+        warm_max_rss: int | None = None,
+        failure_mode: FailureMode = "keep-going",
+        siblings: dict[str, str] | None = None,
+        speculate: float | None = None,
+        keep_open: bool = False,
+        task_factory: Callable[[str], Task[..., None]] | None = None,
+        config_hashes: dict[str, str | None] | None = None,
+        max_in_flight: int | None = None,
+    ):
+        self.tasks = [list(layer) for layer in tasks]
+        self.dependencies = dict(dependencies) if dependencies is not None else None
+        self.history = history
+        self.journal = journal
+        self.resume = resume
+        self.fingerprints = fingerprints
+        self.backends = ExecutionBackends(
+            max_workers=process_workers, warm_max_tasks=warm_max_tasks, warm_max_rss=warm_max_rss
+        )
+        self.failure_mode = failure_mode
+        self.siblings = siblings or {}
+        self.sibling_counts = Counter(self.siblings.values())
+        self.sibling_durations: defaultdict[str, list[float]] = defaultdict(list)
+        self.speculate = speculate
+        self.speculative_runs: dict[str, SpeculativeRun[None]] = {}
+        self.held_resources: dict[str, Any] = {}
+        self.succeeded: set[tuple[str, str | None]] = set()
+        self.start_times: dict[str, float] = {}
+        self.running_tasks: set[asyncio.Future[None]] = set()
+        self.skipped: set[str] = set()
+        self.stopping = False
+        self.keep_open = keep_open
+        self.loop: asyncio.AbstractEventLoop | None = None
+        # Held while the run starts and ends, and while calls from other threads are handed over
+        self.loop_lock = threading.Lock()
+        self.finished = False
+        self.levels = {task_name(entry): i for i, layer in enumerate(tasks) for entry in layer}
+        self.task_map = {entry.name: entry for layer in tasks for entry in layer if not isinstance(entry, str)}
+        self.task_factory = task_factory
+        self.factory_names = {entry for layer in tasks for entry in layer if isinstance(entry, str)}
+        if self.factory_names and task_factory is None:
+            raise ValueError("Tasks given by name require a `task_factory`")
+        self.config_hashes = config_hashes or {}
+        self.priorities: dict[str, float] = {}
+        self.max_in_flight = max_in_flight
+        # Ready tasks by pool and concurrency group, highest priority first
+        self.ready: dict[Hashable, list[tuple[float, int, str, Callable[[bool], None]]]] = {}
+        self.ready_order = itertools.count()
+        # Submitted tasks that have not acquired their resource yet, with their pool and group
+        self.waiting: dict[str, Hashable] = {}
+        self.waiting_counts: Counter[Hashable] = Counter()
+        self.completions: dict[str, concurrent.futures.Future[None]] = {}
+        self.outcomes: dict[str, bool] = {}
+        self.in_degree: dict[str, int] | None = None
+        self.all_done: asyncio.Event | None = None
+        self.dependents: defaultdict[str, list[str]] = defaultdict(list)
+        for name, deps in (dependencies or {}).items():
+            for dep in deps:
+                self.dependents[dep].append(name)
+        if scheduler is None:
+            scheduler = "layered" if dependencies is None else "dependency"
+        if scheduler == "dependency":
+            if dependencies is None:
+                raise ValueError("The dependency scheduler requires `dependencies`")
+            for name, deps in dependencies.items():
+                for dep in deps:
+                    if dep not in dependencies:
+                        raise ValueError(f"Task `{name}` depends on unknown task `{dep}`")
+        self.scheduler = scheduler
         self.state = ExecutorState(total_task_count=sum(len(layer) for layer in tasks))
 
     @classmethod
     def from_configs(
         cls,
-        config: WorkflowConfig,
+        config: WorkflowConfig | Sequence[WorkflowConfig],
         update_hook: Callable[[str, bytes], None] | None = None,
+        *,
+        scheduler: SchedulerMode = "dependency",
+        history: DurationHistory | None = None,
+        journal: RunJournal | None = None,
+        resume: bool = False,
+        fingerprints: FingerprintIndex | None = None,
+        failure_mode: FailureMode = "keep-going",
+        speculate: float | None = None,
+        coordinator: Coordinator | None = None,
+        max_in_flight: int | None = None,
     ) -> Executor:
+        """Create an executor running the command tasks of `config`.
+
+        Several workflows can run in one executor, with their task names prefixed by their workflow
+        name. Workflows declaring the same resources share one pool, so that a resource freed by one
+        workflow can be used by another; concurrency groups stay private to each workflow.
+
+        Matrix tasks with a `chunk_size` run as chunks: one task per chunk, which acquires a resource
+        once and runs its members back to back.
+
+        Tasks are only created once they are ready to run, and at most `max_in_flight` of them run
+        at once. It defaults to the smallest `max_in_flight` of the workflows, or to
+        `DEFAULT_MAX_IN_FLIGHT`, so that tasks without resources do not all start together.
+
+        With a `coordinator`, the commands run on the workers connected to it instead of locally,
+        and `resources = "gpus"` selects a GPU on the worker through `CUDA_VISIBLE_DEVICES`. Chunks
+        are not used then, since every remote command is already dispatched on its own.
+        """
         logger.info("Creating GPU resource pool and parallel tasks")
-        layered_nodes = layer_nodes(config.to_nodes())
-        resources = config.resources
-        if resources == "gpus":
-            resource_pool = GPUResourcePool()
-            layered_tasks = [
-                [
-                    create_gpu_task(node, config.tasks[node].get_command(), pool=resource_pool, update_hook=update_hook)
-                    for node in nodes
-                ]
-                for nodes in layered_nodes
-            ]
-        else:
-            if resources is not None:
+        configs = [config] if isinstance(config, WorkflowConfig) else list(config)
+        if max_in_flight is None:
+            limits = [workflow_config.max_in_flight for workflow_config in configs if workflow_config.max_in_flight]
+            max_in_flight = min(limits, default=DEFAULT_MAX_IN_FLIGHT)
+        task_configs = namespace_tasks(configs)
+        units: dict[str, str] = {}
+        chunks: defaultdict[str, list[str]] = defaultdict(list)
+        deps: dict[str, list[str]] = {}
+        siblings: dict[str, str] = {}
+        config_hashes: dict[str, str | None] = {}
+        chunk_commands: defaultdict[str, list[str]] = defaultdict(list)
+        # Each task config is formatted once here, and once more when its task is created
+        for node, (workflow_config, task_name) in task_configs.items():
+            task_config = workflow_config.expanded_tasks[task_name]
+            prefix = node.removesuffix(task_name)
+            if task_config.chunk is not None and coordinator is None:
+                units[node] = prefix + task_config.chunk
+                chunks[units[node]].append(node)
+                chunk_commands[units[node]].append(task_config.get_command())
+            else:
+                units[node] = node
+                config_hashes[node] = hash_command(task_config.get_command())
+            deps[node] = [prefix + dep for dep in task_config.deps]
+            siblings[units[node]] = prefix + task_config.origin
+        for unit, commands in chunk_commands.items():
+            config_hashes[unit] = hash_command("\n".join(commands))
+        node_dependencies: dict[str, list[str]] = {}
+        for node, node_deps in deps.items():
+            unit_deps = node_dependencies.setdefault(units[node], [])
+            unit_deps.extend(units[dep] for dep in node_deps if units[dep] not in unit_deps)
+        layered_nodes = layer_nodes(node_dependencies)
+        groups = {
+            id(workflow_config): {
+                name: ConcurrencyGroup(name, limit) for name, limit in workflow_config.concurrency.items()
+            }
+            for workflow_config in configs
+        }
+        pools: dict[str | tuple[str, ...], ResourcePool[Any]] = {}
+        # Workflows listing the same resources in any order share one pool, and two pools must not
+        # hold the same resource, which could then be handed to two tasks at once
+        resource_keys = {
+            tuple(sorted(set(workflow_config.resources)))
+            for workflow_config in configs
+            if isinstance(workflow_config.resources, list)
+        }
+        for key, other in itertools.combinations(sorted(resource_keys), 2):
+            if shared := set(key) & set(other):
+                raise ValueError(
+                    f"Resources {list(key)} and {list(other)} share {sorted(shared)}, "
+                    "workflows sharing resources must list the same ones"
+                )
+
+        def get_pool(resources: Literal["gpus"] | list[str] | None) -> ResourcePool[Any] | None:
+            if resources == "gpus":
+                if "gpus" not in pools:
+                    pools["gpus"] = GPUResourcePool()
+                return pools["gpus"]
+            if resources is None:
+                return None
+            key = tuple(sorted(set(resources)))
+            if key not in pools:
                 logger.warning("Use of custom resources is experimental and may not work as expected")
-                resource_pool = ResourcePool(resources)
+                pools[key] = ResourcePool(list(dict.fromkeys(resources)))
+            return pools[key]
+
+        def get_group(workflow_config: WorkflowConfig, name: str | None) -> ConcurrencyGroup | None:
+            return None if name is None else groups[id(workflow_config)].get(name)
+
+        def create_chunk(unit: str) -> Task[[], None]:
+            workflow_config = task_configs[chunks[unit][0]][0]
+            members = {node: workflow_config.expanded_tasks[task_configs[node][1]] for node in chunks[unit]}
+            task_config = next(iter(members.values()))
+            return create_chunk_task(
+                unit,
+                {node: member.get_command() for node, member in members.items()},
+                pool=get_pool(workflow_config.resources),
+                gpus=workflow_config.resources == "gpus",
+                update_hook=update_hook,
+                group=get_group(workflow_config, task_config.group),
+                inputs=[pattern for member in members.values() for pattern in member.inputs],
+                outputs=[pattern for member in members.values() for pattern in member.outputs],
+                retry=task_config.retry,
+                timeout=task_config.timeout,
+                kill_grace=task_config.kill_grace,
+                preload=workflow_config.preload,
+                journal=journal,
+                # Chunks are created once the run started, after the journal was loaded
+                previous=executor.succeeded,
+            )
+
+        def create_node_task(node: str) -> Task[[], None]:
+            if node in chunks:
+                return create_chunk(node)
+            workflow_config, task_name = task_configs[node]
+            task_config = workflow_config.expanded_tasks[task_name]
+            resources = workflow_config.resources
+            if coordinator is not None:
+                create = functools.partial(create_remote_task, coordinator=coordinator, gpus=resources == "gpus")
+            elif resources == "gpus":
+                pool = get_pool(resources)
+                assert pool is not None, "GPU workflows always have a pool"
+                create = functools.partial(create_gpu_task, pool=pool, preload=workflow_config.preload)
             else:
-                resource_pool = None
-            layered_tasks = [
-                [
-                    create_task(node, config.tasks[node].get_command(), pool=resource_pool, update_hook=update_hook)
-                    for node in nodes
-                ]
-                for nodes in layered_nodes
-            ]
-
-        return cls(layered_tasks)
-
-    async def run_async(self):
-        for tasks in self.tasks:
-            start_time = asyncio.get_event_loop().time()
-            logger.info(f"Starting execution of [blue]{len(tasks)} tasks[/blue]")
-            running_tasks = [task.submit() for task in tasks]
-            self.state.running_task_count = len(running_tasks)
-            while len(running_tasks) > 0:
-                await asyncio.sleep(0.1)
-                completed_tasks = [task for task in running_tasks if task.done()]
-                if not completed_tasks:
+                create = functools.partial(create_task, pool=get_pool(resources), preload=workflow_config.preload)
+            return create(
+                node,
+                task_config.get_command(),
+                update_hook=update_hook,
+                group=get_group(workflow_config, task_config.group),
+                inputs=task_config.inputs,
+                outputs=task_config.outputs,
+                retry=task_config.retry,
+                timeout=task_config.timeout,
+                kill_grace=task_config.kill_grace,
+            )
+
+        executor = cls(
+            layered_nodes,
+            task_factory=create_node_task,
+            config_hashes=config_hashes,
+            max_in_flight=max_in_flight,
+            dependencies=node_dependencies,
+            scheduler=scheduler,
+            history=history,
+            journal=journal,
+            resume=resume,
+            fingerprints=fingerprints,
+            failure_mode=failure_mode,
+            siblings=siblings,
+            speculate=speculate,
+        )
+        return executor
+
+    def get_task(self, name: str) -> Task[..., None]:
+        """Task named `name`, which the task factory creates if it is not there."""
+        task = self.task_map.get(name)
+        if task is None:
+            assert self.task_factory is not None
+            task = self.task_map[name] = self.task_factory(name)
+            if name in self.priorities:
+                task.priority = self.priorities[name]
+        return task
+
+    def config_hash(self, name: str) -> str | None:
+        if (task := self.task_map.get(name)) is not None:
+            return task.config_hash
+        return self.config_hashes.get(name)
+
+    def prioritize(self):
+        """Set the priority of every task to the length of its critical path."""
+        assert self.history is not None
+        if self.dependencies is not None:
+            node_dependencies = self.dependencies
+        else:
+            node_dependencies = {name: [] for name in self.levels}
+        durations = {name: self.history.get(name, self.config_hash(name)) for name in self.levels}
+        for name, priority in critical_path_priorities(node_dependencies, durations).items():
+            self.priorities[name] = priority
+            if (task := self.task_map.get(name)) is not None:
+                task.priority = priority
+
+    def skip_dependents(self, name: str):
+        """Mark every transitive dependent of `name` as skipped, so that it is never submitted."""
+        stack = list(self.dependents[name])
+        while stack:
+            dependent = stack.pop()
+            if dependent in self.skipped:
+                continue
+            logger.warning(f"Skipping task [blue]{dependent}[/blue], because [blue]{name}[/blue] failed")
+            self.skipped.add(dependent)
+            self.state.skipped_task_count += 1
+            if (completion := self.completions.get(dependent)) is not None:
+                completion.cancel()
+            stack.extend(self.dependents[dependent])
+
+    def stop(self):
+        """Stop submitting tasks and cancel the ones in flight."""
+        self.stopping = True
+        queued = [entry for queue in self.ready.values() for entry in queue]
+        self.ready.clear()
+        for *_, callback in queued:
+            callback(False)
+        for running_task in list(self.running_tasks):
+            running_task.cancel()
+        self._check_done()
+
+    def on_failure(self, name: str):
+        if self.failure_mode == "fail-fast":
+            logger.error(f"Stopping the run, because [blue]{name}[/blue] failed")
+            self.stop()
+        elif self.dependencies is None:
+            self.stopping = True
+        else:
+            self.skip_dependents(name)
+
+    def add_task(self, task: Task[..., None], deps: Sequence[str] = ()) -> concurrent.futures.Future[None]:
+        """Add a task running once the tasks named in `deps` succeed, before or during the run.
+
+        It can be called from the event loop of the run or from any other thread. The returned
+        future is resolved when the task succeeds, fails with its exception, and is cancelled if
+        the task is skipped; use `asyncio.wrap_future` to await it on the event loop.
+        """
+        return self._call_in_loop(functools.partial(self._add_task, task, list(deps)))
+
+    def close(self):
+        """Let a run started with `keep_open` end once its remaining tasks are done."""
+        self._call_in_loop(self._close)
+
+    def _call_in_loop[T](self, fn: Callable[[], T]) -> T:
+        """Call `fn` on the event loop of the run, waiting for it when called from another thread.
+
+        Outside of a run, `fn` is called right away while holding `loop_lock`, so that a run
+        starting or ending in another thread waits for it instead of changing the state under it.
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is not None and running_loop is self.loop:
+            return fn()
+        result: concurrent.futures.Future[T] = concurrent.futures.Future()
+
+        def call():
+            try:
+                result.set_result(fn())
+            except Exception as e:
+                result.set_exception(e)
+
+        with self.loop_lock:
+            if self.loop is None:
+                return fn()
+            # Scheduled before the lock is released, so that the run cannot end without calling it
+            self.loop.call_soon_threadsafe(call)
+        return result.result()
+
+    def _add_task(self, task: Task[..., None], deps: list[str]) -> concurrent.futures.Future[None]:
+        if self.finished:
+            raise RuntimeError(f"Cannot add task `{task.name}`, the run has finished")
+        if self.scheduler != "dependency":
+            raise ValueError("Tasks can only be added with the dependency scheduler")
+        assert self.dependencies is not None
+        if task.name in self.dependencies:
+            raise ValueError(f"Task `{task.name}` already exists")
+        for dep in deps:
+            if dep not in self.dependencies:
+                raise ValueError(f"Task `{task.name}` depends on unknown task `{dep}`")
+        level = max((self.levels[dep] + 1 for dep in deps), default=0)
+        if level == len(self.tasks):
+            self.tasks.append([])
+        self.tasks[level].append(task)
+        self.levels[task.name] = level
+        self.task_map[task.name] = task
+        self.dependencies[task.name] = deps
+        for dep in deps:
+            self.dependents[dep].append(task.name)
+        self.state.total_task_count += 1
+        completion: concurrent.futures.Future[None] = concurrent.futures.Future()
+        self.completions[task.name] = completion
+        if self.in_degree is None:
+            # Not running yet, the task is scheduled with the others when the run starts
+            return completion
+        if self.history is not None:
+            duration = self.history.get(task.name, task.config_hash)
+            task.priority = critical_path_priorities({task.name: []}, {task.name: duration})[task.name]
+        if self.stopping or any(dep in self.skipped or self.outcomes.get(dep) is False for dep in deps):
+            logger.warning(f"Skipping task [blue]{task.name}[/blue], because one of its dependencies failed")
+            self.skipped.add(task.name)
+            self.state.skipped_task_count += 1
+            completion.cancel()
+            return completion
+        self.in_degree[task.name] = sum(dep not in self.outcomes for dep in deps)
+        if self.in_degree[task.name] == 0:
+            self._enqueue_ready(task.name)
+        return completion
+
+    def _close(self):
+        self.keep_open = False
+        self._check_done()
+
+    def _check_done(self):
+        if (
+            self.all_done is not None
+            and self.state.running_task_count == 0
+            and not self.ready
+            and (self.stopping or not self.keep_open)
+        ):
+            self.all_done.set()
+
+    async def run_async(self) -> ExecutorState:
+        with self.loop_lock:
+            self.loop = asyncio.get_running_loop()
+        if self.history is not None:
+            self.prioritize()
+        if self.journal is not None:
+            if self.resume:
+                self.succeeded = RunJournal.load_succeeded(self.journal.path)
+            self.journal.start_run(resume=self.resume)
+        backends_token = current_backends.set(self.backends)
+        watcher = asyncio.create_task(self._watch_stragglers(self.speculate)) if self.speculate is not None else None
+        try:
+            if self.scheduler == "dependency":
+                await self._run_by_dependency()
+            else:
+                await self._run_by_layer()
+        finally:
+            # Whatever did not complete or fail was skipped, either by a failure or by stopping the run
+            self.state.skipped_task_count = (
+                self.state.total_task_count - self.state.completed_task_count - self.state.failed_task_count
+            )
+            if watcher is not None:
+                watcher.cancel()
+            current_backends.reset(backends_token)
+            self.backends.shutdown()
+            if self.history is not None:
+                self.history.save()
+            if self.journal is not None:
+                self.journal.close()
+            if self.fingerprints is not None:
+                self.fingerprints.save()
+            with self.loop_lock:
+                self.finished = True
+                self.loop = None
+            for completion in self.completions.values():
+                completion.cancel()
+            # Calls handed over from other threads before the run ended are made, and refused, now
+            await asyncio.sleep(0)
+        if self.state.failed_task_count > 0:
+            logger.error(
+                f"[red]{self.state.failed_task_count} tasks failed[/red], "
+                f"[blue]{self.state.skipped_task_count} tasks[/blue] were skipped"
+            )
+        return self.state
+
+    def _submit(self, task: Task[..., None], callback: Callable[[bool], None]) -> asyncio.Future[None]:
+        """Submit a task and call `callback` with whether it succeeded once it is done.
+
+        The state counters are kept up to date. Tasks cancelled by `stop` count as skipped, which
+        `run_async` accounts for at the end of the run.
+        """
+
+        loop = asyncio.get_running_loop()
+
+        def on_start(resource: Any):
+            self._stop_waiting(task.name)
+            self.start_times[task.name] = loop.time()
+            self.held_resources[task.name] = resource
+            if self.journal is not None:
+                self.journal.record("start", task.name, task.config_hash)
+
+        def on_done(running_task: asyncio.Future[None]):
+            self.running_tasks.discard(running_task)
+            self.state.running_task_count -= 1
+            self._stop_waiting(task.name)
+            if task.name in self.factory_names:
+                # The factory creates the task again if it is needed
+                self.task_map.pop(task.name, None)
+            if self.max_in_flight is not None:
+                for key in list(self.ready):
+                    self._drain(key)
+            status: TaskStatus
+            returncode: int | None
+            if running_task.cancelled():
+                status, returncode = "cancelled", None
+            elif isinstance(exception := running_task.exception(), TaskTimeoutError):
+                status, returncode = "timeout", None
+                logger.error(f"Task [blue]{task.name}[/blue] timed out: {exception}")
+            elif exception is not None:
+                status, returncode = "failed", getattr(exception, "returncode", None)
+                logger.error(f"Task [blue]{task.name}[/blue] failed: {exception}")
+            else:
+                status, returncode = "success", 0
+            if status == "success":
+                self.state.completed_task_count += 1
+            elif status != "cancelled" or not self.stopping:
+                self.state.failed_task_count += 1
+            self.speculative_runs.pop(task.name, None)
+            self.held_resources.pop(task.name, None)
+            start_time = self.start_times.pop(task.name, None)
+            if start_time is not None:
+                if status == "success" and task.name in self.siblings:
+                    self.sibling_durations[self.siblings[task.name]].append(loop.time() - start_time)
+                if self.history is not None and status == "success":
+                    self.history.record(task.name, task.config_hash, loop.time() - start_time)
+                if self.journal is not None:
+                    self.journal.record("finish", task.name, task.config_hash, status=status, returncode=returncode)
+            if status != "success" and not self.stopping:
+                self.on_failure(task.name)
+            callback(status == "success")
+
+        if (task.name, task.config_hash) in self.succeeded:
+            logger.info(f"Skipping task [blue]{task.name}[/blue], which succeeded in a previous run")
+            running_task = loop.create_future()
+            running_task.set_result(None)
+        else:
+            # The task given by the caller is left as is, so that it can be submitted again
+            started_task = task.model_copy(update={"on_start": on_start})
+            if self.fingerprints is not None and (task.inputs or task.outputs):
+                running_task = asyncio.create_task(self._run_incrementally(started_task, self.fingerprints))
+            else:
+                running_task = self._start(started_task)
+        self.running_tasks.add(running_task)
+        self.state.running_task_count += 1
+        running_task.add_done_callback(on_done)
+        return running_task
+
+    async def _run_incrementally(self, task: Task[..., None], fingerprints: FingerprintIndex):
+        signature = await asyncio.to_thread(fingerprints.signature, task.config_hash, task.inputs)
+        if fingerprints.is_up_to_date(task.name, signature, task.outputs):
+            logger.info(f"Skipping task [blue]{task.name}[/blue], which is up to date")
+            return
+        await self._start(task)
+        fingerprints.record_success(task.name, signature)
+
+    def _start(self, task: Task[..., None]) -> asyncio.Future[None]:
+        """Submit a task, as a speculative run when it has enough siblings to be compared with."""
+        origin = self.siblings.get(task.name)
+        if self.speculate is None or origin is None or self.sibling_counts[origin] <= MIN_SIBLING_SAMPLES:
+            return task.submit()
+        speculative_run = SpeculativeRun(task)
+        self.speculative_runs[task.name] = speculative_run
+        return asyncio.create_task(speculative_run.run())
+
+    async def _watch_stragglers(self, ratio: float):
+        """Duplicate running tasks that take more than `ratio` times the median duration of their siblings."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.speculation_interval)
+            for name, speculative_run in self.speculative_runs.items():
+                start_time = self.start_times.get(name)
+                durations = self.sibling_durations[self.siblings[name]]
+                if speculative_run.duplicated or start_time is None or len(durations) < MIN_SIBLING_SAMPLES:
+                    continue
+                elapsed = loop.time() - start_time
+                if elapsed <= ratio * median(durations):
+                    continue
+                avoid = {self.held_resources.get(name)}
+                pool = speculative_run.task.resource_pool
+                if pool is not None and not pool.has_free_resource(avoid):
                     continue
-                running_tasks = [task for task in running_tasks if not task.done()]
-                self.state.completed_task_count += len(completed_tasks)
-                self.state.running_task_count -= len(running_tasks)
+                logger.warning(
+                    f"Task [blue]{name}[/blue] has run for {elapsed:.1f} seconds, more than {ratio} times "
+                    f"the median of its siblings, launching a duplicate"
+                )
+                speculative_run.duplicate(avoid)
+
+    async def _run_by_layer(self):
+        for layer in self.tasks:
+            if self.stopping:
+                break
+            names = [name for entry in layer if (name := task_name(entry)) not in self.skipped]
+            start_time = asyncio.get_event_loop().time()
+            logger.info(f"Starting execution of [blue]{len(names)} tasks[/blue]")
+            await self._run_layer(names)
             end_time = asyncio.get_event_loop().time()
             logger.info(
                 f"Execution completed [blue]{self.state.progress}[/blue], actual time taken: "
                 f"[blue]{humanize.precisedelta(datetime.timedelta(seconds=end_time - start_time))}[/blue]"
             )
 
-    def run(self):
-        asyncio.run(self.run_async())
+    async def _run_layer(self, names: list[str]):
+        layer_done = asyncio.Event()
+        remaining_task_count = len(names)
+
+        def on_done(succeeded: bool):
+            nonlocal remaining_task_count
+            remaining_task_count -= 1
+            if remaining_task_count == 0:
+                layer_done.set()
+
+        if self.history is not None:
+            names = sorted(names, key=lambda name: self.priorities.get(name, 0), reverse=True)
+        for name in names:
+            if self.stopping:
+                remaining_task_count -= 1
+                continue
+            self._enqueue(name, on_done)
+        if remaining_task_count > 0:
+            await layer_done.wait()
+
+    def _enqueue(self, name: str, callback: Callable[[bool], None]):
+        """Create a ready task and queue it behind the tasks of its pool and group."""
+        task = self.get_task(name)
+        key = gate_key(task)
+        queue = self.ready.setdefault(key, [])
+        # Without a history, every task has the same priority and they are queued in order
+        priority = task.priority if self.history is not None else 0
+        heapq.heappush(queue, (-priority, next(self.ready_order), name, callback))
+        self._drain(key)
+
+    def _drain(self, key: Hashable):
+        """Submit queued tasks of `key` while none of them waits for a resource."""
+        queue = self.ready.get(key)
+        while queue and not self.waiting_counts[key]:
+            if self.max_in_flight is not None and self.state.running_task_count >= self.max_in_flight:
+                return
+            _, _, name, callback = heapq.heappop(queue)
+            if key is not None:
+                self.waiting[name] = key
+                self.waiting_counts[key] += 1
+            running_task = self._submit(self.get_task(name), callback)
+            if (completion := self.completions.get(name)) is not None:
+                running_task.add_done_callback(functools.partial(self._resolve_completion, completion))
+        if queue is not None and not queue:
+            del self.ready[key]
+
+    def _stop_waiting(self, name: str):
+        """Let the next task of the pool and group of `name` be submitted."""
+        key = self.waiting.pop(name, None)
+        if key is None:
+            return
+        self.waiting_counts[key] -= 1
+        self._drain(key)
+
+    def _enqueue_ready(self, name: str):
+        """Queue a task whose dependencies all succeeded."""
+        self._enqueue(name, functools.partial(self._on_dependency_done, name))
+
+    @staticmethod
+    def _resolve_completion(completion: concurrent.futures.Future[None], running_task: asyncio.Future[None]):
+        if running_task.cancelled():
+            completion.cancel()
+        elif (exception := running_task.exception()) is not None:
+            completion.set_exception(exception)
+        else:
+            completion.set_result(None)
+
+    def _on_dependency_done(self, name: str, succeeded: bool):
+        assert self.in_degree is not None
+        self.outcomes[name] = succeeded
+        if succeeded and not self.stopping:
+            for dependent in self.dependents[name]:
+                self.in_degree[dependent] -= 1
+                if self.in_degree[dependent] == 0 and dependent not in self.skipped:
+                    self._enqueue_ready(dependent)
+        self._check_done()
+
+    async def _run_by_dependency(self):
+        assert self.dependencies is not None
+        self.in_degree = {name: len(deps) for name, deps in self.dependencies.items()}
+        self.all_done = asyncio.Event()
+
+        start_time = asyncio.get_event_loop().time()
+        logger.info(f"Starting execution of [blue]{len(self.levels)} tasks[/blue]")
+
+        ready = [name for name, degree in self.in_degree.items() if degree == 0]
+        if self.history is not None:
+            ready.sort(key=lambda name: self.priorities.get(name, 0), reverse=True)
+        for name in ready:
+            if self.stopping:
+                break
+            self._enqueue_ready(name)
+        self._check_done()
+        await self.all_done.wait()
+        end_time = asyncio.get_event_loop().time()
+        logger.info(
+            f"Execution completed [blue]{self.state.progress}[/blue], actual time taken: "
+            f"[blue]{humanize.precisedelta(datetime.timedelta(seconds=end_time - start_time))}[/blue]"
+        )
+
+    def run(self) -> ExecutorState:
+        return asyncio.run(self.run_async())
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+
+from pydantic import BaseModel, Field
+
+
+class FingerprintIndex(BaseModel):
+    """Fingerprints of task input files, used to skip tasks whose inputs did not change.
+
+    A file is identified by its modification time and size. Its content hash is only computed
+    again when one of them changes, so checking a large number of unchanged files stays cheap.
+    A task is up to date when all of its outputs exist and the fingerprints of its inputs match
+    the ones of its last successful run.
+
+    Example:
+    >>> import tempfile
+    >>> root = Path(tempfile.mkdtemp())
+    >>> (root / "data.txt").write_text("data")
+    4
+    >>> index = FingerprintIndex()
+    >>> signature = index.signature("hash", [str(root / "*.txt")])
+    >>> index.is_up_to_date("task", signature, [])
+    False
+    >>> index.record_success("task", signature)
+    >>> index.is_up_to_date("task", index.signature("hash", [str(root / "*.txt")]), [])
+    True
+    >>> (root / "data.txt").write_text("new data")
+    8
+    >>> index.is_up_to_date("task", index.signature("hash", [str(root / "*.txt")]), [])
+    False
+    """
+
+    files: dict[str, tuple[int, int, str]] = {}
+    tasks: dict[str, str] = {}
+    path: Path | None = Field(default=None, exclude=True)
+
+    @classmethod
+    def load(cls, path: Path) -> FingerprintIndex:
+        if path.exists():
+            index = cls.model_validate_json(path.read_text())
+        else:
+            index = cls()
+        index.path = path
+        return index
+
+    def save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(self.model_dump_json())
+
+    @staticmethod
+    def expand(patterns: list[str]) -> list[Path]:
+        """Files matched by the glob patterns, which may be absolute."""
+        paths: set[Path] = set()
+        for pattern in patterns:
+            root = Path(Path(pattern).anchor or ".")
+            paths.update(path for path in root.glob(str(Path(pattern).relative_to(root))) if path.is_file())
+        return sorted(paths)
+
+    def file_digest(self, path: Path) -> str:
+        stat = path.stat()
+        cached = self.files.get(str(path))
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        with path.open("rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+        self.files[str(path)] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def signature(self, config_hash: str | None, inputs: list[str]) -> str:
+        """Hash of the task config and the content of every input file."""
+        signature = hashlib.sha256((config_hash or "").encode())
+        for path in self.expand(inputs):
+            signature.update(f"\0{path}\0{self.file_digest(path)}".encode())
+        return signature.hexdigest()
+
+    def is_up_to_date(self, name: str, signature: str, outputs: list[str]) -> bool:
+        if self.tasks.get(name) != signature:
+            return False
+        return all(self.expand([pattern]) for pattern in outputs)
+
+    def record_success(self, name: str, signature: str):
+        self.tasks[name] = signature
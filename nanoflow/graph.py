@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable, Generator, Iterator, Sequence
+from contextlib import contextmanager
+from typing import Any
+
+from .executor import Executor, ExecutorState
+from .task import Task, current_graph
+from .utils import layer_nodes
+
+
+class LazyResult:
+    """Future of a task submitted while a workflow graph is captured.
+
+    Passing it as an argument of another task makes that task depend on it. Awaiting it while
+    capturing returns the future itself, so that workflows written with `await task.submit()` can be
+    captured unchanged; its value is only known once the graph has run.
+    """
+
+    def __init__(self, node: str):
+        self.node = node
+        self.future: asyncio.Future[Any] | None = None
+
+    def __repr__(self) -> str:
+        return f"LazyResult({self.node!r})"
+
+    def __await__(self) -> Generator[Any, None, LazyResult]:
+        return self._capture().__await__()
+
+    async def _capture(self) -> LazyResult:
+        return self
+
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    def result(self) -> Any:
+        """Value returned by the task, once the graph has run."""
+        if self.future is None or not self.future.done():
+            raise asyncio.InvalidStateError(f"Task `{self.node}` has not run")
+        return self.future.result()
+
+
+def map_lazy(fn: Callable[[LazyResult], Any], value: Any) -> Any:
+    """Apply `fn` to the `LazyResult`s in `value`, looking into lists, tuples, dicts and sets.
+
+    Example:
+    >>> map_lazy(lambda result: result.node, {"x": [LazyResult("0_a"), 1], "y": (LazyResult("1_b"),)})
+    {'x': ['0_a', 1], 'y': ('1_b',)}
+    """
+    if isinstance(value, LazyResult):
+        return fn(value)
+    if isinstance(value, list | tuple | set | frozenset):
+        items = [map_lazy(fn, item) for item in value]
+        # Named tuples take their fields as arguments
+        return type(value)(*items) if hasattr(value, "_fields") else type(value)(items)
+    if isinstance(value, dict):
+        return type(value)((key, map_lazy(fn, item)) for key, item in value.items())
+    return value
+
+
+class CapturedTask(Task):
+    """Task recorded in a graph, with its arguments bound.
+
+    The `LazyResult` arguments, including those in containers, are replaced by the results of
+    their tasks when it is submitted.
+    """
+
+    args: tuple[Any, ...]
+    kwargs: dict[str, Any]
+    lazy_result: LazyResult
+
+    def submit(self, *args: Any, **kwargs: Any) -> asyncio.Task[Any]:
+        def resolve(value: Any) -> Any:
+            return map_lazy(LazyResult.result, value)
+
+        running = super().submit(
+            *(resolve(value) for value in self.args),
+            *args,
+            **{key: resolve(value) for key, value in self.kwargs.items()},
+            **kwargs,
+        )
+
+        def on_done(attempt: asyncio.Task[Any]):
+            # Speculative duplicates share the result of the task, which comes from the one that succeeded
+            if not attempt.cancelled() and attempt.exception() is None:
+                self.lazy_result.future = attempt
+
+        if self.lazy_result.future is None:
+            self.lazy_result.future = running
+        running.add_done_callback(on_done)
+        return running
+
+
+class WorkflowGraph:
+    """Tasks submitted by a workflow function, recorded instead of run.
+
+    Tasks are named after their submission order, like `0_load`, and depend on the tasks whose
+    `LazyResult` they take as arguments, directly or in lists, tuples, dicts and sets, or wait for
+    with `submit_after`. The graph then runs in an `Executor` with the dependency scheduler, so that
+    independent tasks run in parallel whatever the order of the submissions.
+
+    Example:
+    >>> from nanoflow.task import task
+    >>> @task
+    >>> def add(a: int, b: int) -> int:
+    >>>     return a + b
+    >>> graph = WorkflowGraph()
+    >>> with graph.capture():
+    >>>     total = add.submit(add.submit(1, 2), add.submit(3, 4))
+    >>> graph.dependencies
+    {'0_add': [], '1_add': [], '2_add': ['0_add', '1_add']}
+    >>> state = asyncio.run(graph.run())
+    >>> total.result()
+    10
+    """
+
+    def __init__(self):
+        self.tasks: dict[str, CapturedTask] = {}
+        self.dependencies: dict[str, list[str]] = {}
+
+    def add(
+        self, task: Task[..., Any], args: tuple[Any, ...], kwargs: dict[str, Any], after: Sequence[Any] = ()
+    ) -> LazyResult:
+        name = f"{len(self.tasks)}_{task.name}"
+        for upstream in after:
+            if not isinstance(upstream, LazyResult):
+                raise TypeError(f"Task `{task.name}` can only run after tasks of the graph, got {upstream!r}")
+        deps: list[str] = []
+
+        def add_dep(value: LazyResult):
+            if value.node not in self.tasks:
+                raise ValueError(f"Task `{task.name}` depends on `{value.node}`, which is not in this graph")
+            if value.node not in deps:
+                deps.append(value.node)
+
+        map_lazy(add_dep, (args, kwargs, after))
+        lazy_result = LazyResult(name)
+        fields = {field: getattr(task, field) for field in Task.model_fields}
+        fields.update(name=name, args=args, kwargs=kwargs, lazy_result=lazy_result)
+        self.tasks[name] = CapturedTask(**fields)
+        self.dependencies[name] = deps
+        return lazy_result
+
+    @contextmanager
+    def capture(self) -> Iterator[WorkflowGraph]:
+        """Record the tasks submitted in this context instead of running them."""
+        token = current_graph.set(self)
+        try:
+            yield self
+        finally:
+            current_graph.reset(token)
+
+    def executor(self, **options: Any) -> Executor:
+        """Executor running the graph, created with the given `Executor` options."""
+        layers = [[self.tasks[name] for name in layer] for layer in layer_nodes(self.dependencies)]
+        return Executor(layers, dependencies=self.dependencies, scheduler="dependency", **options)
+
+    async def run(self, **options: Any) -> ExecutorState:
+        return await self.executor(**options).run_async()
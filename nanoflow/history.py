@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from pydantic import BaseModel, Field
+
+
+class DurationHistory(BaseModel):
+    """Measured task durations from previous runs, stored per task name and config hash.
+
+    Example:
+    >>> history = DurationHistory()
+    >>> history.record("train", "abc", 10.0)
+    >>> history.get("train", "abc")
+    10.0
+    >>> history.record("train", "abc", 20.0)
+    >>> history.get("train", "abc")
+    15.0
+    >>> history.get("train", "def") is None
+    True
+    """
+
+    durations: dict[str, dict[str, float]] = {}
+    smoothing: float = 0.5
+    path: Path | None = Field(default=None, exclude=True)
+
+    @classmethod
+    def load(cls, path: Path) -> DurationHistory:
+        if path.exists():
+            history = cls.model_validate_json(path.read_text())
+        else:
+            history = cls()
+        history.path = path
+        return history
+
+    def save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(self.model_dump_json())
+
+    def get(self, name: str, config_hash: str | None) -> float | None:
+        return self.durations.get(name, {}).get(config_hash or "")
+
+    def record(self, name: str, config_hash: str | None, duration: float):
+        previous = self.get(name, config_hash)
+        if previous is not None:
+            duration = self.smoothing * previous + (1 - self.smoothing) * duration
+        self.durations.setdefault(name, {})[config_hash or ""] = duration
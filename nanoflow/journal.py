@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import IO, Any, Literal
+
+JournalEvent = Literal["run", "resume", "start", "finish"]
+TaskStatus = Literal["success", "failed", "timeout", "cancelled"]
+
+
+class RunJournal:
+    """Append-only journal of task starts and finishes, used to resume an interrupted run.
+
+    Each line is a JSON record keyed by task name and config hash. Records are buffered and written
+    with a single `fsync` at most every `flush_interval` seconds, or as soon as `max_buffer` records
+    are pending, so short tasks do not wait for the disk. A crash loses at most the last batch,
+    and the tasks in it are run again on resume.
+
+    Example:
+    >>> import tempfile
+    >>> path = Path(tempfile.mkdtemp()) / "run.jsonl"
+    >>> journal = RunJournal(path)
+    >>> journal.start_run()
+    >>> journal.record("finish", "a", "hash", status="success")
+    >>> journal.record("finish", "b", "hash", status="failed", returncode=1)
+    >>> journal.close()
+    >>> RunJournal.load_succeeded(path)
+    {('a', 'hash')}
+    """
+
+    def __init__(self, path: Path, *, flush_interval: float = 1.0, max_buffer: int = 1000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.buffer: list[str] = []
+        self.file: IO[str] | None = None
+        self.flush_handle: asyncio.TimerHandle | None = None
+
+    @staticmethod
+    def load_succeeded(path: Path) -> set[tuple[str, str | None]]:
+        """Tasks whose latest finish since the last fresh run was successful."""
+        succeeded: set[tuple[str, str | None]] = set()
+        if not path.exists():
+            return succeeded
+        with path.open() as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be cut short by a crash
+                    continue
+                if record["event"] == "run":
+                    succeeded.clear()
+                elif record["event"] == "finish":
+                    key = (record["task"], record["hash"])
+                    if record["status"] == "success":
+                        succeeded.add(key)
+                    else:
+                        succeeded.discard(key)
+        return succeeded
+
+    def start_run(self, *, resume: bool = False):
+        self.write({"event": "resume" if resume else "run"})
+        self.flush()
+
+    def record(
+        self,
+        event: JournalEvent,
+        name: str,
+        config_hash: str | None,
+        *,
+        status: TaskStatus | None = None,
+        **fields: Any,
+    ):
+        if status is not None:
+            fields["status"] = status
+        self.write({"event": event, "task": name, "hash": config_hash, **fields})
+
+    def write(self, record: dict[str, Any]):
+        self.buffer.append(json.dumps({"time": time.time(), **record}))
+        if len(self.buffer) >= self.max_buffer:
+            self.flush()
+        elif self.flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self.flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.buffer:
+            return
+        if self.file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = self.path.open("a")
+        self.file.write("\n".join(self.buffer) + "\n")
+        self.buffer.clear()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
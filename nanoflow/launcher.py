@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+import asyncio
+import importlib
+import json
+import os
+import runpy
+import selectors
+import shlex
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import traceback
+from collections.abc import Callable, Sequence
+from contextlib import suppress
+from pathlib import Path
+from typing import Any
+
+PYTHON_NAMES = frozenset({"python", "python3"})
+# Characters the shell would expand or interpret, in which case the command keeps running in a shell
+SHELL_CHARACTERS = frozenset("$`|&;<>()*?[~#\n")
+# Longest output line forwarded to the update hook, also the line limit of the remote protocol
+STREAM_LIMIT = 2**20
+# Size of the reads of the output of a command
+READ_SIZE = 2**16
+
+
+def parse_module_command(command: str) -> tuple[str, list[str]] | None:
+    """Split a `python -m module args...` command, or return None if it needs a shell.
+
+    Example:
+    >>> parse_module_command("python -m http.server 8000 --bind '127.0.0.1'")
+    ('http.server', ['8000', '--bind', '127.0.0.1'])
+    >>> parse_module_command("python -m train > log.txt") is None
+    True
+    >>> parse_module_command("python train.py") is None
+    True
+    """
+    if SHELL_CHARACTERS.intersection(command):
+        return None
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return None
+    if len(argv) < 3 or argv[1] != "-m":
+        return None
+    if Path(argv[0]).name not in PYTHON_NAMES and argv[0] != sys.executable:
+        return None
+    return argv[2], argv[3:]
+
+
+async def forward_lines(name: str, stream: asyncio.StreamReader, update_hook: Callable[[str, bytes], None]):
+    """Pass the lines of `stream` to `update_hook`.
+
+    The stream is read in chunks rather than by line, so that a line longer than `STREAM_LIMIT`, like
+    the output of a progress bar that only uses `\\r`, is passed in pieces of that size instead of
+    failing the read.
+    """
+    pending = b""
+    while chunk := await stream.read(READ_SIZE):
+        pending += chunk
+        start = 0
+        while True:
+            end = pending.find(b"\n", start, start + STREAM_LIMIT)
+            if end != -1:
+                update_hook(name, pending[start : end + 1])
+                start = end + 1
+            elif len(pending) - start >= STREAM_LIMIT:
+                update_hook(name, pending[start : start + STREAM_LIMIT])
+                start += STREAM_LIMIT
+            else:
+                break
+        pending = pending[start:]
+    if pending:
+        update_hook(name, pending)
+
+
+def run_child(request: dict[str, Any], fds: list[int], inherited: Sequence[int]):
+    """Run the module of `request` in a freshly forked child of the template, and exit with its code.
+
+    The `inherited` file descriptors of the template are closed, and stdin, whose end shuts the
+    template down, is replaced by `/dev/null`.
+    """
+    code: Any = 1
+    try:
+        os.setsid()
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for fd in inherited:
+            os.close(fd)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        os.dup2(fds[0], 1)
+        os.dup2(fds[1], 2)
+        for fd in fds:
+            os.close(fd)
+        sys.stdout = open(1, "w", buffering=1, closefd=False)
+        sys.stderr = open(2, "w", buffering=1, closefd=False)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["environ"])
+        sys.argv = [request["module"], *request["args"]]
+        sys.path.insert(0, request["cwd"])
+        runpy.run_module(request["module"], run_name="__main__", alter_sys=True)
+        code = 0
+    except SystemExit as e:
+        code = e.code
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        if code is None:
+            code = 0
+        elif not isinstance(code, int):
+            print(code, file=sys.stderr)
+            code = 1
+        with suppress(Exception):
+            sys.stdout.flush()
+            sys.stderr.flush()
+        os._exit(code)
+
+
+def serve(socket_path: str, preload: Sequence[str]):
+    """Main loop of the template process.
+
+    It imports `preload`, then forks a child for each connection. A connection sends a JSON request
+    with the file descriptors for the output of the child, and receives the pid of the child, then
+    its return code once it exits. The template exits when its stdin is closed.
+    """
+    for module in preload:
+        importlib.import_module(module)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_read, False)
+    os.set_blocking(wakeup_write, False)
+    signal.set_wakeup_fd(wakeup_write)
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    selector.register(wakeup_read, selectors.EVENT_READ)
+    selector.register(sys.stdin, selectors.EVENT_READ)
+    children: dict[int, socket.socket] = {}
+    sys.stdout.write("ready\n")
+    sys.stdout.flush()
+
+    while True:
+        for key, _ in selector.select():
+            if key.fileobj is sys.stdin:
+                if not os.read(sys.stdin.fileno(), 4096):
+                    return
+            elif key.fileobj is server:
+                connection, _ = server.accept()
+                data, fds, _, _ = socket.recv_fds(connection, 2**16, 2)
+                while data and not data.endswith(b"\n"):
+                    data += connection.recv(2**16)
+                pid = os.fork()
+                if pid == 0:
+                    selector.close()
+                    server.close()
+                    for child_connection in children.values():
+                        child_connection.close()
+                    run_child(json.loads(data), fds, [wakeup_read, wakeup_write])
+                for fd in fds:
+                    os.close(fd)
+                connection.sendall(f"{pid}\n".encode())
+                children[pid] = connection
+            else:
+                with suppress(BlockingIOError):
+                    while os.read(wakeup_read, 4096):
+                        pass
+                while children:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                    if pid == 0:
+                        break
+                    connection = children.pop(pid)
+                    with suppress(OSError):
+                        connection.sendall(f"{os.waitstatus_to_exitcode(status)}\n".encode())
+                    connection.close()
+
+
+class ForkServer:
+    """Template Python process launching `python -m` commands without starting an interpreter.
+
+    The template imports the `preload` modules once, then forks a child for each command, which
+    takes the environment, working directory and arguments of the command and runs its module
+    like `python -m` would. Commands run with the interpreter of nanoflow, and only modules that
+    are not preloaded see the environment of their command when they are imported.
+    """
+
+    def __init__(self, preload: Sequence[str] = ()):
+        self.preload = list(preload)
+        self.process: asyncio.subprocess.Process | None = None
+        self.directory: str | None = None
+        self.lock = asyncio.Lock()
+
+    @property
+    def socket_path(self) -> str:
+        assert self.directory is not None, "The fork server is not started"
+        return str(Path(self.directory) / "launcher.sock")
+
+    async def start(self):
+        async with self.lock:
+            if self.process is not None and self.process.returncode is None:
+                return
+            self.directory = tempfile.mkdtemp(prefix="nanoflow-")
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                __file__,
+                self.socket_path,
+                *self.preload,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+            )
+            assert self.process.stdout is not None
+            if await self.process.stdout.readline() != b"ready\n":
+                raise ChildProcessError(f"The fork server failed to start with return code {await self.process.wait()}")
+
+    async def run(
+        self,
+        name: str,
+        module: str,
+        args: list[str],
+        *,
+        environ: dict[str, str] | None = None,
+        update_hook: Callable[[str, bytes], None] | None = None,
+        kill_grace: float = 5,
+    ) -> int:
+        """Run `module` with `args` in a child of the template and return its return code.
+
+        Like in `create_command`, the output lines are passed to `update_hook` if given, the child
+        runs in its own process group, and the group is killed if the coroutine is cancelled.
+        """
+        await self.start()
+        loop = asyncio.get_running_loop()
+        # Read ends of the pipes of the output of the child, which is forwarded to the hook
+        pipes: list[int] = []
+        if update_hook is not None:
+            stdout_read, stdout_write = os.pipe()
+            stderr_read, stderr_write = os.pipe()
+            pipes = [stdout_read, stderr_read]
+            fds = [stdout_write, stderr_write]
+        else:
+            fds = [sys.stdout.fileno(), sys.stderr.fileno()]
+        request = {
+            "module": module,
+            "args": args,
+            "environ": dict(os.environ if environ is None else environ),
+            "cwd": str(Path.cwd()),
+        }
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        socket.send_fds(sock, [json.dumps(request).encode() + b"\n"], fds)
+        if update_hook is not None:
+            for fd in fds:
+                os.close(fd)
+        reader, writer = await asyncio.open_unix_connection(sock=sock)
+
+        async def read_number() -> int:
+            line = await reader.readline()
+            if not line:
+                raise ChildProcessError(f"The fork server exited while running `{name}`")
+            return int(line)
+
+        async def forward(fd: int):
+            assert update_hook is not None
+            stream = asyncio.StreamReader(limit=STREAM_LIMIT)
+            transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(stream), open(fd, "rb", buffering=0)
+            )
+            try:
+                await forward_lines(name, stream, update_hook)
+            finally:
+                transport.close()
+
+        try:
+            pid = await read_number()
+            try:
+                await asyncio.gather(*(forward(fd) for fd in pipes))
+                return await read_number()
+            except BaseException:
+                # Cancelling the task or failing to read its output must not leave the command running
+                with suppress(ProcessLookupError):
+                    os.killpg(pid, signal.SIGTERM)
+                returncode = asyncio.ensure_future(read_number())
+                with suppress(TimeoutError, ChildProcessError):
+                    await asyncio.wait_for(asyncio.shield(returncode), kill_grace)
+                with suppress(ProcessLookupError):
+                    os.killpg(pid, signal.SIGKILL)
+                with suppress(ChildProcessError):
+                    await returncode
+                raise
+        finally:
+            writer.close()
+
+    def close(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+        self.process = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+
+if __name__ == "__main__":
+    # The template runs as a script, whose directory would shadow the modules of the commands
+    del sys.path[0]
+    serve(sys.argv[1], sys.argv[2:])
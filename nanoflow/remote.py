@@ -0,0 +1,392 @@
+from __future__ import annotations
+
+import asyncio
+import hmac
+import itertools
+import json
+import os
+import socket
+import sys
+from collections.abc import Callable, Coroutine
+from typing import Any, Literal, NamedTuple
+
+from loguru import logger
+
+from .launcher import STREAM_LIMIT
+from .resource_pool import ConcurrencyGroup, DynamicResourcePool, GPUResourcePool
+from .retry import RetryPolicy
+from .task import Task, TaskProcessError
+from .utils import create_command, hash_command
+
+
+class RemoteResource(NamedTuple):
+    worker: str
+    resource: str
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """Split a `host:port` address.
+
+    Example:
+    >>> parse_address("localhost:7000")
+    ('localhost', 7000)
+    """
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid address `{address}`, expected `host:port`")
+    return host, int(port)
+
+
+def encode_message(message: dict[str, Any]) -> bytes:
+    return json.dumps(message).encode() + b"\n"
+
+
+def parse_hello(line: bytes, token: str | None) -> tuple[str, set[str]]:
+    """Name and resources of a worker introducing itself with `line`.
+
+    Example:
+    >>> parse_hello(b'{"type": "hello", "name": "w1", "resources": ["r1"], "token": null}', None)
+    ('w1', {'r1'})
+    >>> parse_hello(b'{"type": "hello", "name": "w1", "resources": ["r1"], "token": "guess"}', "secret")
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid token
+    """
+    hello = json.loads(line)
+    if not isinstance(hello, dict) or hello.get("type") != "hello":
+        raise ValueError("Expected a `hello` message")
+    if token is not None and not hmac.compare_digest(str(hello.get("token")).encode(), token.encode()):
+        raise ValueError("Invalid token")
+    name, resources = hello.get("name"), hello.get("resources")
+    if not isinstance(name, str) or not name:
+        raise ValueError("Invalid worker name")
+    if not isinstance(resources, list) or not all(isinstance(resource, str) for resource in resources):
+        raise ValueError("Invalid worker resources")
+    return name, set(resources)
+
+
+class RemoteJob:
+    def __init__(self, name: str, update_hook: Callable[[str, bytes], None] | None):
+        self.name = name
+        self.update_hook = update_hook
+        self.returncode: asyncio.Future[int | None] = asyncio.get_running_loop().create_future()
+
+
+class WorkerConnection:
+    def __init__(self, name: str, writer: asyncio.StreamWriter, resources: set[str]):
+        self.name = name
+        self.writer = writer
+        self.resources = resources
+        self.jobs: dict[int, RemoteJob] = {}
+
+    def send(self, message: dict[str, Any]):
+        self.writer.write(encode_message(message))
+
+
+class RemoteResourcePool(DynamicResourcePool[RemoteResource]):
+    """Resources advertised by the workers connected to a coordinator.
+
+    Workers joining, leaving or changing their resources are handled like devices appearing and
+    disappearing in any dynamic pool, except that the pool is updated as soon as they do.
+    """
+
+    def __init__(self, coordinator: Coordinator):
+        self.coordinator = coordinator
+        super().__init__()
+
+    def get_available_resources(self) -> set[RemoteResource]:
+        return {
+            RemoteResource(worker.name, resource)
+            for worker in self.coordinator.workers.values()
+            for resource in worker.resources
+        }
+
+    def refresh_now(self):
+        self.update()
+        self.wake_waiters()
+
+    def release(self, res: RemoteResource):
+        if res.worker in self.coordinator.workers:
+            self.resources[res] = False
+            self.wake_waiters()
+        else:
+            self.resources.pop(res, None)
+
+
+class Coordinator:
+    """Server dispatching commands to remote workers.
+
+    Workers connect over TCP and exchange JSON lines with the coordinator. A worker introduces
+    itself with a `hello` message listing its resources, and may later send `resources` updates.
+    The coordinator sends `run` and `cancel` messages, and the worker answers with `log` messages
+    carrying the output of a job and an `exit` message carrying its return code.
+
+    Jobs running on a worker that disconnects fail with `TaskProcessError`, so that they can be
+    retried on another worker.
+
+    Workers run any command they are sent, so with a `token`, only workers sending the same token
+    in their `hello` are accepted. Serve on an address other than localhost only with a token.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, *, token: str | None = None):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.workers: dict[str, WorkerConnection] = {}
+        self.pool = RemoteResourcePool(self)
+        self.job_counter = itertools.count()
+        self.server: asyncio.Server | None = None
+
+    @property
+    def address(self) -> tuple[str, int]:
+        assert self.server is not None, "The coordinator is not started"
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return host, port
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_worker, self.host, self.port, limit=STREAM_LIMIT)
+
+    async def close(self):
+        if self.server is None:
+            return
+        self.server.close()
+        for worker in list(self.workers.values()):
+            worker.writer.close()
+        await self.server.wait_closed()
+        self.server = None
+
+    async def __aenter__(self) -> Coordinator:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: object):
+        await self.close()
+
+    async def handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            name, resources = parse_hello(await reader.readline(), self.token)
+        except (ValueError, ConnectionError) as e:
+            host, port = writer.get_extra_info("peername", ("unknown", 0))[:2]
+            logger.warning(f"Rejected a worker from [blue]{host}:{port}[/blue]: {e}")
+            writer.close()
+            return
+        if name in self.workers:
+            name = f"{name}-{next(self.job_counter)}"
+        worker = WorkerConnection(name, writer, resources)
+        self.workers[name] = worker
+        logger.info(f"Worker [blue]{name}[/blue] joined with resources {sorted(worker.resources)}")
+        self.pool.refresh_now()
+        try:
+            async for line in reader:
+                self.handle_message(worker, json.loads(line))
+        except ConnectionError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Dropping worker [blue]{name}[/blue] after an invalid message: {e!r}")
+        finally:
+            del self.workers[name]
+            logger.warning(f"Worker [blue]{name}[/blue] left")
+            for job in worker.jobs.values():
+                if not job.returncode.done():
+                    job.returncode.set_exception(TaskProcessError(f"Worker `{name}` left while running `{job.name}`"))
+            self.pool.refresh_now()
+            writer.close()
+
+    def handle_message(self, worker: WorkerConnection, message: dict[str, Any]):
+        if message["type"] == "resources":
+            worker.resources = set(message["resources"])
+            self.pool.refresh_now()
+        elif message["type"] == "log":
+            job = worker.jobs.get(message["job"])
+            if job is None:
+                return
+            data: str = message["data"]
+            if job.update_hook is not None:
+                job.update_hook(job.name, data.encode())
+            else:
+                stream = sys.stderr if message["stream"] == "stderr" else sys.stdout
+                stream.write(data)
+        elif message["type"] == "exit":
+            job = worker.jobs.pop(message["job"], None)
+            if job is not None and not job.returncode.done():
+                job.returncode.set_result(message["returncode"])
+
+    async def run(
+        self,
+        resource: RemoteResource,
+        name: str,
+        command: str,
+        *,
+        environ: dict[str, str] | None = None,
+        update_hook: Callable[[str, bytes], None] | None = None,
+        kill_grace: float = 5,
+    ):
+        """Run `command` on the worker owning `resource`, raising `TaskProcessError` if it fails."""
+        worker = self.workers.get(resource.worker)
+        if worker is None:
+            raise TaskProcessError(f"Worker `{resource.worker}` left before `{name}` started")
+        job_id = next(self.job_counter)
+        job = RemoteJob(name, update_hook)
+        worker.jobs[job_id] = job
+        worker.send(
+            {
+                "type": "run",
+                "job": job_id,
+                "name": name,
+                "command": command,
+                "resource": resource.resource,
+                "environ": environ or {},
+                "kill_grace": kill_grace,
+            }
+        )
+        try:
+            returncode = await job.returncode
+        except asyncio.CancelledError:
+            if worker.jobs.pop(job_id, None) is not None and resource.worker in self.workers:
+                worker.send({"type": "cancel", "job": job_id})
+            raise
+        if returncode != 0:
+            raise TaskProcessError(
+                f"Task `{name}` failed with return code {returncode} on worker `{resource.worker}`", returncode
+            )
+
+
+def create_remote_task(
+    name: str,
+    command: str,
+    *,
+    coordinator: Coordinator,
+    gpus: bool = False,
+    update_hook: Callable[[str, bytes], None] | None = None,
+    group: ConcurrencyGroup | None = None,
+    inputs: list[str] | None = None,
+    outputs: list[str] | None = None,
+    retry: RetryPolicy | None = None,
+    timeout: float | None = None,
+    kill_grace: float = 5,
+) -> Task[[], None]:
+    def run_on_worker(fn: Callable[[], None], resource: RemoteResource) -> Callable[[], Coroutine[Any, Any, None]]:
+        environ = {"FORCE_COLOR": "1"}
+        if gpus:
+            environ["CUDA_VISIBLE_DEVICES"] = resource.resource
+
+        async def inner_fn() -> None:
+            await coordinator.run(
+                resource, name, command, environ=environ, update_hook=update_hook, kill_grace=kill_grace
+            )
+
+        return inner_fn
+
+    return Task(
+        name=name,
+        fn=lambda: None,
+        resource_pool=coordinator.pool,
+        resource_modifier=run_on_worker,
+        config_hash=hash_command(command),
+        concurrency_group=group,
+        inputs=inputs or [],
+        outputs=outputs or [],
+        retry=retry or RetryPolicy(),
+        timeout=timeout,
+    )
+
+
+class Worker:
+    """Agent running the commands dispatched by a coordinator on its own resources.
+
+    With `resources="gpus"`, the free GPUs of the machine are advertised, and the coordinator is
+    told whenever they change, every `refresh_interval` seconds.
+    """
+
+    refresh_interval: float = 1.0
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        *,
+        resources: list[str] | Literal["gpus"],
+        name: str | None = None,
+        token: str | None = None,
+    ):
+        self.host = host
+        self.port = port
+        self.resources = resources
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.token = token
+        self.jobs: dict[int, asyncio.Task[None]] = {}
+        self.gpu_pool = GPUResourcePool() if resources == "gpus" else None
+
+    def get_resources(self) -> list[str]:
+        if self.gpu_pool is not None:
+            return sorted(self.gpu_pool.get_available_resources())
+        assert isinstance(self.resources, list), "GPU workers advertise the resources of their pool"
+        return self.resources
+
+    async def run(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=STREAM_LIMIT)
+        resources = self.get_resources()
+        hello = {"type": "hello", "name": self.name, "resources": resources, "token": self.token}
+        writer.write(encode_message(hello))
+        logger.info(f"Connected to [blue]{self.host}:{self.port}[/blue] with resources {resources}")
+        advertiser = asyncio.create_task(self.advertise(writer, resources)) if self.gpu_pool is not None else None
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                if message["type"] == "run":
+                    job = asyncio.create_task(self.run_job(writer, message))
+                    self.jobs[message["job"]] = job
+                    job.add_done_callback(lambda _, job_id=message["job"]: self.jobs.pop(job_id, None))
+                elif message["type"] == "cancel" and (job := self.jobs.get(message["job"])) is not None:
+                    job.cancel()
+        except ConnectionError:
+            pass
+        finally:
+            if advertiser is not None:
+                advertiser.cancel()
+            jobs = list(self.jobs.values())
+            for job in jobs:
+                job.cancel()
+            if jobs:
+                await asyncio.wait(jobs)
+            writer.close()
+            logger.info("Disconnected from the coordinator")
+
+    async def advertise(self, writer: asyncio.StreamWriter, resources: list[str]):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            current = await asyncio.to_thread(self.get_resources)
+            if current != resources:
+                resources = current
+                writer.write(encode_message({"type": "resources", "resources": resources}))
+
+    async def run_job(self, writer: asyncio.StreamWriter, message: dict[str, Any]):
+        job_id = message["job"]
+
+        def forward(stream: str) -> Callable[[str, bytes], None]:
+            def update_hook(name: str, line: bytes):
+                data = line.decode(errors="replace")
+                writer.write(encode_message({"type": "log", "job": job_id, "stream": stream, "data": data}))
+
+            return update_hook
+
+        logger.info(f"Running task [blue]{message['name']}[/blue] on resource {message['resource']}")
+        try:
+            command_fn = create_command(
+                message["name"],
+                message["command"],
+                update_hook=forward("stdout"),
+                stderr_hook=forward("stderr"),
+                environ={**os.environ, **message["environ"]},
+                kill_grace=message["kill_grace"],
+            )
+            await command_fn()
+            returncode = 0
+        except TaskProcessError as e:
+            returncode = e.returncode
+        except Exception as e:
+            # The coordinator is still told, so that the job fails instead of waiting forever
+            logger.error(f"Task [blue]{message['name']}[/blue] could not run: {e}")
+            returncode = None
+        writer.write(encode_message({"type": "exit", "job": job_id, "returncode": returncode}))
+        await writer.drain()
@@ -1,37 +1,98 @@
 from __future__ import annotations
 
 import asyncio
+import heapq
+import itertools
 import subprocess
 from abc import abstractmethod
-from collections.abc import Hashable, Sequence
+from collections.abc import Collection, Hashable, Sequence
 
 from loguru import logger
 
 
 class ResourcePool[T: Hashable]:
-    def __init__(self, resources: Sequence[T]):
-        self.resources = {res: asyncio.Semaphore(1) for res in resources}
+    """Pool of resources, each of which can be held by one task at a time.
+
+    When every resource is in use, `acquire` waits without polling. Released resources are handed
+    to the waiting task with the highest priority, and to the earliest one among equal priorities.
+    Resources in `avoid` are only handed out when no other resource is free.
+    """
 
-    async def acquire(self) -> T:
-        while True:
-            for res, sem in self.resources.items():
-                if sem.locked():
-                    continue
-                if await sem.acquire():
-                    return res
-            await asyncio.sleep(0.1)
+    resources: dict[T, bool]
+
+    def __init__(self, resources: Sequence[T]):
+        self.resources = dict.fromkeys(resources, False)
+        self.waiters: list[tuple[float, int, asyncio.Future[T], Collection[T]]] = []
+        self.waiter_counter = itertools.count()
+
+    @property
+    def used_resources(self) -> set[T]:
+        return {res for res, used in self.resources.items() if used}
+
+    def take_free_resource(self, avoid: Collection[T] = ()) -> T | None:
+        fallback = None
+        for res, used in self.resources.items():
+            if used:
+                continue
+            if res not in avoid:
+                self.resources[res] = True
+                return res
+            if fallback is None:
+                fallback = res
+        if fallback is not None:
+            self.resources[fallback] = True
+        return fallback
+
+    def has_free_resource(self, avoid: Collection[T] = ()) -> bool:
+        """Whether a resource outside `avoid` can be acquired without waiting."""
+        return not self.waiters and any(not used and res not in avoid for res, used in self.resources.items())
+
+    def wake_waiters(self):
+        while self.waiters:
+            _, _, waiter, avoid = self.waiters[0]
+            if waiter.done():
+                heapq.heappop(self.waiters)
+                continue
+            res = self.take_free_resource(avoid)
+            if res is None:
+                return
+            heapq.heappop(self.waiters)
+            waiter.set_result(res)
+
+    async def wait_for_resource(self, priority: float, avoid: Collection[T] = ()) -> T:
+        waiter: asyncio.Future[T] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (-priority, next(self.waiter_counter), waiter, avoid))
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(waiter.result())
+            raise
+
+    async def acquire(self, priority: float = 0, avoid: Collection[T] = ()) -> T:
+        if not self.waiters:
+            res = self.take_free_resource(avoid)
+            if res is not None:
+                return res
+        return await self.wait_for_resource(priority, avoid)
 
     def release(self, res: T):
-        self.resources[res].release()
+        self.resources[res] = False
+        self.wake_waiters()
 
 
 class DynamicResourcePool[T](ResourcePool[T]):
-    resources: dict[T, asyncio.Semaphore]
-    used_resources: set[T]
+    """Resource pool whose resources are discovered by `get_available_resources`.
+
+    Resources can appear or disappear at any time, so while tasks are waiting the pool is
+    refreshed every `refresh_interval` seconds and free resources are handed to the waiters.
+    """
+
+    refresh_interval: float = 0.1
 
     def __init__(self):
-        self.resources = {}
-        self.used_resources = set()
+        super().__init__([])
+        self.refresher: asyncio.Task[None] | None = None
 
     @abstractmethod
     def get_available_resources(self) -> set[T]: ...
@@ -40,25 +101,34 @@ class DynamicResourcePool[T](ResourcePool[T]):
         available_resources = self.get_available_resources()
         for new_res in available_resources - self.resources.keys():
             logger.info(f"Adding new resource {new_res}")
-            self.resources[new_res] = asyncio.Semaphore(1)
+            self.resources[new_res] = False
         for res in self.resources.keys() - available_resources - self.used_resources:
             logger.info(f"Removing resource {res}")
             self.resources.pop(res)
 
-    async def acquire(self) -> T:
-        while True:
+    def has_free_resource(self, avoid: Collection[T] = ()) -> bool:
+        self.update()
+        return super().has_free_resource(avoid)
+
+    async def refresh(self):
+        while self.waiters:
+            await asyncio.sleep(self.refresh_interval)
             self.update()
-            for res, sem in self.resources.items():
-                if sem.locked():
-                    continue
-                if await sem.acquire():
-                    self.used_resources.add(res)
-                    return res
-            await asyncio.sleep(0.1)
+            self.wake_waiters()
+
+    async def acquire(self, priority: float = 0, avoid: Collection[T] = ()) -> T:
+        if not self.waiters:
+            self.update()
+            res = self.take_free_resource(avoid)
+            if res is not None:
+                return res
+        if self.refresher is None or self.refresher.done():
+            self.refresher = asyncio.create_task(self.refresh())
+        return await self.wait_for_resource(priority, avoid)
 
     def release(self, res: T):
-        self.resources[res].release()
-        self.used_resources.remove(res)
+        # The resource may still look busy right after release, so it is handed out on the next refresh
+        self.resources[res] = False
 
 
 class GPUResourcePool(DynamicResourcePool[str]):
@@ -85,11 +155,32 @@ class GPUResourcePool(DynamicResourcePool[str]):
         return free_gpus
 
 
+class ConcurrencyGroup(ResourcePool[int]):
+    """Limit on how many tasks of a group run at the same time.
+
+    Each running task holds one of `limit` interchangeable slots, which are handed out by priority
+    like any other resource.
+
+    Example:
+    >>> group = ConcurrencyGroup("db", 1)
+    >>> group.limit
+    1
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        super().__init__(range(limit))
+
+
 class UnlimitedPool[T](ResourcePool[T]):
     def __init__(self, resource: T):
         self.resource = resource
 
-    async def acquire(self) -> T:
+    def has_free_resource(self, avoid: Collection[T] = ()) -> bool:
+        return True
+
+    async def acquire(self, priority: float = 0, avoid: Collection[T] = ()) -> T:
         return self.resource
 
     def release(self, res: T):
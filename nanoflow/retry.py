@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import random
+
+from pydantic import BaseModel, Field, NonNegativeFloat, PositiveInt
+
+# The shell reports commands that cannot be executed or found with these codes; retrying will not help
+NOT_RETRYABLE_EXIT_CODES = frozenset({126, 127})
+
+
+class RetryPolicy(BaseModel):
+    """How a task that raised `TaskProcessError` is retried.
+
+    The `n`-th retry waits `interval * backoff ** (n - 1)` seconds, at most `max_interval`, scaled
+    by a random factor within `1 ± jitter` so that tasks failing together do not retry together.
+    By default, retries wait 10, 30 and 60 seconds. With
+    `retry_on_exit_codes`, only these exit codes are retried; otherwise every failure is, except
+    commands that could not be executed or found. With `retry_on_different_resource`, a retry
+    prefers a free resource other than the ones it already failed on.
+
+    Example:
+    >>> policy = RetryPolicy(max_attempts=4, interval=10, backoff=3, max_interval=60, jitter=0)
+    >>> [policy.delay(attempt) for attempt in (1, 2, 3)]
+    [10.0, 30.0, 60.0]
+    >>> policy.should_retry(1, 1), policy.should_retry(1, 127), policy.should_retry(4, 1)
+    (True, False, False)
+    """
+
+    max_attempts: PositiveInt = 4
+    interval: NonNegativeFloat = 10
+    backoff: float = Field(default=3, ge=1)
+    max_interval: NonNegativeFloat | None = 60
+    jitter: float = Field(default=0.1, ge=0, le=1)
+    retry_on_exit_codes: list[int] | None = None
+    retry_on_different_resource: bool = False
+
+    def should_retry(self, attempt: int, returncode: int | None) -> bool:
+        """Whether a task whose `attempt`-th attempt failed with `returncode` is run again."""
+        if attempt >= self.max_attempts:
+            return False
+        if self.retry_on_exit_codes is not None:
+            return returncode in self.retry_on_exit_codes
+        return returncode not in NOT_RETRYABLE_EXIT_CODES
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before running the task again after its `attempt`-th attempt failed."""
+        delay = self.interval * self.backoff ** (attempt - 1)
+        if self.max_interval is not None:
+            delay = min(delay, self.max_interval)
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return delay
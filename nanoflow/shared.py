@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import weakref
+from collections.abc import Callable, Coroutine
+from contextlib import suppress
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Literal, cast, get_args
+
+# Smaller results are cheaper to copy than to place in shared memory
+SHARED_MIN_SIZE = 2**16
+
+# Native formats a `memoryview` can be cast to
+CastFormat = Literal[
+    "b", "B", "@b", "@B", "h", "H", "@h", "@H", "i", "I", "@i", "@I", "l", "L", "@l", "@L", "q", "Q", "@q", "@Q",
+    "P", "@P", "f", "@f", "d", "@d", "?", "c", "@c",
+]  # fmt: skip
+CAST_FORMATS = frozenset(get_args(CastFormat))
+
+# Segments created or opened by this process, by name
+_segments: dict[str, SharedMemory] = {}
+# Number of references to the segments owned by this process, by name
+_references: dict[str, int] = {}
+
+
+class SharedResult:
+    """Handle to a task result placed in shared memory.
+
+    The handle is cheap to pickle, so it can be passed to tasks running in other processes, which
+    see the result as a read-only view of the shared memory instead of a copy: a `memoryview` for
+    `bytes` and other buffers, or an array for NumPy arrays.
+
+    The process receiving the result from its task owns the segment. It is unlinked once the handle
+    is no longer referenced there and the last task taking it as an argument has finished.
+
+    Example:
+    >>> result = share(bytes(SHARED_MIN_SIZE))
+    >>> adopt(result) is result
+    True
+    >>> view = result.view()
+    >>> view.nbytes == SHARED_MIN_SIZE, view.readonly
+    (True, True)
+    """
+
+    def __init__(self, name: str, nbytes: int, format: CastFormat, shape: tuple[int, ...], dtype: str | None = None):
+        self.name = name
+        self.nbytes = nbytes
+        self.format: CastFormat = format
+        self.shape = shape
+        self.dtype = dtype
+
+    def __repr__(self) -> str:
+        return f"SharedResult({self.name!r}, shape={self.shape})"
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        # Copies in other processes do not own the segment
+        return SharedResult, (self.name, self.nbytes, self.format, self.shape, self.dtype)
+
+    def view(self) -> Any:
+        """Read-only view of the result, opening the segment in this process if needed."""
+        segment = _segments.get(self.name)
+        if segment is None:
+            segment = _segments[self.name] = SharedMemory(self.name)
+        assert segment.buf is not None, f"Shared memory `{self.name}` is closed"
+        buffer = segment.buf.toreadonly()
+        if self.dtype is not None:
+            import numpy as np
+
+            return np.ndarray(self.shape, dtype=self.dtype, buffer=buffer)
+        return buffer[: self.nbytes].cast(self.format, self.shape)
+
+
+def share(value: Any, min_size: int = SHARED_MIN_SIZE) -> Any:
+    """Copy a buffer of at least `min_size` bytes to shared memory and return its handle.
+
+    Other values are returned unchanged.
+    """
+    try:
+        view = memoryview(value)
+    except TypeError:
+        return value
+    if view.nbytes < min_size:
+        return value
+    assert view.shape is not None
+    format: CastFormat = "B"
+    shape, dtype = view.shape, None
+    if type(value).__module__ == "numpy" and hasattr(value, "dtype"):
+        dtype = value.dtype.str
+    elif view.format in CAST_FORMATS:
+        format = cast(CastFormat, view.format)
+    else:
+        # Views can only be cast to native formats, others are shared as bytes
+        shape = (view.nbytes,)
+    # The bytes of the buffer in C order
+    data = view.cast("B") if view.c_contiguous else memoryview(view.tobytes())
+    segment = SharedMemory(create=True, size=view.nbytes)
+    assert segment.buf is not None
+    segment.buf[: view.nbytes] = data
+    _segments[segment.name] = segment
+    return SharedResult(segment.name, view.nbytes, format, shape, dtype)
+
+
+def adopt(value: Any) -> Any:
+    """Take ownership of the segment of a `SharedResult` received from a task."""
+    if isinstance(value, SharedResult) and value.name not in _references:
+        _references[value.name] = 1
+        weakref.finalize(value, release, value.name)
+    return value
+
+
+def acquire(name: str):
+    if name in _references:
+        _references[name] += 1
+
+
+def release(name: str):
+    """Drop a reference to the segment `name`, and unlink it after the last one."""
+    if name not in _references:
+        return
+    _references[name] -= 1
+    if _references[name] > 0:
+        return
+    del _references[name]
+    segment = _segments.get(name) or SharedMemory(name)
+    segment.unlink()
+    # Views still referenced keep the memory mapped until they are collected
+    with suppress(BufferError):
+        segment.close()
+        _segments.pop(name, None)
+
+
+def shared_arguments(args: tuple[Any, ...], kwargs: dict[str, Any]) -> list[SharedResult]:
+    return [value for value in (*args, *kwargs.values()) if isinstance(value, SharedResult)]
+
+
+def open_views(args: tuple[Any, ...], kwargs: dict[str, Any]) -> tuple[tuple[Any, ...], dict[str, Any]]:
+    """Replace the `SharedResult` arguments of a task by views of their results."""
+
+    def open_view(value: Any) -> Any:
+        return value.view() if isinstance(value, SharedResult) else value
+
+    return tuple(open_view(value) for value in args), {key: open_view(value) for key, value in kwargs.items()}
+
+
+def close_views(handles: list[SharedResult]):
+    """Close the segments of `handles` opened by this process, unless it owns them or still uses them."""
+    for handle in handles:
+        if handle.name in _references or (segment := _segments.get(handle.name)) is None:
+            continue
+        with suppress(BufferError):
+            segment.close()
+            del _segments[handle.name]
+
+
+def call_shared(fn: Callable[..., Any], share_result: bool, *args: Any, **kwargs: Any) -> Any:
+    """Call `fn` with views of its `SharedResult` arguments, and share its result if asked to.
+
+    It runs where `fn` runs, so a result computed in a worker process is copied to shared memory
+    there and only its handle is sent back.
+    """
+    handles = shared_arguments(args, kwargs)
+    view_args, view_kwargs = open_views(args, kwargs)
+    try:
+        result = fn(*view_args, **view_kwargs)
+    finally:
+        del view_args, view_kwargs
+        close_views(handles)
+    if share_result:
+        result = share(result)
+        if isinstance(result, SharedResult) and result.name not in _references:
+            # The receiving process owns the segment, this one only needs to unmap it
+            _segments.pop(result.name).close()
+    return result
+
+
+async def call_shared_async(
+    fn: Callable[..., Coroutine[Any, Any, Any]], share_result: bool, *args: Any, **kwargs: Any
+) -> Any:
+    """Like `call_shared`, for coroutine functions awaited on the event loop."""
+    view_args, view_kwargs = open_views(args, kwargs)
+    result = await fn(*view_args, **view_kwargs)
+    return share(result) if share_result else result
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Collection
+from typing import Any
+
+from .task import Task
+
+# Number of finished siblings needed before their median duration is trusted
+MIN_SIBLING_SAMPLES = 3
+
+
+class SpeculativeRun[RetT]:
+    """Attempts of one task racing each other.
+
+    The run starts with the task itself, and `duplicate` launches a copy of it on another resource.
+    The first attempt to succeed wins and the others are cancelled, which kills their commands.
+    The run only fails when every attempt failed.
+    """
+
+    def __init__(self, task: Task[[], RetT]):
+        self.task = task
+        self.attempts: set[asyncio.Task[RetT]] = set()
+        self.result: asyncio.Future[RetT] = asyncio.get_running_loop().create_future()
+        self.duplicated = False
+
+    def launch(self, task: Task[[], RetT]):
+        attempt = task.submit()
+        self.attempts.add(attempt)
+        attempt.add_done_callback(self.on_attempt_done)
+
+    def duplicate(self, avoid: Collection[Any]):
+        """Launch a copy of the task, which does not report its start and avoids the given resources."""
+        self.duplicated = True
+        self.launch(self.task.model_copy(update={"on_start": None, "avoid_resources": set(avoid)}))
+
+    def on_attempt_done(self, attempt: asyncio.Task[RetT]):
+        self.attempts.discard(attempt)
+        if self.result.done():
+            return
+        if attempt.cancelled():
+            if not self.attempts:
+                self.result.cancel()
+        elif (exception := attempt.exception()) is not None:
+            if not self.attempts:
+                self.result.set_exception(exception)
+        else:
+            self.result.set_result(attempt.result())
+
+    async def run(self) -> RetT:
+        self.launch(self.task)
+        try:
+            return await self.result
+        finally:
+            for attempt in self.attempts:
+                attempt.cancel()
+            if self.attempts:
+                await asyncio.wait(self.attempts)
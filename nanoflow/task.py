@@ -1,21 +1,61 @@
 from __future__ import annotations
 
 import asyncio
-from collections.abc import Callable
-from typing import Any, ParamSpec, TypeVar, overload
+import functools
+import inspect
+from collections import deque
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Sequence
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, ParamSpec, TypeVar, cast, overload
 
 from loguru import logger
 from pydantic import BaseModel, ConfigDict
 
-from .resource_pool import ResourcePool
+from .backend import TaskBackend, current_backends, process_target
+from .resource_pool import ConcurrencyGroup, GPUResourcePool, ResourcePool
+from .retry import RetryPolicy
+from .shared import acquire, adopt, call_shared, call_shared_async, release, shared_arguments
+
+if TYPE_CHECKING:
+    from .graph import WorkflowGraph
 
 InputT = ParamSpec("InputT")
 RetT = TypeVar("RetT")
 
+# Graph recording the submitted tasks instead of running them, while a workflow is captured
+current_graph: ContextVar[WorkflowGraph | None] = ContextVar("current_graph", default=None)
+
 
 class TaskProcessError(Exception):
     """Exception raised when a task process fails."""
 
+    def __init__(self, message: str, returncode: int | None = None):
+        super().__init__(message)
+        self.returncode = returncode
+
+
+class TaskTimeoutError(TaskProcessError):
+    """Exception raised when a task runs longer than its timeout."""
+
+
+class TaskDependencyError(Exception):
+    """Exception raised when a task does not run, because a task it waits for failed."""
+
+
+async def run_with_timeout[T](coro_fn: Callable[[], Awaitable[T]], timeout: float | None, name: str) -> T:
+    """Await `coro_fn()`, raising `TaskTimeoutError` if the task `name` runs longer than `timeout` seconds."""
+    if timeout is None:
+        return await coro_fn()
+    deadline = asyncio.timeout(timeout)
+    try:
+        async with deadline:
+            return await coro_fn()
+    except TimeoutError:
+        # A timeout raised from inside the function is not the one of the task
+        if not deadline.expired():
+            raise
+        raise TaskTimeoutError(f"Task `{name}` timed out after {timeout} seconds") from None
+
 
 class Task[**InputT, RetT](BaseModel):
     """
@@ -30,9 +70,20 @@ class Task[**InputT, RetT](BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True)
     name: str
     fn: Callable[InputT, RetT]
-    retry_interval: list[int] = [10, 30, 60]
+    retry: RetryPolicy = RetryPolicy()
+    timeout: float | None = None
     resource_pool: ResourcePool[Any] | None = None
-    resource_modifier: Callable[[Callable[InputT, RetT], Any], Callable[InputT, RetT]] | None = None
+    # Wraps `fn` for the acquired resource, possibly into a coroutine function run on the event loop
+    resource_modifier: Callable[[Callable[InputT, RetT], Any], Callable[InputT, RetT | Awaitable[RetT]]] | None = None
+    avoid_resources: set[Any] = set()
+    concurrency_group: ConcurrencyGroup | None = None
+    inputs: list[str] = []
+    outputs: list[str] = []
+    backend: TaskBackend | None = None
+    priority: float = 0
+    config_hash: str | None = None
+    on_start: Callable[[Any], None] | None = None
+    shared_result: bool = False
 
     def __call__(self, *args: InputT.args, **kwargs: InputT.kwargs) -> RetT:
         if self.resource_pool is not None or self.resource_modifier is not None:
@@ -42,35 +93,188 @@ class Task[**InputT, RetT](BaseModel):
         return self.fn(*args, **kwargs)
 
     def submit(self, *args: InputT.args, **kwargs: InputT.kwargs) -> asyncio.Task[RetT]:
-        retry_interval = self.retry_interval[:]
+        """Run the task in the background and return its `asyncio.Task`."""
+        return self.submit_after((), *args, **kwargs)
 
-        async def wrapper_fn() -> RetT:
+    def submit_after(
+        self, after: Sequence[Awaitable[Any]], /, *args: InputT.args, **kwargs: InputT.kwargs
+    ) -> asyncio.Task[RetT]:
+        """Run the task in the background once the futures in `after` are done.
+
+        The futures, such as other submitted tasks, are awaited before the task takes its
+        concurrency group slot and its resource. If one of them fails, the task raises
+        `TaskDependencyError` without running.
+        """
+        if (graph := current_graph.get()) is not None:
+            # The `LazyResult` is awaitable like a running task, and resolves to itself
+            return cast(asyncio.Task[RetT], graph.add(self, args, kwargs, after))
+        upstreams = [asyncio.ensure_future(upstream) for upstream in after]
+
+        async def call(fn: Callable[InputT, Any], resource: Any) -> RetT:
+            # Coroutine functions, such as command tasks, run on the event loop unless told otherwise
+            backend = self.backend or ("async" if inspect.iscoroutinefunction(fn) else "thread")
+            backends = current_backends.get()
+            handles = shared_arguments(args, kwargs)
+            if handles or self.shared_result:
+                # Results are shared and arguments viewed where the function runs, so that a worker
+                # process sends a handle back instead of pickling the whole result
+                if backend == "async":
+                    fn = functools.partial(call_shared_async, fn, self.shared_result)
+                else:
+                    target = process_target(fn) if backend in ("process", "warm") else fn
+                    fn = functools.partial(call_shared, target, self.shared_result)
+            if backend == "warm":
+                environ: dict[str, str] = {}
+                if isinstance(self.resource_pool, GPUResourcePool):
+                    # The warm worker of a GPU only sees that GPU, like command tasks do
+                    environ["CUDA_VISIBLE_DEVICES"] = str(resource)
+                # Pools may name their resources alike, so each pool has its own workers
+                key = (id(self.resource_pool), resource)
+                run = functools.partial(backends.run_warm, key, environ, fn, *args, **kwargs)
+            else:
+                run = functools.partial(backends.run, backend, fn, *args, **kwargs)
+            # The shared results passed as arguments stay alive until the function has finished
+            for handle in handles:
+                acquire(handle.name)
             try:
-                if self.resource_pool is not None:
-                    resource = await self.resource_pool.acquire()
-                    logger.info(f"Acquired resource by task [blue]{self.name}[/blue]: {resource}")
-                    if self.resource_modifier is not None:
-                        fn = self.resource_modifier(self.fn, resource)
-                    else:
-                        fn = self.fn
-                    try:
-                        return await asyncio.to_thread(fn, *args, **kwargs)
-                    finally:
-                        self.resource_pool.release(resource)
-                        logger.info(f"Released resource: {resource}")
+                # On timeout, commands kill their process group and warm workers are killed; functions in a
+                # thread or process run on in the background, but the task fails and its resource is released
+                return adopt(await run_with_timeout(run, self.timeout, self.name))
+            finally:
+                for handle in handles:
+                    release(handle.name)
+
+        async def run_with_resource(avoid: set[Any]) -> RetT:
+            if self.resource_pool is not None:
+                resource = await self.resource_pool.acquire(self.priority, avoid=avoid)
+                logger.info(f"Acquired resource by task [blue]{self.name}[/blue]: {resource}")
+                if self.resource_modifier is not None:
+                    fn = self.resource_modifier(self.fn, resource)
                 else:
-                    return await asyncio.to_thread(self.fn, *args, **kwargs)
-            except TaskProcessError as e:
-                logger.error(f"Failed to execute task: {e}")
-                if retry_interval:
-                    retry = retry_interval.pop(0)
-                    logger.info(f"Retry task `{self.name}` after {retry} seconds")
-                    await asyncio.sleep(retry)
-                    return await wrapper_fn()
-                raise e
+                    fn = self.fn
+                try:
+                    if self.on_start is not None:
+                        self.on_start(resource)
+                    return await call(fn, resource)
+                except TaskProcessError:
+                    if self.retry.retry_on_different_resource:
+                        avoid.add(resource)
+                    raise
+                finally:
+                    self.resource_pool.release(resource)
+                    logger.info(f"Released resource: {resource}")
+            else:
+                if self.on_start is not None:
+                    self.on_start(None)
+                return await call(self.fn, None)
+
+        async def run_once(avoid: set[Any]) -> RetT:
+            if self.concurrency_group is not None:
+                # The group slot is taken first, so that a task waiting for it does not hold a resource
+                slot = await self.concurrency_group.acquire(self.priority)
+                try:
+                    return await run_with_resource(avoid)
+                finally:
+                    self.concurrency_group.release(slot)
+            return await run_with_resource(avoid)
+
+        async def wait_upstreams():
+            await asyncio.wait(upstreams)
+            for upstream in upstreams:
+                if upstream.cancelled():
+                    raise TaskDependencyError(f"Task `{self.name}` waits for a task that was cancelled")
+                if (exception := upstream.exception()) is not None:
+                    message = f"Task `{self.name}` waits for a task that failed"
+                    raise TaskDependencyError(message) from exception
+
+        async def wrapper_fn() -> RetT:
+            if upstreams:
+                await wait_upstreams()
+            avoid = set(self.avoid_resources)
+            attempt = 1
+            while True:
+                try:
+                    return await run_once(avoid)
+                except TaskProcessError as e:
+                    logger.error(f"Failed to execute task: {e}")
+                    if not self.retry.should_retry(attempt, e.returncode):
+                        raise
+                    delay = self.retry.delay(attempt)
+                    attempt += 1
+                    logger.info(
+                        f"Retry task `{self.name}` after {delay:.1f} seconds "
+                        f"(attempt {attempt}/{self.retry.max_attempts})"
+                    )
+                    await asyncio.sleep(delay)
 
         return asyncio.create_task(wrapper_fn())
 
+    async def map(
+        self: Task[[Any], RetT],
+        items: Iterable[Any] | AsyncIterable[Any],
+        *,
+        max_in_flight: int = 64,
+        ordered: bool = False,
+    ) -> AsyncIterator[RetT]:
+        """Submit the task once per item and yield the results.
+
+        Each item is passed as the only argument of the task. Items are pulled from `items` as
+        submissions finish, so that at most `max_in_flight` of them are alive at a time whatever the
+        length of `items`. Results are yielded as they complete, or in the order of `items` when
+        `ordered` is set. If a submission fails, its exception is raised and the others are cancelled.
+
+        Example:
+        >>> square = Task(name="square", fn=lambda x: x * x)
+        >>> async def squares() -> list[int]:
+        ...     return [result async for result in square.map(range(5), max_in_flight=2, ordered=True)]
+        >>> asyncio.run(squares())
+        [0, 1, 4, 9, 16]
+        """
+        if max_in_flight < 1:
+            raise ValueError("`max_in_flight` must be at least 1")
+        if isinstance(items, AsyncIterable):
+            async_items = aiter(items)
+        else:
+            sync_items = iter(items)
+
+            async def next_items() -> AsyncIterator[Any]:
+                for item in sync_items:
+                    yield item
+
+            async_items = next_items()
+        # Submissions in the order of their items, some of which may be done but not yielded yet
+        in_flight: deque[asyncio.Task[RetT]] = deque()
+        exhausted = False
+
+        async def fill():
+            nonlocal exhausted
+            while not exhausted and len(in_flight) < max_in_flight:
+                try:
+                    item = await anext(async_items)
+                except StopAsyncIteration:
+                    exhausted = True
+                else:
+                    in_flight.append(self.submit(item))
+
+        try:
+            await fill()
+            while in_flight:
+                if ordered:
+                    running = in_flight.popleft()
+                    await asyncio.wait([running])
+                else:
+                    done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    running = next(running for running in in_flight if running in done)
+                    in_flight.remove(running)
+                result = running.result()
+                await fill()
+                yield result
+        finally:
+            for running in in_flight:
+                running.cancel()
+            if in_flight:
+                await asyncio.wait(in_flight)
+
 
 @overload
 def task[**InputT, RetT](fn: Callable[InputT, RetT]) -> Task[InputT, RetT]: ...
@@ -81,7 +285,11 @@ def task(
     *,
     name: str | None = None,
     resource_pool: ResourcePool[Any] | None = ...,
-    resource_modifier: Callable[[Callable[InputT, RetT], Any], Callable[InputT, RetT]] | None = None,
+    resource_modifier: Callable[[Callable[InputT, RetT], Any], Callable[InputT, RetT | Awaitable[RetT]]] | None = None,
+    backend: TaskBackend | None = None,
+    retry: RetryPolicy | None = None,
+    timeout: float | None = None,
+    shared_result: bool = False,
 ) -> Callable[[Callable[InputT, RetT]], Task[InputT, RetT]]: ...
 
 
@@ -90,7 +298,11 @@ def task(
     *,
     name: str | None = None,
     resource_pool: ResourcePool[Any] | None = None,
-    resource_modifier: Callable[[Callable[InputT, RetT], Any], Callable[InputT, RetT]] | None = None,
+    resource_modifier: Callable[[Callable[InputT, RetT], Any], Callable[InputT, RetT | Awaitable[RetT]]] | None = None,
+    backend: TaskBackend | None = None,
+    retry: RetryPolicy | None = None,
+    timeout: float | None = None,
+    shared_result: bool = False,
 ) -> Callable[[Callable[InputT, RetT]], Task[InputT, RetT]] | Task[InputT, RetT]:
     """Decorator to create a task.
 
@@ -105,6 +317,26 @@ def task(
     >>>     return a + b
     >>> my_task.name
     'custom_name'
+    >>> @task(backend="process")
+    >>> def cpu_bound_task(n: int) -> int:
+    >>>     return sum(i * i for i in range(n))
+    >>> cpu_bound_task.backend
+    'process'
+    >>> @task(retry=RetryPolicy(max_attempts=1))
+    >>> def flaky_task() -> None:
+    >>>     pass
+    >>> flaky_task.retry.max_attempts
+    1
+    >>> @task(timeout=60)
+    >>> def bounded_task() -> None:
+    >>>     pass
+    >>> bounded_task.timeout
+    60.0
+    >>> @task(backend="process", shared_result=True)
+    >>> def large_task() -> bytes:
+    >>>     return bytes(2**20)
+    >>> large_task.shared_result
+    True
     """
 
     def decorator(fn: Callable[InputT, RetT]) -> Task[InputT, RetT]:
@@ -113,6 +345,10 @@ def task(
             fn=fn,
             resource_pool=resource_pool,
             resource_modifier=resource_modifier,
+            backend=backend,
+            retry=retry or RetryPolicy(),
+            timeout=timeout,
+            shared_result=shared_result,
         )
 
     if fn is None:
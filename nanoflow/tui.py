@@ -7,7 +7,7 @@ from textual.containers import Vertical, VerticalScroll
 from textual.screen import ModalScreen
 from textual.widgets import Footer, Label, Markdown, RichLog, TabbedContent, Tabs
 
-from .config import WorkflowConfig
+from .config import WorkflowConfig, namespace_tasks
 
 
 class HelpScreen(ModalScreen[None]):
@@ -42,18 +42,20 @@ class Nanoflow(App[None]):
         Binding("f1,?", "help", "Help"),
     ]
 
-    def __init__(self, workflow_config: WorkflowConfig):
+    def __init__(self, *workflow_configs: WorkflowConfig):
         super().__init__()
-        self.workflow_config = workflow_config
+        self.workflow_configs = workflow_configs
+        # Task names may contain characters that are not allowed in widget ids
+        self.log_ids = {task_name: f"log-{i}" for i, task_name in enumerate(namespace_tasks(workflow_configs))}
 
     def update_log(self, task_name: str, line: bytes):
         if self.is_running:
-            self.query_one(f"#log-{task_name}", RichLog).write(line.decode())
+            self.query_one(f"#{self.log_ids[task_name]}", RichLog).write(line.decode())
 
     def compose(self) -> ComposeResult:
-        with TabbedContent(*list(self.workflow_config.tasks.keys())):
-            for task_name in self.workflow_config.tasks:
-                yield RichLog(id=f"log-{task_name}")
+        with TabbedContent(*self.log_ids):
+            for log_id in self.log_ids.values():
+                yield RichLog(id=log_id)
         yield Footer()
 
     def on_mount(self) -> None:
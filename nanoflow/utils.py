@@ -1,13 +1,23 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import os
-import subprocess
-from collections.abc import Callable
+import signal
+from collections.abc import Callable, Collection, Coroutine, Sequence
+from contextlib import suppress
+from statistics import median
+from typing import Any
 
 import networkx as nx
+from loguru import logger
 
-from .resource_pool import ResourcePool, UnlimitedPool
-from .task import Task, TaskProcessError, task
+from .backend import current_backends
+from .journal import RunJournal, TaskStatus
+from .launcher import STREAM_LIMIT, forward_lines, parse_module_command
+from .resource_pool import ConcurrencyGroup, ResourcePool, UnlimitedPool
+from .retry import RetryPolicy
+from .task import Task, TaskProcessError, TaskTimeoutError, run_with_timeout
 
 
 def layer_nodes(node_dependencies: dict[str, list[str]]) -> list[list[str]]:
@@ -30,24 +40,114 @@ def layer_nodes(node_dependencies: dict[str, list[str]]) -> list[list[str]]:
     return parallel_nodes
 
 
+def critical_path_priorities(
+    node_dependencies: dict[str, list[str]], durations: dict[str, float | None]
+) -> dict[str, float]:
+    """Length of the longest path from each node to a sink, weighted by the node durations.
+
+    Nodes without a known duration are assumed to take the median of the known durations.
+
+    Example:
+    >>> priorities = critical_path_priorities({"a": [], "b": ["a"], "c": ["a"]}, {"a": 1, "b": 5, "c": None})
+    >>> sorted(priorities.items())
+    [('a', 6.0), ('b', 5.0), ('c', 3.0)]
+    """
+    known_durations = [duration for duration in durations.values() if duration is not None]
+    default_duration = median(known_durations) if known_durations else 1.0
+
+    graph = nx.DiGraph()
+    for node, dependencies in node_dependencies.items():
+        graph.add_node(node)
+        for dependency in dependencies:
+            graph.add_edge(dependency, node)
+
+    priorities: dict[str, float] = {}
+    for node in reversed(list(nx.topological_sort(graph))):
+        duration = durations.get(node)
+        own_duration = float(default_duration if duration is None else duration)
+        priorities[node] = own_duration + max((priorities[succ] for succ in graph.successors(node)), default=0.0)
+    return priorities
+
+
+def hash_command(command: str) -> str:
+    return hashlib.sha256(command.encode()).hexdigest()[:16]
+
+
+async def kill_process_group(process: asyncio.subprocess.Process, grace: float):
+    """Send SIGTERM to the process group of `process`, then SIGKILL once it exits or `grace` seconds pass."""
+    with suppress(ProcessLookupError):
+        os.killpg(process.pid, signal.SIGTERM)
+    with suppress(TimeoutError):
+        await asyncio.wait_for(process.wait(), grace)
+    # Children may outlive the shell, so the group is killed even if the shell exited in time
+    with suppress(ProcessLookupError):
+        os.killpg(process.pid, signal.SIGKILL)
+    await process.wait()
+
+
 def create_command(
     name: str,
     command: str,
     *,
     update_hook: Callable[[str, bytes], None] | None = None,
     environ: dict[str, str] | None = None,
-) -> Callable[[], None]:
-    def inner_fn() -> None:
+    kill_grace: float = 5,
+    stderr_hook: Callable[[str, bytes], None] | None = None,
+    preload: Sequence[str] | None = None,
+) -> Callable[[], Coroutine[Any, Any, None]]:
+    """Create a coroutine function running `command` in a shell.
+
+    The output lines are passed to `update_hook`, and those on stderr to `stderr_hook` if given.
+    The command runs in its own process group. If the coroutine is cancelled, for example on
+    timeout, the whole group is terminated, and killed after `kill_grace` seconds.
+
+    With `preload`, a `python -m` command that needs no shell is forked from the fork server of
+    the current execution backends, which imported the `preload` modules beforehand.
+    """
+    module_command = parse_module_command(command) if preload is not None else None
+
+    async def run_in_shell() -> int:
         if update_hook is not None:
-            process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=environ)
-            assert process.stdout is not None
-            for line in process.stdout:
-                update_hook(name, line)
+            process = await asyncio.create_subprocess_shell(
+                command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=environ,
+                limit=STREAM_LIMIT,
+                start_new_session=True,
+            )
         else:
-            process = subprocess.Popen(command, shell=True, env=environ)
-        returncode = process.wait()
+            process = await asyncio.create_subprocess_shell(command, env=environ, start_new_session=True)
+        try:
+            if update_hook is not None:
+                assert process.stdout is not None and process.stderr is not None
+                await asyncio.gather(
+                    forward_lines(name, process.stdout, update_hook),
+                    forward_lines(name, process.stderr, stderr_hook or update_hook),
+                )
+            return await process.wait()
+        finally:
+            if process.returncode is None:
+                # Cancelling the task or failing to read its output must not leave the command running
+                await kill_process_group(process, kill_grace)
+
+    async def run_forked(module: str, args: list[str]) -> int:
+        assert preload is not None
+        fork_server = current_backends.get().get_fork_server(preload)
+        try:
+            return await fork_server.run(
+                name, module, args, environ=environ, update_hook=update_hook, kill_grace=kill_grace
+            )
+        except ChildProcessError as e:
+            raise TaskProcessError(str(e)) from e
+
+    async def inner_fn() -> None:
+        if module_command is not None:
+            returncode = await run_forked(*module_command)
+        else:
+            returncode = await run_in_shell()
         if returncode != 0:
-            raise TaskProcessError(f"Task `{name}` failed with return code {returncode}")
+            raise TaskProcessError(f"Task `{name}` failed with return code {returncode}", returncode)
 
     return inner_fn
 
@@ -58,15 +158,35 @@ def create_gpu_task(
     *,
     pool: ResourcePool,
     update_hook: Callable[[str, bytes], None] | None = None,
+    group: ConcurrencyGroup | None = None,
+    inputs: list[str] | None = None,
+    outputs: list[str] | None = None,
+    retry: RetryPolicy | None = None,
+    timeout: float | None = None,
+    kill_grace: float = 5,
+    preload: list[str] | None = None,
 ) -> Task[[], None]:
-    def set_visible_gpu(fn: Callable[[], None], resource: int) -> Callable[[], None]:
+    def set_visible_gpu(fn: Callable[[], None], resource: int) -> Callable[[], Coroutine[Any, Any, None]]:
         # TODO: To support custom resources, we need to set the resource in the environ
         environ = os.environ.copy()
         environ["CUDA_VISIBLE_DEVICES"] = str(resource)
         environ["FORCE_COLOR"] = "1"
-        return create_command(name, command, update_hook=update_hook, environ=environ)
+        return create_command(
+            name, command, update_hook=update_hook, environ=environ, kill_grace=kill_grace, preload=preload
+        )
 
-    return task(name=name, resource_pool=pool, resource_modifier=set_visible_gpu)(lambda: None)
+    return Task(
+        name=name,
+        fn=lambda: None,
+        resource_pool=pool,
+        resource_modifier=set_visible_gpu,
+        config_hash=hash_command(command),
+        concurrency_group=group,
+        inputs=inputs or [],
+        outputs=outputs or [],
+        retry=retry or RetryPolicy(),
+        timeout=timeout,
+    )
 
 
 def create_task(
@@ -75,12 +195,21 @@ def create_task(
     *,
     pool: ResourcePool | None = None,
     update_hook: Callable[[str, bytes], None] | None = None,
+    group: ConcurrencyGroup | None = None,
+    inputs: list[str] | None = None,
+    outputs: list[str] | None = None,
+    retry: RetryPolicy | None = None,
+    timeout: float | None = None,
+    kill_grace: float = 5,
+    preload: list[str] | None = None,
 ) -> Task[[], None]:
-    def set_base_environ(fn: Callable[[], None], resource: int) -> Callable[[], None]:
+    def set_base_environ(fn: Callable[[], None], resource: int) -> Callable[[], Coroutine[Any, Any, None]]:
         # TODO: To support custom resources, we need to set the resource in the environ
         environ = os.environ.copy()
         environ["FORCE_COLOR"] = "1"
-        return create_command(name, command, update_hook=update_hook, environ=environ)
+        return create_command(
+            name, command, update_hook=update_hook, environ=environ, kill_grace=kill_grace, preload=preload
+        )
 
     if pool is None:
         pool = UnlimitedPool(None)
@@ -89,4 +218,88 @@ def create_task(
         fn=lambda: None,
         resource_pool=pool,
         resource_modifier=set_base_environ,
+        config_hash=hash_command(command),
+        concurrency_group=group,
+        inputs=inputs or [],
+        outputs=outputs or [],
+        retry=retry or RetryPolicy(),
+        timeout=timeout,
+    )
+
+
+def create_chunk_task(
+    name: str,
+    commands: dict[str, str],
+    *,
+    pool: ResourcePool | None = None,
+    gpus: bool = False,
+    update_hook: Callable[[str, bytes], None] | None = None,
+    group: ConcurrencyGroup | None = None,
+    inputs: list[str] | None = None,
+    outputs: list[str] | None = None,
+    retry: RetryPolicy | None = None,
+    timeout: float | None = None,
+    kill_grace: float = 5,
+    preload: list[str] | None = None,
+    journal: RunJournal | None = None,
+    previous: Collection[tuple[str, str | None]] = (),
+) -> Task[[], None]:
+    """Create a task running the `commands` of a chunk of matrix members back to back on one resource.
+
+    The output of each member is passed to `update_hook` under the name of the member, and the
+    `timeout` applies to each member. A failing member does not stop the others, but the chunk
+    fails once they ran. When it is retried, only the members that did not succeed run again.
+    The finish of each member is recorded in the `journal`, and the members whose name and command
+    hash are in `previous`, the tasks that succeeded in a previous run, are skipped.
+    """
+    hashes = {member: hash_command(command) for member, command in commands.items()}
+    succeeded = {member for member, config_hash in hashes.items() if (member, config_hash) in previous}
+
+    async def run_member(member: str, command: str, environ: dict[str, str]):
+        command_fn = create_command(
+            member, command, update_hook=update_hook, environ=environ, kill_grace=kill_grace, preload=preload
+        )
+        await run_with_timeout(command_fn, timeout, member)
+
+    def run_members(fn: Callable[[], None], resource: Any) -> Callable[[], Coroutine[Any, Any, None]]:
+        environ = os.environ.copy()
+        environ["FORCE_COLOR"] = "1"
+        if gpus:
+            environ["CUDA_VISIBLE_DEVICES"] = str(resource)
+
+        async def inner_fn() -> None:
+            failures: list[TaskProcessError] = []
+            for member, command in commands.items():
+                if member in succeeded:
+                    continue
+                status: TaskStatus
+                returncode: int | None
+                try:
+                    await run_member(member, command, environ)
+                except TaskProcessError as e:
+                    logger.error(f"Task [blue]{member}[/blue] failed in chunk [blue]{name}[/blue]: {e}")
+                    failures.append(e)
+                    status, returncode = "timeout" if isinstance(e, TaskTimeoutError) else "failed", e.returncode
+                else:
+                    succeeded.add(member)
+                    status, returncode = "success", 0
+                if journal is not None:
+                    journal.record("finish", member, hashes[member], status=status, returncode=returncode)
+            if failures:
+                raise TaskProcessError(
+                    f"{len(failures)} of {len(commands)} tasks failed in chunk `{name}`", failures[0].returncode
+                )
+
+        return inner_fn
+
+    return Task(
+        name=name,
+        fn=lambda: None,
+        resource_pool=pool or UnlimitedPool(None),
+        resource_modifier=run_members,
+        config_hash=hash_command("\n".join(commands.values())),
+        concurrency_group=group,
+        inputs=inputs or [],
+        outputs=outputs or [],
+        retry=retry or RetryPolicy(),
     )
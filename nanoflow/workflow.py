@@ -6,18 +6,54 @@ from typing import Any, ParamSpec, overload
 
 from pydantic import BaseModel
 
+from .graph import WorkflowGraph
+
 P = ParamSpec("P")
 
 
 class Workflow[**P](BaseModel):
+    """Workflow defined by a coroutine function submitting tasks.
+
+    By default, the function runs as is, and each task starts when it is submitted. A `lazy`
+    workflow captures the tasks submitted by the function into a `WorkflowGraph` instead, then runs
+    the graph with the dependency scheduler, so that a task waits for the tasks whose results it
+    takes as arguments and nothing else.
+
+    Example:
+    >>> from nanoflow.task import task
+    >>> @task
+    >>> def add(a: int, b: int) -> int:
+    >>>     return a + b
+    >>> @workflow(lazy=True)
+    >>> async def sums():
+    >>>     await add.submit(await add.submit(1, 2), 3)
+    >>> graph = asyncio.run(sums.capture())
+    >>> graph.dependencies
+    {'0_add': [], '1_add': ['0_add']}
+    """
+
     name: str
     fn: Callable[P, Coroutine[Any, Any, None]]
+    lazy: bool = False
 
     async def __call__(self, *args: P.args, **kwargs: P.kwargs) -> None:
-        await self.fn(*args, **kwargs)
+        if not self.lazy:
+            await self.fn(*args, **kwargs)
+            return
+        graph = await self.capture(*args, **kwargs)
+        state = await graph.run()
+        if state.failed_task_count > 0:
+            raise RuntimeError(f"{state.failed_task_count} tasks failed in workflow `{self.name}`")
+
+    async def capture(self, *args: P.args, **kwargs: P.kwargs) -> WorkflowGraph:
+        """Run the function, recording the tasks it submits instead of running them."""
+        graph = WorkflowGraph()
+        with graph.capture():
+            await self.fn(*args, **kwargs)
+        return graph
 
     def run(self, *args: P.args, **kwargs: P.kwargs) -> None:
-        asyncio.run(self.fn(*args, **kwargs))
+        asyncio.run(self(*args, **kwargs))
 
 
 @overload
@@ -25,14 +61,16 @@ def workflow[**P](fn: Callable[P, Coroutine[Any, Any, None]]) -> Workflow[P]: ..
 
 
 @overload
-def workflow(*, name: str | None = ...) -> Callable[[Callable[P, Coroutine[Any, Any, None]]], Workflow[P]]: ...
+def workflow(
+    *, name: str | None = ..., lazy: bool = ...
+) -> Callable[[Callable[P, Coroutine[Any, Any, None]]], Workflow[P]]: ...
 
 
 def workflow[**P](
-    fn: Callable[P, Coroutine[Any, Any, None]] | None = None, *, name: str | None = None
+    fn: Callable[P, Coroutine[Any, Any, None]] | None = None, *, name: str | None = None, lazy: bool = False
 ) -> Callable[[Callable[P, Coroutine[Any, Any, None]]], Workflow[P]] | Workflow[P]:
     def decorator(fn: Callable[P, Coroutine[Any, Any, None]]) -> Workflow[P]:
-        return Workflow(name=name or getattr(fn, "__name__", "unnamed_workflow"), fn=fn)
+        return Workflow(name=name or getattr(fn, "__name__", "unnamed_workflow"), fn=fn, lazy=lazy)
 
     if fn is None:
         return decorator
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+
+import pytest
+
+from nanoflow.backend import (
+    ExecutionBackends,
+    WarmWorker,
+    call_by_reference,
+    current_backends,
+    default_backends,
+    process_target,
+)
+from nanoflow.executor import Executor
+from nanoflow.resource_pool import GPUResourcePool, ResourcePool
+from nanoflow.task import Task, TaskTimeoutError, task
+
+
+def get_pid() -> int:
+    return os.getpid()
+
+
+@task(backend="process")
+def decorated_get_pid(offset: int = 0) -> int:
+    return os.getpid() + offset
+
+
+WARM_CALLS: list[int] = []
+
+
+def count_warm_calls() -> tuple[int, int, str | None]:
+    """Return the pid, the number of calls in this process and the visible GPUs."""
+    WARM_CALLS.append(1)
+    return os.getpid(), len(WARM_CALLS), os.environ.get("CUDA_VISIBLE_DEVICES")
+
+
+def fail():
+    raise ValueError("failed in worker")
+
+
+class TestProcessTarget:
+    def test_module_level_function_is_called_by_reference(self):
+        """Test that module level functions are imported by the worker."""
+        target = process_target(get_pid)
+
+        assert target() == os.getpid()
+        assert target.args == (get_pid.__module__, "get_pid")  # type: ignore
+
+    def test_decorated_function_is_unwrapped(self):
+        """Test that a function replaced by its task can still be called by reference."""
+        assert call_by_reference(__name__, "decorated_get_pid", 1) == os.getpid() + 1
+
+    def test_local_function_is_passed_as_is(self):
+        """Test that functions that cannot be imported are passed unchanged."""
+
+        def local_fn():
+            pass
+
+        assert process_target(local_fn) is local_fn
+
+
+class TestExecutionBackends:
+    @pytest.mark.asyncio
+    async def test_process_backend_runs_in_another_process(self):
+        """Test that the process backend uses worker processes."""
+        backends = ExecutionBackends(max_workers=2)
+        try:
+            pids = await asyncio.gather(*[backends.run("process", get_pid) for _ in range(4)])
+        finally:
+            backends.shutdown()
+
+        assert os.getpid() not in pids
+        assert len(set(pids)) <= 2
+
+    @pytest.mark.asyncio
+    async def test_process_pool_is_reused(self):
+        """Test that the process pool is created once and reused."""
+        backends = ExecutionBackends(max_workers=1)
+        try:
+            first_pid = await backends.run("process", get_pid)
+            pool = backends.process_pool
+            second_pid = await backends.run("process", get_pid)
+        finally:
+            backends.shutdown()
+
+        assert backends.process_pool is None
+        assert pool is not None
+        assert first_pid == second_pid
+
+    @pytest.mark.asyncio
+    async def test_async_backend_awaits_coroutine(self):
+        """Test that the async backend runs coroutine functions on the event loop."""
+
+        async def get_loop():
+            return asyncio.get_running_loop()
+
+        assert await ExecutionBackends().run("async", get_loop) is asyncio.get_running_loop()
+
+    @pytest.mark.asyncio
+    async def test_thread_backend(self):
+        """Test that the thread backend runs functions outside of the event loop thread."""
+        main_thread_pid = os.getpid()
+        assert await ExecutionBackends().run("thread", get_pid) == main_thread_pid
+
+
+class TestTaskBackend:
+    @pytest.mark.asyncio
+    async def test_decorated_process_task(self):
+        """Test submitting a decorated task with the process backend."""
+        assert decorated_get_pid.backend == "process"
+        assert await decorated_get_pid.submit(0) != os.getpid()
+
+    @pytest.mark.asyncio
+    async def test_coroutine_function_defaults_to_async(self):
+        """Test that coroutine functions are awaited without a backend."""
+
+        async def add(a: int, b: int) -> int:
+            await asyncio.sleep(0)
+            return a + b
+
+        assert await Task(name="add", fn=add).submit(1, 2) == 3
+
+    @pytest.mark.asyncio
+    async def test_executor_owns_process_pool(self):
+        """Test that tasks submitted by an executor use its pool, which is shut down afterwards."""
+        pids = []
+
+        async def record_pid():
+            assert current_backends.get() is executor.backends
+            pids.append(await current_backends.get().run("process", get_pid))
+
+        tasks = [Task(name=f"task{i}", fn=record_pid) for i in range(3)]
+        executor = Executor([tasks], dependencies={task.name: [] for task in tasks}, process_workers=1)
+
+        await executor.run_async()
+
+        assert len(set(pids)) == 1
+        assert executor.backends.process_pool is None
+        assert current_backends.get() is default_backends
+
+
+class TestWarmBackend:
+    @pytest.mark.asyncio
+    async def test_worker_stays_warm(self):
+        """Test that the tasks of a resource share one long-lived process."""
+        backends = ExecutionBackends()
+        try:
+            first = await backends.run_warm(0, {"CUDA_VISIBLE_DEVICES": "0"}, count_warm_calls)
+            second = await backends.run_warm(0, {"CUDA_VISIBLE_DEVICES": "0"}, count_warm_calls)
+            other = await backends.run_warm(1, {"CUDA_VISIBLE_DEVICES": "1"}, count_warm_calls)
+        finally:
+            backends.shutdown()
+
+        assert first[0] == second[0] != os.getpid()
+        assert (first[1], second[1]) == (1, 2)
+        assert other[0] != first[0]
+        assert (first[2], other[2]) == ("0", "1")
+        assert backends.warm_workers == {}
+
+    @pytest.mark.asyncio
+    async def test_worker_recycling(self):
+        """Test that a worker is replaced after `warm_max_tasks` tasks or past `warm_max_rss`."""
+        backends = ExecutionBackends(warm_max_tasks=2)
+        try:
+            pids = [(await backends.run_warm(None, {}, count_warm_calls))[0] for _ in range(3)]
+        finally:
+            backends.shutdown()
+        assert pids[0] == pids[1] != pids[2]
+
+        backends = ExecutionBackends(warm_max_rss=1)
+        try:
+            pids = [(await backends.run_warm(None, {}, count_warm_calls))[0] for _ in range(2)]
+        finally:
+            backends.shutdown()
+        assert pids[0] != pids[1]
+
+    @pytest.mark.asyncio
+    async def test_concurrent_tasks_with_recycling(self):
+        """Test that tasks of one key wait for each other while their worker is recycled."""
+        backends = ExecutionBackends(warm_max_tasks=1)
+        try:
+            results = await asyncio.gather(*(backends.run_warm(0, {}, count_warm_calls) for _ in range(3)))
+        finally:
+            backends.shutdown()
+
+        assert len({pid for pid, *_ in results}) == 3
+        assert [count for _, count, _ in results] == [1, 1, 1]
+
+    @pytest.mark.asyncio
+    async def test_worker_exception(self):
+        """Test that exceptions raised in the worker are raised by the task, which keeps the worker."""
+        worker = WarmWorker({})
+        try:
+            with pytest.raises(ValueError, match="failed in worker"):
+                await worker.run(fail)
+            assert worker.alive
+        finally:
+            worker.close()
+
+    @pytest.mark.asyncio
+    async def test_timeout_kills_worker(self):
+        """Test that a warm task running past its timeout kills its worker."""
+        backends = ExecutionBackends()
+        token = current_backends.set(backends)
+        try:
+            slow_task = Task(name="slow", fn=time.sleep, backend="warm", timeout=0.5)
+            slow_task.retry.max_attempts = 1
+            with pytest.raises(TaskTimeoutError):
+                await slow_task.submit(30)
+            assert backends.warm_workers == {}
+        finally:
+            current_backends.reset(token)
+            backends.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_gpu_task_sees_its_gpu(self, monkeypatch):
+        """Test that warm tasks of a GPU pool run in a worker that only sees their GPU."""
+        monkeypatch.setattr(GPUResourcePool, "get_available_resources", lambda self: {"3"})
+        pool = GPUResourcePool()
+        warm_task = Task(name="warm", fn=count_warm_calls, backend="warm", resource_pool=pool)
+        other_task = Task(name="other", fn=count_warm_calls, backend="warm", resource_pool=ResourcePool(["3"]))
+        executor = Executor([[warm_task]], dependencies={"warm": []})
+        token = current_backends.set(executor.backends)
+        try:
+            _, _, visible = await warm_task.submit()
+            _, _, other_visible = await other_task.submit()
+        finally:
+            current_backends.reset(token)
+            executor.backends.shutdown()
+
+        assert visible == "3"
+        assert other_visible is None
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+import time
+from collections.abc import Callable
+
+import pytest
+
+from nanoflow.backend import ExecutionBackends, current_backends
+from nanoflow.config import TaskConfig, WorkflowConfig, flatten_matrix
+from nanoflow.executor import Executor, SchedulerMode
+from nanoflow.task import Task
+from nanoflow.utils import create_command, create_task, layer_nodes
+
+
+def sleep_task(name: str, seconds: float) -> Task[[], None]:
+    return Task(name=name, fn=lambda: time.sleep(seconds))
+
+
+def skewed_executor(scheduler: SchedulerMode) -> Executor:
+    """One slow chain next to several fast chains, so every layer has a straggler."""
+    depth, width = 4, 4
+    dependencies: dict[str, list[str]] = {}
+    layers: list[list[Task[[], None]]] = [[] for _ in range(depth)]
+    for level in range(depth):
+        layers[level].append(sleep_task(f"slow_{level}", 0.2 if level == 0 else 0.01))
+        dependencies[f"slow_{level}"] = [f"slow_{level - 1}"] if level else []
+        for i in range(width):
+            name = f"fast_{i}_{level}"
+            layers[level].append(sleep_task(name, 0.05))
+            dependencies[name] = [f"fast_{i}_{level - 1}"] if level else []
+    return Executor(layers, dependencies=dependencies, scheduler=scheduler)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("scheduler", ["dependency", "layered"])
+def test_skewed_dag_makespan(scheduler: SchedulerMode):
+    executor = skewed_executor(scheduler)
+    asyncio.run(executor.run_async())
+    assert executor.state.completed_task_count == executor.state.total_task_count
+
+
+def test_dependency_scheduler_shortens_skewed_makespan():
+    makespans = {}
+    for scheduler in ("dependency", "layered"):
+        executor = skewed_executor(scheduler)
+        start = time.perf_counter()
+        asyncio.run(executor.run_async())
+        makespans[scheduler] = time.perf_counter() - start
+
+    assert makespans["dependency"] < makespans["layered"]
+
+
+def noop_executor(scheduler: SchedulerMode, count: int = 500) -> Executor:
+    """Independent no-op tasks followed by a chain of no-op tasks."""
+    dependencies: dict[str, list[str]] = {f"wide_{i}": [] for i in range(count)}
+    dependencies.update({f"chain_{i}": [f"chain_{i - 1}"] if i else [] for i in range(count // 10)})
+    task_map = {name: Task(name=name, fn=lambda: None) for name in dependencies}
+    layers = [[task_map[name] for name in layer] for layer in layer_nodes(dependencies)]
+    return Executor(layers, dependencies=dependencies, scheduler=scheduler)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("scheduler", ["dependency", "layered"])
+def test_noop_task_scheduling_overhead(scheduler: SchedulerMode):
+    executor = noop_executor(scheduler)
+    start = time.perf_counter()
+    asyncio.run(executor.run_async())
+    elapsed = time.perf_counter() - start
+
+    assert executor.state.completed_task_count == executor.state.total_task_count
+    # Without polling, a chain of no-op tasks no longer pays a fixed delay per completion
+    assert elapsed / executor.state.total_task_count < 0.01
+
+
+@pytest.mark.benchmark
+def test_concurrent_sleep_commands():
+    count = 1000
+    dependencies: dict[str, list[str]] = {f"sleep_{i}": [] for i in range(count)}
+    tasks = [create_task(name, "sleep 1") for name in dependencies]
+    executor = Executor([tasks], dependencies=dependencies)
+
+    start = time.perf_counter()
+    asyncio.run(executor.run_async())
+    elapsed = time.perf_counter() - start
+
+    assert executor.state.completed_task_count == count
+    # With one thread per command, the default thread pool would run these in batches of at most 32
+    assert elapsed < count / 32
+
+
+async def module_command_latencies(command: str, count: int, preload: list[str]) -> tuple[float, float]:
+    """Mean latencies of running `command` `count` times in a row in a shell, then with a fork server."""
+    latencies = []
+    for task_preload in (None, preload):
+        # The first run starts the fork server
+        await create_command("latency", command, update_hook=lambda *_: None, preload=task_preload)()
+        start = time.perf_counter()
+        for _ in range(count):
+            await create_command("latency", command, update_hook=lambda *_: None, preload=task_preload)()
+        latencies.append((time.perf_counter() - start) / count)
+    return latencies[0], latencies[1]
+
+
+@pytest.mark.benchmark
+def test_fork_server_module_latency(tmp_path, monkeypatch):
+    (tmp_path / "heavy.py").write_text("import pydantic\nimport loguru\n")
+    monkeypatch.chdir(tmp_path)
+    backends = ExecutionBackends()
+    token = current_backends.set(backends)
+    try:
+        shell, forked = asyncio.run(module_command_latencies(f"{sys.executable} -m heavy", 10, ["pydantic", "loguru"]))
+    finally:
+        current_backends.reset(token)
+        backends.shutdown()
+
+    # Children of the template skip the interpreter startup and the preloaded imports
+    assert forked < shell
+
+
+SWEEP = {
+    "name": "sweep",
+    "matrix": {"seed": {"range": [0, 1000]}, "lr": {"logspace": [-5, -1, 10]}, "dataset": [f"d{i}" for i in range(10)]},
+    "tasks": {
+        "train": {
+            "command": "python -m train",
+            "args": ["--seed {seed}", "--lr {lr}", "--data {dataset}"],
+            "outputs": ["runs/{dataset}/{seed}/{lr}.pt"],
+        }
+    },
+}
+
+
+def expansion_throughput(count: int, expand: Callable[[int], object]) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        expand(i)
+    return count / (time.perf_counter() - start)
+
+
+@pytest.mark.benchmark
+def test_matrix_expansion_throughput():
+    config = WorkflowConfig.model_validate(SWEEP)
+    assert len(config.expanded_tasks) == 100_000
+    names = list(config.expanded_tasks)
+    compiled = expansion_throughput(len(names), lambda i: config.expanded_tasks[names[i]])
+    template = TaskConfig.model_validate(SWEEP["tasks"]["train"])
+    combinations = list(flatten_matrix(WorkflowConfig.model_validate({**SWEEP, "tasks": {}}).matrix or {}))
+    # Expanding a combination used to deep copy its config task, then parse and format each of its strings
+    copied = expansion_throughput(
+        len(combinations) // 10, lambda i: template.model_copy(deep=True).format(combinations[i], inplace=True)
+    )
+
+    assert compiled > 1.5 * copied, f"{compiled:.0f} tasks/s compiled, {copied:.0f} tasks/s with deep copies"
@@ -57,3 +57,47 @@ class TestCLI:
         assert "config_path" in params
         assert "use_tui" in params
         assert "try_run" in params
+
+    def test_run_resume(self, tmp_path, monkeypatch):
+        """Test that a resumed run skips the tasks that succeeded before."""
+        config_path = tmp_path / "workflow.toml"
+        output_path = tmp_path / "out.txt"
+        config_path.write_text(f'name = "resume example"\n[tasks.a]\ncommand = "echo a >> {output_path}"\n')
+        monkeypatch.chdir(tmp_path)
+        runner = CliRunner()
+
+        assert runner.invoke(app, ["run", str(config_path)]).exit_code == 0
+        assert runner.invoke(app, ["run", str(config_path), "--resume"]).exit_code == 0
+        assert (tmp_path / "out.txt").read_text() == "a\n"
+        assert (tmp_path / ".nanoflow" / "journals" / "resume-example.jsonl").exists()
+
+        assert runner.invoke(app, ["run", str(config_path)]).exit_code == 0
+        assert (tmp_path / "out.txt").read_text() == "a\na\n"
+
+    def test_run_multiple_configs(self, tmp_path, monkeypatch):
+        """Test that several workflows run together in one command."""
+        output_path = tmp_path / "out.txt"
+        for name in ("first", "second"):
+            config = f'name = "{name}"\nresources = ["r1"]\n[tasks.a]\ncommand = "echo {name} >> {output_path}"\n'
+            (tmp_path / f"{name}.toml").write_text(config)
+        monkeypatch.chdir(tmp_path)
+        runner = CliRunner()
+
+        result = runner.invoke(app, ["run", str(tmp_path / "first.toml"), str(tmp_path / "second.toml")])
+
+        assert result.exit_code == 0
+        assert sorted(output_path.read_text().split()) == ["first", "second"]
+        assert (tmp_path / ".nanoflow" / "journals" / "first-second.jsonl").exists()
+
+    def test_run_max_in_flight(self, tmp_path, monkeypatch):
+        """Test that `--max-in-flight` caps the tasks without resources running at once."""
+        config_path = tmp_path / "workflow.toml"
+        config_path.write_text(
+            'name = "capped"\n[tasks.a]\ncommand = "mkdir lock && sleep 0.2 && rmdir lock"\n'
+            '[tasks.a.matrix]\nx = ["1", "2", "3"]\n[tasks.a.retry]\nmax_attempts = 1\n'
+        )
+        monkeypatch.chdir(tmp_path)
+        runner = CliRunner()
+
+        assert runner.invoke(app, ["run", str(config_path), "--max-in-flight", "1"]).exit_code == 0
+        assert runner.invoke(app, ["run", str(config_path), "--max-in-flight", "0"]).exit_code != 0
@@ -1,8 +1,22 @@
 from __future__ import annotations
 
+import itertools
+
 import pytest
 
-from nanoflow.config import DefaultDict, TaskConfig, WorkflowConfig, flatten_matrix
+from nanoflow.config import (
+    CompiledTemplate,
+    DefaultDict,
+    LinspaceAxis,
+    LogspaceAxis,
+    RangeAxis,
+    TaskConfig,
+    TaskSpec,
+    WorkflowConfig,
+    flatten_matrix,
+    merge_nodes,
+    namespace_tasks,
+)
 
 
 class TestDefaultDict:
@@ -89,9 +103,7 @@ class TestFlattenMatrix:
         """Test flattening empty matrix."""
         matrix = {}
 
-        # Empty matrix causes ValueError in the current implementation
-        # This is expected behavior based on the implementation
-        with pytest.raises(ValueError, match="not enough values to unpack"):
+        with pytest.raises(ValueError, match="at least one key"):
             list(flatten_matrix(matrix))
 
     def test_flatten_matrix_single_value_lists(self):
@@ -105,6 +117,81 @@ class TestFlattenMatrix:
         assert result[0]["single_env"] == "production"
 
 
+class TestMatrixAxes:
+    def test_range_axis(self):
+        """Test that a range axis computes its values from their index."""
+        axis = RangeAxis(range=(0, 10**9))
+
+        assert len(axis) == 10**9
+        assert axis[0] == "0"
+        assert axis[123456789] == "123456789"
+        assert axis[-1] == str(10**9 - 1)
+        assert list(RangeAxis(range=(1, 8, 3)).values()) == ["1", "4", "7"]
+        with pytest.raises(IndexError):
+            axis[10**9]
+
+    def test_range_axis_zero_step(self):
+        """Test that a range with a zero step is rejected."""
+        with pytest.raises(ValueError, match="cannot be zero"):
+            RangeAxis(range=(0, 10, 0))
+
+    def test_space_axes(self):
+        """Test that linspace and logspace axes include both ends, like NumPy."""
+        assert list(LinspaceAxis(linspace=(0.1, 0.5, 5)).values()) == ["0.1", "0.2", "0.3", "0.4", "0.5"]
+        assert list(LinspaceAxis(linspace=(3, 4, 1)).values()) == ["3"]
+        assert list(LogspaceAxis(logspace=(-4, -2, 3)).values()) == ["0.0001", "0.001", "0.01"]
+        with pytest.raises(ValueError):
+            LinspaceAxis(linspace=(0, 1, 0))
+
+    def test_axes_from_toml_tables(self):
+        """Test that matrix values can be given as generator tables, and unknown tables are rejected."""
+        config = TaskConfig.model_validate(
+            {
+                "command": "train --seed {seed} --lr {lr} --model {model}",
+                "matrix": {"seed": {"range": [0, 3]}, "lr": {"logspace": [-3, -1, 3]}, "model": ["a", "b"]},
+            }
+        )
+
+        combinations = list(flatten_matrix(config.matrix or {}))
+        assert len(combinations) == 18
+        assert combinations[0] == {"seed": "0", "lr": "0.001", "model": "a"}
+        assert combinations[-1] == {"seed": "2", "lr": "0.1", "model": "b"}
+        with pytest.raises(ValueError):
+            TaskConfig.model_validate({"command": "train", "matrix": {"seed": {"arange": [0, 3]}}})
+
+
+class TestCompiledTemplate:
+    @pytest.mark.parametrize(
+        "source",
+        [
+            "echo {a} {b}",
+            "{a}{a}{a}",
+            "no fields",
+            "{{escaped}} {a} 50% %s",
+            "{a:>4}|{b!r}|{missing}",
+            "glob/{x,y}/*.csv",
+        ],
+    )
+    def test_compiled_template_matches_format_map(self, source: str):
+        """Test that rendering a compiled template gives the same string as `format_map`."""
+        values = DefaultDict(a="1", b="two")
+
+        assert CompiledTemplate(source).render(values) == source.format_map(values)
+
+    def test_compiled_template_missing_key(self):
+        """Test that missing keys raise like `format_map` unless the values default to the field."""
+        template = CompiledTemplate("echo {a}")
+
+        with pytest.raises(KeyError, match="a"):
+            template.render({})
+        assert template.render(DefaultDict()) == "echo {a}"
+
+    def test_compiled_template_invalid(self):
+        """Test that invalid templates are rejected when compiled."""
+        with pytest.raises(ValueError):
+            CompiledTemplate("echo {a")
+
+
 class TestTaskConfig:
     def test_task_config_basic(self):
         """Test basic TaskConfig creation and usage."""
@@ -246,12 +333,25 @@ class TestWorkflowConfig:
         )
 
         # After model_post_init, tasks should be prefixed with "0_"
-        assert "0_task1" in config.tasks
-        assert "0_task2" in config.tasks
-        assert len(config.tasks) == 2
+        assert "0_task1" in config.expanded_tasks
+        assert "0_task2" in config.expanded_tasks
+        assert len(config.expanded_tasks) == 2
 
         # Dependencies should be updated
-        assert config.tasks["0_task2"].deps == ["0_task1"]
+        assert config.expanded_tasks["0_task2"].deps == ["0_task1"]
+
+    def test_workflow_config_dump(self):
+        """Test WorkflowConfig dumps its declared tasks and loads back from the dump."""
+        config = WorkflowConfig(
+            name="dump_workflow",
+            matrix={"env": ["dev", "prod"]},
+            tasks={"task1": TaskConfig(command="echo", args=["{env}"])},
+        )
+
+        assert list(config.model_dump()["tasks"]) == ["task1"]
+        loaded = WorkflowConfig.model_validate_json(config.model_dump_json())
+        assert loaded.tasks == config.tasks
+        assert list(loaded.expanded_tasks) == ["0_task1", "1_task1"]
 
     def test_workflow_config_with_workflow_matrix(self):
         """Test WorkflowConfig with workflow-level matrix."""
@@ -265,19 +365,19 @@ class TestWorkflowConfig:
         )
 
         # Should have tasks for both matrix values
-        assert "0_task1" in config.tasks  # dev environment
-        assert "0_task2" in config.tasks  # dev environment
-        assert "1_task1" in config.tasks  # prod environment
-        assert "1_task2" in config.tasks  # prod environment
-        assert len(config.tasks) == 4
+        assert "0_task1" in config.expanded_tasks  # dev environment
+        assert "0_task2" in config.expanded_tasks  # dev environment
+        assert "1_task1" in config.expanded_tasks  # prod environment
+        assert "1_task2" in config.expanded_tasks  # prod environment
+        assert len(config.expanded_tasks) == 4
 
         # Check template substitution
-        assert "dev" in config.tasks["0_task1"].get_command()
-        assert "prod" in config.tasks["1_task1"].get_command()
+        assert "dev" in config.expanded_tasks["0_task1"].get_command()
+        assert "prod" in config.expanded_tasks["1_task1"].get_command()
 
         # Check dependencies are updated
-        assert config.tasks["0_task2"].deps == ["0_task1"]
-        assert config.tasks["1_task2"].deps == ["1_task1"]
+        assert config.expanded_tasks["0_task2"].deps == ["0_task1"]
+        assert config.expanded_tasks["1_task2"].deps == ["1_task1"]
 
     def test_workflow_config_with_task_matrix(self):
         """Test WorkflowConfig with task-level matrix."""
@@ -292,10 +392,10 @@ class TestWorkflowConfig:
         # Should expand task matrix - actual naming uses index suffix, not colon format
         expected_tasks = ["0_test", "0_test_1", "0_after"]
         for task_name in expected_tasks:
-            assert task_name in config.tasks
+            assert task_name in config.expanded_tasks
 
         # Check dependencies are properly updated
-        assert config.tasks["0_after"].deps == ["0_test"]
+        assert config.expanded_tasks["0_after"].deps == ["0_test"]
 
     def test_workflow_config_to_nodes(self):
         """Test converting WorkflowConfig to node dependencies."""
@@ -336,27 +436,27 @@ class TestWorkflowConfig:
         )
 
         # Should have: 2 env * (1 build + 2 test) = 6 tasks total
-        assert len(config.tasks) == 6
+        assert len(config.expanded_tasks) == 6
 
         # Check dev environment tasks
-        assert "0_build" in config.tasks
-        assert "0_test" in config.tasks
-        assert "0_test_1" in config.tasks
+        assert "0_build" in config.expanded_tasks
+        assert "0_test" in config.expanded_tasks
+        assert "0_test_1" in config.expanded_tasks
 
         # Check prod environment tasks
-        assert "1_build" in config.tasks
-        assert "1_test" in config.tasks
-        assert "1_test_1" in config.tasks
+        assert "1_build" in config.expanded_tasks
+        assert "1_test" in config.expanded_tasks
+        assert "1_test_1" in config.expanded_tasks
 
         # Check dependencies within each environment
-        assert config.tasks["0_test"].deps == ["0_build"]
-        assert config.tasks["1_test_1"].deps == ["1_build"]
+        assert config.expanded_tasks["0_test"].deps == ["0_build"]
+        assert config.expanded_tasks["1_test_1"].deps == ["1_build"]
 
     def test_workflow_config_empty_tasks(self):
         """Test WorkflowConfig with no tasks."""
         config = WorkflowConfig(name="empty", tasks={})
 
-        assert len(config.tasks) == 0
+        assert len(config.expanded_tasks) == 0
 
     def test_workflow_config_single_task_matrix(self):
         """Test WorkflowConfig with single task having matrix."""
@@ -365,7 +465,197 @@ class TestWorkflowConfig:
             tasks={"single": TaskConfig(command="echo", args=["{version}"], matrix={"version": ["1", "2", "3"]})},
         )
 
-        assert len(config.tasks) == 3
-        assert "0_single" in config.tasks
-        assert "0_single_1" in config.tasks
-        assert "0_single_2" in config.tasks
+        assert len(config.expanded_tasks) == 3
+        assert "0_single" in config.expanded_tasks
+        assert "0_single_1" in config.expanded_tasks
+        assert "0_single_2" in config.expanded_tasks
+
+    def test_workflow_config_concurrency_groups(self):
+        """Test WorkflowConfig with named concurrency groups."""
+        config = WorkflowConfig(
+            name="groups",
+            concurrency={"nfs": 4, "db": 1},
+            tasks={
+                "copy": TaskConfig(command="cp", args=["{i}"], matrix={"i": ["1", "2"]}, group="nfs"),
+                "load": TaskConfig(command="load", group="db"),
+                "free": TaskConfig(command="echo"),
+            },
+        )
+
+        assert config.concurrency == {"nfs": 4, "db": 1}
+        assert config.expanded_tasks["0_copy"].group == "nfs"
+        assert config.expanded_tasks["0_copy_1"].group == "nfs"
+        assert config.expanded_tasks["0_load"].group == "db"
+        assert config.expanded_tasks["0_free"].group is None
+
+    def test_workflow_config_undefined_concurrency_group(self):
+        """Test that using an undefined concurrency group is rejected."""
+        with pytest.raises(ValueError, match="undefined concurrency group `db`"):
+            WorkflowConfig(name="groups", tasks={"load": TaskConfig(command="load", group="db")})
+
+    def test_workflow_config_invalid_concurrency_limit(self):
+        """Test that concurrency limits must be positive."""
+        with pytest.raises(ValueError):
+            WorkflowConfig(name="groups", concurrency={"db": 0}, tasks={})
+
+    def test_task_config_inputs_and_outputs(self):
+        """Test that inputs and outputs are formatted with the matrix values."""
+        config = WorkflowConfig(
+            name="files",
+            tasks={
+                "convert": TaskConfig(
+                    command="convert",
+                    args=["{name}"],
+                    matrix={"name": ["a", "b"]},
+                    inputs=["raw/{name}/*.csv"],
+                    outputs=["out/{name}.parquet"],
+                )
+            },
+        )
+
+        assert config.expanded_tasks["0_convert"].inputs == ["raw/a/*.csv"]
+        assert config.expanded_tasks["0_convert"].outputs == ["out/a.parquet"]
+        assert config.expanded_tasks["0_convert_1"].inputs == ["raw/b/*.csv"]
+        assert config.expanded_tasks["0_convert_1"].outputs == ["out/b.parquet"]
+
+    def test_task_config_retry(self):
+        """Test that a retry policy is read from the config and kept for every expanded task."""
+        config = WorkflowConfig.model_validate(
+            {
+                "name": "retry",
+                "matrix": {"seed": ["1", "2"]},
+                "tasks": {
+                    "train": {
+                        "command": "train {seed}",
+                        "retry": {"max_attempts": 2, "retry_on_exit_codes": [1], "retry_on_different_resource": True},
+                    },
+                    "eval": {"command": "eval {seed}"},
+                },
+            }
+        )
+
+        retry = config.expanded_tasks["1_train"].retry
+        assert retry is not None
+        assert retry.max_attempts == 2
+        assert retry.retry_on_exit_codes == [1]
+        assert retry.retry_on_different_resource
+        assert config.expanded_tasks["1_eval"].retry is None
+
+    def test_task_config_timeout(self):
+        """Test that timeouts are validated and kept for expanded tasks."""
+        config = WorkflowConfig.model_validate(
+            {"name": "timeout", "tasks": {"load": {"command": "load", "timeout": 60, "kill_grace": 1}}}
+        )
+
+        assert config.expanded_tasks["0_load"].timeout == 60
+        assert config.expanded_tasks["0_load"].kill_grace == 1
+        with pytest.raises(ValueError):
+            TaskConfig(command="load", timeout=0)
+
+    def test_task_config_chunk(self):
+        """Test that matrix combinations are grouped into chunks of `chunk_size`."""
+        config = WorkflowConfig.model_validate(
+            {
+                "name": "chunks",
+                "tasks": {
+                    "sweep": {"command": "run {x}", "matrix": {"x": ["1", "2", "3"]}, "chunk_size": 2},
+                    "report": {"command": "report"},
+                },
+            }
+        )
+
+        assert {name: task.chunk for name, task in config.expanded_tasks.items()} == {
+            "0_sweep": "0_sweep_chunk_0",
+            "0_sweep_1": "0_sweep_chunk_0",
+            "0_sweep_2": "0_sweep_chunk_1",
+            "0_report": None,
+        }
+
+    def test_workflow_config_lazy_expansion(self):
+        """Test that a large workflow matrix is expanded on lookup, in the order of the combinations."""
+        config = WorkflowConfig.model_validate(
+            {
+                "name": "sweep",
+                "matrix": {"seed": {"range": [0, 100000]}, "lr": {"logspace": [-5, -1, 5]}},
+                "tasks": {
+                    "train": {"command": "train --seed {seed} --lr {lr}"},
+                    "eval": {"command": "eval --seed {seed}", "deps": ["train"]},
+                },
+            }
+        )
+
+        assert len(config.expanded_tasks) == 1000000
+        assert list(itertools.islice(config.expanded_tasks, 4)) == ["0_train", "0_eval", "1_train", "1_eval"]
+        assert config.expanded_tasks["6_train"].get_command() == "train --seed 1 --lr 0.0001 "
+        assert config.expanded_tasks["499999_eval"].deps == ["499999_train"]
+        assert config.expanded_tasks["499999_eval"].get_command() == "eval --seed 99999 "
+        assert "500000_train" not in config.expanded_tasks
+        assert "01_train" not in config.expanded_tasks
+        with pytest.raises(KeyError):
+            config.expanded_tasks["500000_train"]
+
+    def test_workflow_config_task_specs(self):
+        """Test that expanded tasks are immutable specs, with task matrix values taking precedence."""
+        config = WorkflowConfig(
+            name="specs",
+            matrix={"x": ["w"], "y": ["1"]},
+            tasks={"t": TaskConfig(command="run", args=["{x}", "{y}"], matrix={"x": ["t"]}, outputs=["{x}/{y}"])},
+        )
+
+        spec = config.expanded_tasks["0_t"]
+        assert isinstance(spec, TaskSpec)
+        assert spec.get_command() == "run t 1"
+        assert spec.outputs == ["t/1"]
+        assert spec.origin == "t"
+        with pytest.raises(AttributeError):
+            spec.command = "rm"  # type: ignore[misc]
+
+    def test_workflow_config_ignores_expansion_fields(self):
+        """Test that the origin and chunk of expanded tasks cannot be set from the config."""
+        config = WorkflowConfig.model_validate(
+            {"name": "fields", "tasks": {"t": {"command": "run", "origin": "other", "chunk": "shared"}}}
+        )
+
+        spec = config.expanded_tasks["0_t"]
+        assert spec.origin == "t"
+        assert spec.chunk is None
+
+    def test_workflow_config_template_error(self):
+        """Test that errors in the templates are raised when the config is loaded."""
+        with pytest.raises(KeyError, match="missing"):
+            WorkflowConfig(name="broken", tasks={"task1": TaskConfig(command="echo {missing}")})
+
+
+class TestMergeWorkflows:
+    def test_namespace_tasks(self):
+        """Test that tasks of several workflows are prefixed with their workflow name."""
+        first = WorkflowConfig(name="first", tasks={"a": TaskConfig(command="echo")})
+        second = WorkflowConfig(name="second", tasks={"a": TaskConfig(command="echo")})
+
+        tasks = namespace_tasks([first, second])
+
+        assert tasks == {"first/0_a": (first, "0_a"), "second/0_a": (second, "0_a")}
+        assert namespace_tasks([first]) == {"0_a": (first, "0_a")}
+
+    def test_namespace_tasks_duplicate_workflows(self):
+        """Test that two workflows with the same name are rejected."""
+        config = WorkflowConfig(name="same", tasks={"a": TaskConfig(command="echo")})
+
+        with pytest.raises(ValueError, match="more than once"):
+            namespace_tasks([config, config])
+
+    def test_merge_nodes(self):
+        """Test that dependencies stay within their own workflow."""
+        first = WorkflowConfig(
+            name="first", tasks={"a": TaskConfig(command="echo"), "b": TaskConfig(command="echo", deps=["a"])}
+        )
+        second = WorkflowConfig(
+            name="second", tasks={"a": TaskConfig(command="echo"), "b": TaskConfig(command="echo", deps=["a"])}
+        )
+
+        assert merge_nodes([first, second]) == {
+            "first/0_a": [],
+            "first/0_b": ["first/0_a"],
+            "second/0_a": [],
+            "second/0_b": ["second/0_a"],
+        }
@@ -1,11 +1,21 @@
 from __future__ import annotations
 
+import asyncio
+import functools
+import json
+import time
 from unittest.mock import AsyncMock, Mock, patch
 
 import pytest
 
 from nanoflow.config import TaskConfig, WorkflowConfig
-from nanoflow.executor import Executor, ExecutorState
+from nanoflow.executor import DEFAULT_MAX_IN_FLIGHT, Executor, ExecutorState
+from nanoflow.fingerprint import FingerprintIndex
+from nanoflow.history import DurationHistory
+from nanoflow.journal import RunJournal
+from nanoflow.resource_pool import ResourcePool
+from nanoflow.retry import RetryPolicy
+from nanoflow.task import Task, TaskProcessError
 
 
 class TestExecutorState:
@@ -37,6 +47,12 @@ class TestExecutorState:
         assert state.remaining_task_count == 7  # 20 - 12 - 1
         assert state.progress == "12/20"
 
+    def test_executor_state_skipped_tasks(self):
+        """Test that skipped tasks are not remaining."""
+        state = ExecutorState(total_task_count=10, completed_task_count=3, failed_task_count=1, skipped_task_count=4)
+
+        assert state.remaining_task_count == 2
+
 
 class TestExecutor:
     def test_executor_creation(self):
@@ -53,21 +69,23 @@ class TestExecutor:
     @pytest.mark.asyncio
     async def test_executor_run_async_basic(self):
         """Test basic async execution."""
-        # Create mock tasks
+
+        # Create mock tasks whose submissions complete immediately
+        async def noop():
+            pass
+
         mock_task1 = Mock()
-        mock_task1.submit.return_value = AsyncMock()
-        mock_task1.submit.return_value.done.return_value = True
+        mock_task1.model_copy.return_value = mock_task1
+        mock_task1.submit.side_effect = lambda: asyncio.create_task(noop())
 
         mock_task2 = Mock()
-        mock_task2.submit.return_value = AsyncMock()
-        mock_task2.submit.return_value.done.return_value = True
+        mock_task2.model_copy.return_value = mock_task2
+        mock_task2.submit.side_effect = lambda: asyncio.create_task(noop())
 
         layered_tasks = [[mock_task1], [mock_task2]]
         executor = Executor(layered_tasks)  # type: ignore
 
-        # Mock asyncio.sleep to speed up test
-        with patch("asyncio.sleep", new_callable=AsyncMock):
-            await executor.run_async()
+        await executor.run_async()
 
         # Verify tasks were submitted
         mock_task1.submit.assert_called_once()
@@ -75,6 +93,42 @@ class TestExecutor:
 
         # Verify state was updated
         assert executor.state.completed_task_count == 2
+        assert executor.state.running_task_count == 0
+
+    @pytest.mark.asyncio
+    async def test_executor_state_updated_on_completion(self):
+        """Test that state counters are pushed by completion events."""
+        release = asyncio.Event()
+
+        async def wait_for_release():
+            await release.wait()
+
+        mock_task = Mock()
+        mock_task.model_copy.return_value = mock_task
+        mock_task.submit.side_effect = lambda: asyncio.create_task(wait_for_release())
+        executor = Executor([[mock_task, mock_task]])  # type: ignore
+
+        running = asyncio.create_task(executor.run_async())
+        await asyncio.sleep(0)
+        assert executor.state.running_task_count == 2
+        assert executor.state.completed_task_count == 0
+
+        release.set()
+        await running
+        assert executor.state.running_task_count == 0
+        assert executor.state.completed_task_count == 2
+
+    @pytest.mark.asyncio
+    async def test_submitted_task_left_as_is(self):
+        """Test that running a task does not leave the callbacks of the executor on it."""
+        calls = []
+        task = Task(name="a", fn=lambda: calls.append("a"), resource_pool=ResourcePool(["r1"]))
+
+        for _ in range(2):
+            await Executor([[task]]).run_async()
+
+        assert task.on_start is None
+        assert calls == ["a", "a"]
 
     def test_executor_run_sync(self):
         """Test synchronous run method."""
@@ -112,11 +166,12 @@ class TestExecutor:
 
         # Verify executor was created
         assert isinstance(executor, Executor)
-        assert len(executor.tasks) == 2
-        assert len(executor.tasks[0]) == 1  # First layer has 1 task
-        assert len(executor.tasks[1]) == 1  # Second layer has 1 task
+        assert executor.tasks == [["0_task1"], ["0_task2"]]
 
-        # Verify create_task was called for each task
+        # Verify tasks are only created once needed
+        assert mock_create_task.call_count == 0
+        executor.get_task("0_task1")
+        executor.get_task("0_task2")
         assert mock_create_task.call_count == 2
 
     @patch("nanoflow.executor.create_gpu_task")
@@ -136,6 +191,7 @@ class TestExecutor:
         )
 
         executor = Executor.from_configs(config)
+        executor.get_task("0_task1")
 
         # Verify GPU pool was created
         mock_gpu_pool.assert_called_once()
@@ -167,6 +223,7 @@ class TestExecutor:
 
         with patch("nanoflow.executor.logger") as mock_logger:
             executor = Executor.from_configs(config)
+            executor.get_task("0_task1")
 
         # Verify warning was logged for experimental feature
         mock_logger.warning.assert_called_once()
@@ -189,12 +246,35 @@ class TestExecutor:
             pass
 
         executor = Executor.from_configs(config, update_hook=update_hook)
+        executor.get_task("0_task1")
 
         # Verify create_task was called with update_hook
         call_args = mock_create_task.call_args[1]  # Get keyword arguments
         assert "update_hook" in call_args
         assert call_args["update_hook"] == update_hook
 
+    def test_from_configs_concurrency_groups(self):
+        """Test that tasks of a group share one concurrency group."""
+        config = WorkflowConfig(
+            name="groups",
+            concurrency={"db": 1},
+            tasks={
+                "task1": TaskConfig(command="echo", args=["1"], group="db"),
+                "task2": TaskConfig(command="echo", args=["2"], group="db"),
+                "task3": TaskConfig(command="echo", args=["3"]),
+            },
+        )
+
+        executor = Executor.from_configs(config)
+
+        tasks = {name: executor.get_task(name) for name in executor.levels}
+        group = tasks["0_task1"].concurrency_group
+        assert group is not None
+        assert group.name == "db"
+        assert group.limit == 1
+        assert tasks["0_task2"].concurrency_group is group
+        assert tasks["0_task3"].concurrency_group is None
+
     def test_from_configs_empty_tasks(self):
         """Test creating executor with empty task list."""
         config = WorkflowConfig(name="empty", tasks={})
@@ -204,3 +284,695 @@ class TestExecutor:
         assert isinstance(executor, Executor)
         assert executor.tasks == []
         assert executor.state.total_task_count == 0
+
+    @pytest.mark.asyncio
+    async def test_from_configs_multiple_workflows(self):
+        """Test that several workflows run in one executor and share their resources."""
+        first = WorkflowConfig(
+            name="first",
+            resources=["r1", "r2"],
+            concurrency={"db": 1},
+            tasks={"a": TaskConfig(command="true", group="db"), "b": TaskConfig(command="true", deps=["a"])},
+        )
+        second = WorkflowConfig(
+            name="second",
+            resources=["r1", "r2"],
+            concurrency={"db": 1},
+            tasks={"a": TaskConfig(command="true", group="db")},
+        )
+
+        executor = Executor.from_configs([first, second])
+
+        tasks = {name: executor.get_task(name) for name in executor.levels}
+        assert executor.dependencies == {"first/0_a": [], "first/0_b": ["first/0_a"], "second/0_a": []}
+        assert tasks["first/0_a"].resource_pool is tasks["second/0_a"].resource_pool
+        assert tasks["first/0_a"].concurrency_group is not tasks["second/0_a"].concurrency_group
+        state = await executor.run_async()
+        assert state.completed_task_count == 3
+
+    def test_from_configs_shared_resources_in_any_order(self):
+        """Test that workflows listing the same resources in another order share one pool."""
+        first = WorkflowConfig(name="first", resources=["r1", "r2"], tasks={"a": TaskConfig(command="true")})
+        second = WorkflowConfig(name="second", resources=["r2", "r1", "r2"], tasks={"a": TaskConfig(command="true")})
+
+        executor = Executor.from_configs([first, second])
+
+        pool = executor.get_task("first/0_a").resource_pool
+        assert pool is executor.get_task("second/0_a").resource_pool
+        assert list(pool.resources) == ["r1", "r2"]
+
+    def test_from_configs_overlapping_resources(self):
+        """Test that workflows sharing only some of their resources are rejected."""
+        first = WorkflowConfig(name="first", resources=["r1", "r2"], tasks={"a": TaskConfig(command="true")})
+        second = WorkflowConfig(name="second", resources=["r2", "r3"], tasks={"a": TaskConfig(command="true")})
+
+        with pytest.raises(ValueError, match=r"share \['r2'\]"):
+            Executor.from_configs([first, second])
+
+    @pytest.mark.asyncio
+    async def test_from_configs_chunks(self):
+        """Test that a chunked matrix is scheduled as one task per chunk."""
+        config = WorkflowConfig(
+            name="chunks",
+            resources=["r1"],
+            tasks={
+                "prepare": TaskConfig(command="true"),
+                "sweep": TaskConfig(command="echo {x}", matrix={"x": ["1", "2", "3"]}, chunk_size=2, deps=["prepare"]),
+            },
+        )
+        lines = []
+
+        executor = Executor.from_configs(config, update_hook=lambda name, line: lines.append((name, line)))
+
+        assert executor.dependencies == {
+            "0_prepare": [],
+            "0_sweep_chunk_0": ["0_prepare"],
+            "0_sweep_chunk_1": ["0_prepare"],
+        }
+        assert executor.siblings == {"0_prepare": "prepare", "0_sweep_chunk_0": "sweep", "0_sweep_chunk_1": "sweep"}
+        state = await executor.run_async()
+        assert state.completed_task_count == 3
+        assert sorted(lines) == [("0_sweep", b"1\n"), ("0_sweep_1", b"2\n"), ("0_sweep_2", b"3\n")]
+
+    def test_from_configs_max_in_flight(self):
+        """Test that the in-flight limit comes from the caller, then the workflows, then the default."""
+        first = WorkflowConfig(name="first", max_in_flight=8, tasks={"a": TaskConfig(command="true")})
+        second = WorkflowConfig(name="second", max_in_flight=4, tasks={"a": TaskConfig(command="true")})
+        third = WorkflowConfig(name="third", tasks={"a": TaskConfig(command="true")})
+
+        assert Executor.from_configs(third).max_in_flight == DEFAULT_MAX_IN_FLIGHT
+        assert Executor.from_configs([first, second, third]).max_in_flight == 4
+        assert Executor.from_configs([first, second], max_in_flight=16).max_in_flight == 16
+
+    @pytest.mark.asyncio
+    async def test_from_configs_chunks_resume(self, tmp_path):
+        """Test that resuming a failed chunk runs again only the members that did not succeed."""
+        marker = tmp_path / "marker"
+        log_path = tmp_path / "log.txt"
+        config = WorkflowConfig(
+            name="chunks",
+            tasks={
+                "sweep": TaskConfig(
+                    command=f"echo {{x}} >> {log_path}; test {{x}} != 2 || test -e {marker}",
+                    matrix={"x": ["1", "2", "3"]},
+                    chunk_size=3,
+                    retry=RetryPolicy(max_attempts=1),
+                )
+            },
+        )
+        path = tmp_path / "run.jsonl"
+
+        state = await Executor.from_configs(config, journal=RunJournal(path)).run_async()
+        assert state.failed_task_count == 1
+        marker.touch()
+        state = await Executor.from_configs(config, journal=RunJournal(path), resume=True).run_async()
+
+        assert state.completed_task_count == 1
+        assert log_path.read_text().split() == ["1", "2", "3", "2"]
+        records = [json.loads(line) for line in path.read_text().splitlines()]
+        finished = [(record["task"], record["status"]) for record in records if record["event"] == "finish"]
+        assert ("0_sweep_1", "failed") in finished
+        assert ("0_sweep_1", "success") in finished
+
+
+class TestDependencyScheduler:
+    def test_scheduler_defaults(self):
+        """Test the scheduler chosen from the given dependencies."""
+        assert Executor([]).scheduler == "layered"
+        assert Executor([], dependencies={}).scheduler == "dependency"
+
+    def test_dependency_scheduler_requires_dependencies(self):
+        """Test that the dependency scheduler refuses to run without dependencies."""
+        with pytest.raises(ValueError, match="requires `dependencies`"):
+            Executor([], scheduler="dependency")
+
+    def test_unknown_dependency(self):
+        """Test that depending on an unknown task is rejected."""
+        task = Task(name="a", fn=lambda: None)
+        with pytest.raises(ValueError, match="unknown task `b`"):
+            Executor([[task]], dependencies={"a": ["b"]})
+
+    @pytest.mark.asyncio
+    async def test_dependency_scheduler_does_not_wait_for_layer(self):
+        """Test that a task starts as soon as its own dependencies are done."""
+        events = []
+
+        def record(name: str, delay: float = 0):
+            def fn():
+                events.append(f"start_{name}")
+                time.sleep(delay)
+                events.append(f"end_{name}")
+
+            return Task(name=name, fn=fn)
+
+        dependencies = {"slow": [], "fast": [], "after_fast": ["fast"]}
+        tasks = [[record("slow", 0.3), record("fast")], [record("after_fast")]]
+        executor = Executor(tasks, dependencies=dependencies)
+
+        await executor.run_async()
+
+        assert events.index("start_after_fast") < events.index("end_slow")
+        assert events.index("end_fast") < events.index("start_after_fast")
+        assert executor.state.completed_task_count == 3
+        assert executor.state.running_task_count == 0
+
+    @pytest.mark.asyncio
+    async def test_layered_scheduler_waits_for_layer(self):
+        """Test that the layered scheduler keeps the barrier between layers."""
+        events = []
+
+        def record(name: str, delay: float = 0):
+            def fn():
+                events.append(f"start_{name}")
+                time.sleep(delay)
+                events.append(f"end_{name}")
+
+            return Task(name=name, fn=fn)
+
+        dependencies = {"slow": [], "fast": [], "after_fast": ["fast"]}
+        tasks = [[record("slow", 0.2), record("fast")], [record("after_fast")]]
+        executor = Executor(tasks, dependencies=dependencies, scheduler="layered")
+
+        await executor.run_async()
+
+        assert events.index("end_slow") < events.index("start_after_fast")
+        assert executor.state.completed_task_count == 3
+
+    def test_from_configs_scheduler(self):
+        """Test that the scheduler is passed through from configs."""
+        config = WorkflowConfig(
+            name="test",
+            tasks={
+                "task1": TaskConfig(command="echo", args=["hello"]),
+                "task2": TaskConfig(command="echo", args=["world"], deps=["task1"]),
+            },
+        )
+
+        executor = Executor.from_configs(config)
+        assert executor.scheduler == "dependency"
+        assert executor.dependencies == {"0_task1": [], "0_task2": ["0_task1"]}
+
+        executor = Executor.from_configs(config, scheduler="layered")
+        assert executor.scheduler == "layered"
+
+
+class TestDynamicTasks:
+    @pytest.mark.asyncio
+    async def test_add_task_while_running(self):
+        """Test that tasks added from the event loop are scheduled without restarting the run."""
+        events = []
+
+        def record(name: str):
+            return Task(name=name, fn=lambda: events.append(name))
+
+        executor = Executor([[record("first")]], dependencies={"first": []}, keep_open=True)
+
+        async def search():
+            await asyncio.sleep(0.05)
+            for i in range(3):
+                trial = executor.add_task(record(f"trial_{i}"), deps=["first"])
+                await asyncio.wrap_future(trial)
+            executor.close()
+
+        state, _ = await asyncio.wait_for(asyncio.gather(executor.run_async(), search()), timeout=5)
+
+        assert events == ["first", "trial_0", "trial_1", "trial_2"]
+        assert state.total_task_count == 4
+        assert state.completed_task_count == 4
+        assert executor.dependencies == {"first": [], "trial_0": ["first"], "trial_1": ["first"], "trial_2": ["first"]}
+
+    @pytest.mark.asyncio
+    async def test_add_task_from_thread(self):
+        """Test that tasks can be added from another thread."""
+        executor = Executor([[Task(name="a", fn=lambda: time.sleep(0.1))]], dependencies={"a": []})
+
+        def add():
+            time.sleep(0.02)
+            return executor.add_task(Task(name="b", fn=lambda: None), deps=["a"])
+
+        state, completion = await asyncio.gather(executor.run_async(), asyncio.to_thread(add))
+
+        assert completion.result(timeout=1) is None
+        assert state.completed_task_count == 2
+
+    @pytest.mark.asyncio
+    async def test_add_task_from_threads_while_starting(self):
+        """Test that tasks added from other threads as the run starts are all run once."""
+        executor = Executor([[Task(name="a", fn=lambda: None)]], dependencies={"a": []}, keep_open=True)
+        ran = []
+
+        def add(thread: int):
+            return [
+                executor.add_task(Task(name=f"{thread}_{i}", fn=functools.partial(ran.append, i)), deps=["a"])
+                for i in range(50)
+            ]
+
+        async def add_all():
+            added = await asyncio.gather(*(asyncio.to_thread(add, thread) for thread in range(4)))
+            executor.close()
+            return added
+
+        state, added = await asyncio.gather(executor.run_async(), add_all())
+
+        assert state.completed_task_count == 201
+        assert len(ran) == 200
+        assert all(completion.result(timeout=1) is None for completions in added for completion in completions)
+
+    @pytest.mark.asyncio
+    async def test_add_task_after_failure(self):
+        """Test that a task depending on a failed task is skipped."""
+
+        def fail():
+            raise TaskProcessError("failed", returncode=1)
+
+        failing = Task(name="a", fn=fail, retry=RetryPolicy(max_attempts=1))
+        executor = Executor([[failing]], dependencies={"a": []}, keep_open=True)
+
+        async def add_after_failure():
+            while executor.state.failed_task_count == 0:
+                await asyncio.sleep(0.01)
+            completion = executor.add_task(Task(name="b", fn=lambda: None), deps=["a"])
+            executor.close()
+            return completion
+
+        state, completion = await asyncio.wait_for(asyncio.gather(executor.run_async(), add_after_failure()), timeout=5)
+
+        assert completion.cancelled()
+        assert state.failed_task_count == 1
+        assert state.skipped_task_count == 1
+
+    def test_add_task_before_run(self):
+        """Test that tasks added before the run are scheduled with the others."""
+        executor = Executor([[Task(name="a", fn=lambda: None)]], dependencies={"a": []})
+        completion = executor.add_task(Task(name="b", fn=lambda: None), deps=["a"])
+
+        state = executor.run()
+
+        assert completion.done()
+        assert [[task.name for task in layer] for layer in executor.tasks] == [["a"], ["b"]]
+        assert state.completed_task_count == 2
+        with pytest.raises(RuntimeError, match="has finished"):
+            executor.add_task(Task(name="c", fn=lambda: None))
+
+    def test_add_task_invalid(self):
+        """Test that duplicate tasks, unknown dependencies and the layered scheduler are rejected."""
+        executor = Executor([[Task(name="a", fn=lambda: None)]], dependencies={"a": []})
+
+        with pytest.raises(ValueError, match="already exists"):
+            executor.add_task(Task(name="a", fn=lambda: None))
+        with pytest.raises(ValueError, match="unknown task `c`"):
+            executor.add_task(Task(name="b", fn=lambda: None), deps=["c"])
+        with pytest.raises(ValueError, match="dependency scheduler"):
+            Executor([]).add_task(Task(name="a", fn=lambda: None))
+
+
+class TestBackpressure:
+    @staticmethod
+    async def run_sampled(executor: Executor) -> int:
+        """Run the executor, returning the peak number of running tasks."""
+        peak_running = 0
+
+        async def sample():
+            nonlocal peak_running
+            while True:
+                peak_running = max(peak_running, executor.state.running_task_count)
+                await asyncio.sleep(0)
+
+        sampler = asyncio.create_task(sample())
+        await executor.run_async()
+        sampler.cancel()
+        return peak_running
+
+    @pytest.mark.asyncio
+    async def test_matrix_waits_outside_the_pool(self):
+        """Test that a large matrix only submits about as many tasks as the pool has resources."""
+        config = WorkflowConfig(
+            name="matrix",
+            resources=["r1", "r2"],
+            matrix={"i": [str(i) for i in range(100)]},
+            tasks={"echo": TaskConfig(command="true {i}")},
+        )
+        executor = Executor.from_configs(config)
+        assert executor.task_map == {}
+
+        peak_running = await self.run_sampled(executor)
+
+        assert executor.state.completed_task_count == 100
+        # The tasks holding the two resources and the next one waiting for a resource, plus at times
+        # a task that released its resource, letting the next one start, before its completion ran
+        assert peak_running <= 4
+        assert executor.task_map == {}
+
+    @pytest.mark.asyncio
+    async def test_tasks_created_when_ready(self):
+        """Test that a task is only created once its dependencies are done."""
+        created = []
+
+        def create(name: str) -> Task[[], None]:
+            created.append(name)
+            return Task(name=name, fn=lambda: None)
+
+        dependencies = {"a": [], "b": ["a"], "c": ["b"]}
+        executor = Executor([["a"], ["b"], ["c"]], dependencies=dependencies, task_factory=create)
+
+        async def check_order():
+            while executor.state.completed_task_count < 1:
+                await asyncio.sleep(0)
+            assert "c" not in created
+
+        await asyncio.gather(executor.run_async(), check_order())
+        assert created == ["a", "b", "c"]
+
+    @pytest.mark.asyncio
+    async def test_max_in_flight(self):
+        """Test that tasks without resources are capped by `max_in_flight`."""
+        tasks = [Task(name=f"t{i}", fn=lambda: time.sleep(0.01)) for i in range(20)]
+        executor = Executor([tasks], dependencies={task.name: [] for task in tasks}, max_in_flight=4)
+
+        peak_running = await self.run_sampled(executor)
+
+        assert executor.state.completed_task_count == 20
+        assert peak_running == 4
+
+    def test_names_require_factory(self):
+        """Test that tasks given by name cannot be created without a factory."""
+        with pytest.raises(ValueError, match="task_factory"):
+            Executor([["a"]], dependencies={"a": []})
+
+
+class TestPriorityScheduling:
+    def test_prioritize_by_critical_path(self):
+        """Test that priorities follow the longest remaining path weighted by history."""
+        history = DurationHistory()
+        history.record("a", None, 1.0)
+        history.record("b", None, 10.0)
+        history.record("c", None, 2.0)
+        tasks = {name: Task(name=name, fn=lambda: None) for name in "abcd"}
+        dependencies = {"a": [], "b": ["a"], "c": ["a"], "d": ["c"]}
+        executor = Executor([list(tasks.values())], dependencies=dependencies, history=history)
+
+        executor.prioritize()
+
+        # `d` has no history and is assumed to take the median duration
+        assert tasks["d"].priority == 2.0
+        assert tasks["c"].priority == 4.0
+        assert tasks["b"].priority == 10.0
+        assert tasks["a"].priority == 11.0
+
+    @pytest.mark.asyncio
+    async def test_critical_path_acquires_first(self):
+        """Test that the task on the critical path gets the single resource first."""
+        history = DurationHistory()
+        history.record("short", None, 1.0)
+        history.record("long", None, 1.0)
+        history.record("long_next", None, 100.0)
+        pool = ResourcePool(["device"])
+        order = []
+
+        def record(name: str):
+            return Task(name=name, fn=lambda: order.append(name), resource_pool=pool)
+
+        tasks = [record("short"), record("long"), record("long_next")]
+        dependencies = {"short": [], "long": [], "long_next": ["long"]}
+        executor = Executor([tasks[:2], tasks[2:]], dependencies=dependencies, history=history)
+
+        await executor.run_async()
+
+        assert order[0] == "long"
+        assert history.get("long_next", None) is not None
+
+    @pytest.mark.asyncio
+    async def test_run_records_durations(self, tmp_path):
+        """Test that measured durations are saved after a run."""
+        path = tmp_path / "durations.json"
+        history = DurationHistory.load(path)
+        task = Task(name="a", fn=lambda: time.sleep(0.01), config_hash="hash")
+        executor = Executor([[task]], dependencies={"a": []}, history=history)
+
+        await executor.run_async()
+
+        assert DurationHistory.load(path).get("a", "hash") >= 0.01  # type: ignore
+
+
+class TestJournal:
+    @pytest.mark.asyncio
+    async def test_run_writes_journal(self, tmp_path):
+        """Test that starts and finishes are journaled with their status."""
+        path = tmp_path / "journal.jsonl"
+
+        def fail():
+            raise TaskProcessError("failed", returncode=3)
+
+        tasks = [Task(name="ok", fn=lambda: None, config_hash="h1"), Task(name="bad", fn=fail, config_hash="h2")]
+        for task in tasks:
+            task.retry = RetryPolicy(max_attempts=1)
+        executor = Executor([tasks], dependencies={"ok": [], "bad": []}, journal=RunJournal(path))
+
+        await executor.run_async()
+
+        records = [json.loads(line) for line in path.read_text().splitlines()]
+        assert records[0]["event"] == "run"
+        finishes = {record["task"]: record for record in records if record["event"] == "finish"}
+        assert finishes["ok"]["status"] == "success"
+        assert finishes["ok"]["returncode"] == 0
+        assert finishes["bad"]["status"] == "failed"
+        assert finishes["bad"]["returncode"] == 3
+        assert {record["task"] for record in records if record["event"] == "start"} == {"ok", "bad"}
+
+    @pytest.mark.asyncio
+    async def test_timeout_is_journaled(self, tmp_path):
+        """Test that a timeout is recorded as its own kind of failure."""
+        path = tmp_path / "journal.jsonl"
+
+        async def hang():
+            await asyncio.sleep(30)
+
+        task = Task(name="hang", fn=hang, timeout=0.05, retry=RetryPolicy(max_attempts=1))
+        executor = Executor([[task]], dependencies={"hang": []}, journal=RunJournal(path))
+
+        state = await executor.run_async()
+
+        finishes = [json.loads(line) for line in path.read_text().splitlines() if '"finish"' in line]
+        assert finishes[0]["status"] == "timeout"
+        assert state.failed_task_count == 1
+
+    @pytest.mark.asyncio
+    async def test_resume_skips_succeeded_tasks(self, tmp_path):
+        """Test that resuming only runs tasks that did not succeed before."""
+        path = tmp_path / "journal.jsonl"
+        journal = RunJournal(path)
+        journal.start_run()
+        journal.record("finish", "a", "h", status="success")
+        journal.record("finish", "b", "old", status="success")
+        journal.close()
+        ran = []
+
+        def record(name: str, config_hash: str):
+            return Task(name=name, fn=lambda: ran.append(name), config_hash=config_hash)
+
+        tasks = [[record("a", "h"), record("b", "h")], [record("c", "h")]]
+        dependencies = {"a": [], "b": [], "c": ["a", "b"]}
+        executor = Executor(tasks, dependencies=dependencies, journal=RunJournal(path), resume=True)
+
+        await executor.run_async()
+
+        # `b` changed its command since it succeeded, so it runs again
+        assert sorted(ran) == ["b", "c"]
+        assert executor.state.completed_task_count == 3
+        assert RunJournal.load_succeeded(path) == {("a", "h"), ("b", "old"), ("b", "h"), ("c", "h")}
+
+
+class TestIncrementalExecution:
+    @pytest.mark.asyncio
+    async def test_skip_up_to_date_tasks(self, tmp_path):
+        """Test that a task runs again only when its inputs change or its outputs are missing."""
+        source = tmp_path / "source.txt"
+        target = tmp_path / "target.txt"
+        source.write_text("v1")
+        ran = []
+
+        def copy():
+            ran.append("copy")
+            target.write_text(source.read_text())
+
+        async def run_once():
+            task = Task(name="copy", fn=copy, config_hash="h", inputs=[str(source)], outputs=[str(target)])
+            untracked = Task(name="untracked", fn=lambda: ran.append("untracked"))
+            executor = Executor(
+                [[task, untracked]],
+                dependencies={"copy": [], "untracked": []},
+                fingerprints=FingerprintIndex.load(tmp_path / "fingerprints.json"),
+            )
+            await executor.run_async()
+            assert executor.state.completed_task_count == 2
+
+        await run_once()
+        assert ran.count("copy") == 1
+
+        await run_once()
+        assert ran.count("copy") == 1
+        assert ran.count("untracked") == 2
+
+        source.write_text("v2")
+        await run_once()
+        assert ran.count("copy") == 2
+
+        target.unlink()
+        await run_once()
+        assert ran.count("copy") == 3
+        assert ran.count("untracked") == 4
+        assert target.read_text() == "v2"
+
+    @pytest.mark.asyncio
+    async def test_failed_task_is_not_recorded(self, tmp_path):
+        """Test that a failed task is run again next time."""
+
+        def fail():
+            raise TaskProcessError("failed")
+
+        task = Task(name="fail", fn=fail, retry=RetryPolicy(max_attempts=1), inputs=[str(tmp_path / "*")])
+        fingerprints = FingerprintIndex()
+        executor = Executor([[task]], dependencies={"fail": []}, fingerprints=fingerprints)
+
+        await executor.run_async()
+
+        assert fingerprints.tasks == {}
+
+
+class TestFailurePropagation:
+    @staticmethod
+    def make_task(name: str, events: list[str], *, fail: bool = False, delay: float = 0) -> Task[[], None]:
+        async def fn():
+            events.append(f"start_{name}")
+            await asyncio.sleep(delay)
+            if fail:
+                raise TaskProcessError(f"{name} failed")
+            events.append(f"end_{name}")
+
+        return Task(name=name, fn=fn, retry=RetryPolicy(max_attempts=1))
+
+    @pytest.mark.asyncio
+    async def test_keep_going_skips_dependents(self):
+        """Test that dependents of a failed task are skipped while independent tasks keep running."""
+        events = []
+        dependencies = {"fail": [], "child": ["fail"], "grandchild": ["child"], "other": [], "after_other": ["other"]}
+        tasks = [
+            [self.make_task("fail", events, fail=True), self.make_task("other", events, delay=0.05)],
+            [self.make_task("child", events), self.make_task("after_other", events)],
+            [self.make_task("grandchild", events)],
+        ]
+        executor = Executor(tasks, dependencies=dependencies)
+
+        state = await executor.run_async()
+
+        assert state is executor.state
+        assert executor.skipped == {"child", "grandchild"}
+        assert "start_child" not in events and "start_grandchild" not in events
+        assert "end_after_other" in events
+        assert state.completed_task_count == 2
+        assert state.failed_task_count == 1
+        assert state.skipped_task_count == 2
+        assert state.remaining_task_count == 0
+
+    @pytest.mark.asyncio
+    async def test_fail_fast_cancels_running_tasks(self):
+        """Test that fail-fast cancels the tasks in flight and submits nothing else."""
+        events = []
+        dependencies = {"fail": [], "slow": [], "after_slow": ["slow"]}
+        tasks = [
+            [self.make_task("fail", events, fail=True), self.make_task("slow", events, delay=10)],
+            [self.make_task("after_slow", events)],
+        ]
+        executor = Executor(tasks, dependencies=dependencies, failure_mode="fail-fast")
+
+        state = await asyncio.wait_for(executor.run_async(), timeout=5)
+
+        assert "start_slow" in events and "end_slow" not in events
+        assert "start_after_slow" not in events
+        assert state.completed_task_count == 0
+        assert state.failed_task_count == 1
+        assert state.skipped_task_count == 2
+        assert state.running_task_count == 0
+
+    @pytest.mark.asyncio
+    async def test_layered_without_dependencies_stops_after_layer(self):
+        """Test that later layers are skipped when there are no dependencies to limit the damage."""
+        events = []
+        tasks = [
+            [self.make_task("fail", events, fail=True), self.make_task("sibling", events, delay=0.05)],
+            [self.make_task("next", events)],
+        ]
+        executor = Executor(tasks)
+
+        state = await executor.run_async()
+
+        assert "end_sibling" in events
+        assert "start_next" not in events
+        assert state.completed_task_count == 1
+        assert state.failed_task_count == 1
+        assert state.skipped_task_count == 1
+
+    @pytest.mark.asyncio
+    async def test_layered_skips_dependents(self):
+        """Test that the layered scheduler also skips only the dependents of a failed task."""
+        events = []
+        dependencies = {"fail": [], "other": [], "child": ["fail"], "after_other": ["other"]}
+        tasks = [
+            [self.make_task("fail", events, fail=True), self.make_task("other", events)],
+            [self.make_task("child", events), self.make_task("after_other", events)],
+        ]
+        executor = Executor(tasks, dependencies=dependencies, scheduler="layered")
+
+        state = await executor.run_async()
+
+        assert "start_child" not in events
+        assert "end_after_other" in events
+        assert state.failed_task_count == 1
+        assert state.skipped_task_count == 1
+
+
+class TestSpeculation:
+    @pytest.mark.asyncio
+    async def test_straggler_is_duplicated(self):
+        """Test that a sibling running far longer than the others is raced by a duplicate."""
+        pool = ResourcePool(["noisy", "r1", "r2", "r3", "r4"])
+        attempts = []
+
+        def on_resource(fn, resource: str):
+            async def run():
+                attempts.append(resource)
+                await asyncio.sleep(30 if resource == "noisy" else 0.05)
+
+            return run
+
+        names = [f"{i}_train" for i in range(5)]
+        tasks = [Task(name=name, fn=lambda: None, resource_pool=pool, resource_modifier=on_resource) for name in names]
+        executor = Executor(
+            [tasks],
+            dependencies={name: [] for name in names},
+            siblings=dict.fromkeys(names, "train"),
+            speculate=2,
+        )
+        executor.speculation_interval = 0.05
+
+        state = await asyncio.wait_for(executor.run_async(), timeout=5)
+
+        assert state.completed_task_count == 5
+        assert attempts.count("noisy") == 1
+        assert len(attempts) == 6
+        assert pool.used_resources == set()
+
+    def test_from_configs_siblings(self):
+        """Test that tasks expanded from the same config task are siblings."""
+        config = WorkflowConfig(
+            name="sweep",
+            tasks={
+                "train": TaskConfig(command="train", args=["{lr}"], matrix={"lr": ["1", "2"]}),
+                "report": TaskConfig(command="report", deps=["train"]),
+            },
+        )
+
+        executor = Executor.from_configs(config, speculate=2)
+
+        assert executor.siblings == {"0_train": "train", "0_train_1": "train", "0_report": "report"}
+        assert executor.speculate == 2
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+from pathlib import Path
+from unittest.mock import patch
+
+from nanoflow.fingerprint import FingerprintIndex
+
+
+class TestFingerprintIndex:
+    def test_expand_patterns(self, tmp_path: Path):
+        """Test that glob patterns expand to sorted files only."""
+        (tmp_path / "b.txt").write_text("b")
+        (tmp_path / "a.txt").write_text("a")
+        (tmp_path / "sub").mkdir()
+        (tmp_path / "sub" / "c.txt").write_text("c")
+
+        assert FingerprintIndex.expand([str(tmp_path / "*.txt")]) == [tmp_path / "a.txt", tmp_path / "b.txt"]
+        assert FingerprintIndex.expand([str(tmp_path / "**" / "*.txt")]) == [
+            tmp_path / "a.txt",
+            tmp_path / "b.txt",
+            tmp_path / "sub" / "c.txt",
+        ]
+        assert FingerprintIndex.expand([str(tmp_path / "*")]) == [tmp_path / "a.txt", tmp_path / "b.txt"]
+
+    def test_unchanged_file_is_not_hashed_again(self, tmp_path: Path):
+        """Test the modification time and size fast path."""
+        path = tmp_path / "input.txt"
+        path.write_text("data")
+        index = FingerprintIndex()
+        digest = index.file_digest(path)
+
+        with patch("hashlib.file_digest") as mock_file_digest:
+            assert index.file_digest(path) == digest
+        mock_file_digest.assert_not_called()
+
+    def test_changed_file_is_hashed_again(self, tmp_path: Path):
+        """Test that a changed file gets a new content hash."""
+        path = tmp_path / "input.txt"
+        path.write_text("data")
+        index = FingerprintIndex()
+        digest = index.file_digest(path)
+
+        path.write_text("other data")
+        assert index.file_digest(path) != digest
+
+    def test_signature_depends_on_config_hash(self, tmp_path: Path):
+        """Test that changing the command invalidates the signature."""
+        (tmp_path / "input.txt").write_text("data")
+        index = FingerprintIndex()
+        inputs = [str(tmp_path / "input.txt")]
+
+        assert index.signature("hash1", inputs) == index.signature("hash1", inputs)
+        assert index.signature("hash1", inputs) != index.signature("hash2", inputs)
+
+    def test_missing_output_is_not_up_to_date(self, tmp_path: Path):
+        """Test that a task is run again when its output is missing."""
+        index = FingerprintIndex()
+        signature = index.signature("hash", [])
+        index.record_success("task", signature)
+        outputs = [str(tmp_path / "output.txt")]
+
+        assert not index.is_up_to_date("task", signature, outputs)
+        (tmp_path / "output.txt").write_text("result")
+        assert index.is_up_to_date("task", signature, outputs)
+
+    def test_save_and_load(self, tmp_path: Path):
+        """Test that the index survives a save and load round trip."""
+        (tmp_path / "input.txt").write_text("data")
+        path = tmp_path / "state" / "fingerprints.json"
+        index = FingerprintIndex.load(path)
+        signature = index.signature("hash", [str(tmp_path / "input.txt")])
+        index.record_success("task", signature)
+        index.save()
+
+        loaded = FingerprintIndex.load(path)
+        assert loaded.is_up_to_date("task", signature, [])
+        assert loaded.files == index.files
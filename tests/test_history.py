@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from nanoflow.history import DurationHistory
+
+
+class TestDurationHistory:
+    def test_record_and_get(self):
+        """Test recording durations per task name and config hash."""
+        history = DurationHistory()
+
+        history.record("task", "hash1", 4.0)
+        history.record("task", "hash2", 8.0)
+        history.record("task", None, 1.0)
+
+        assert history.get("task", "hash1") == 4.0
+        assert history.get("task", "hash2") == 8.0
+        assert history.get("task", None) == 1.0
+        assert history.get("other", "hash1") is None
+
+    def test_record_smooths_durations(self):
+        """Test that repeated measurements are smoothed."""
+        history = DurationHistory(smoothing=0.75)
+
+        history.record("task", "hash", 4.0)
+        history.record("task", "hash", 8.0)
+
+        assert history.get("task", "hash") == 5.0
+
+    def test_load_missing_file(self, tmp_path: Path):
+        """Test loading history from a file that does not exist yet."""
+        path = tmp_path / "durations.json"
+        history = DurationHistory.load(path)
+
+        assert history.durations == {}
+        assert history.path == path
+
+    def test_save_and_load(self, tmp_path: Path):
+        """Test that durations survive a save and load round trip."""
+        path = tmp_path / "state" / "durations.json"
+        history = DurationHistory.load(path)
+        history.record("task", "hash", 3.0)
+        history.save()
+
+        loaded = DurationHistory.load(path)
+        assert loaded.get("task", "hash") == 3.0
+        assert "path" not in path.read_text()
+
+    def test_save_without_path(self):
+        """Test that saving an in-memory history does nothing."""
+        DurationHistory().save()
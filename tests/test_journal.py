@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from nanoflow.journal import RunJournal
+
+
+def read_records(path: Path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+class TestRunJournal:
+    def test_record_is_buffered_until_flush(self, tmp_path: Path):
+        """Test that records are not written one by one."""
+        path = tmp_path / "journal.jsonl"
+        journal = RunJournal(path)
+
+        journal.record("start", "a", "hash")
+        assert not path.exists()
+
+        journal.flush()
+        records = read_records(path)
+        assert len(records) == 1
+        assert records[0]["event"] == "start"
+        assert records[0]["task"] == "a"
+        assert records[0]["hash"] == "hash"
+        journal.close()
+
+    def test_flush_when_buffer_is_full(self, tmp_path: Path):
+        """Test that a full buffer is flushed right away."""
+        path = tmp_path / "journal.jsonl"
+        journal = RunJournal(path, max_buffer=2)
+
+        journal.record("start", "a", None)
+        journal.record("start", "b", None)
+
+        assert len(read_records(path)) == 2
+        journal.close()
+
+    @pytest.mark.asyncio
+    async def test_flush_after_interval(self, tmp_path: Path):
+        """Test that buffered records are flushed after the flush interval."""
+        path = tmp_path / "journal.jsonl"
+        journal = RunJournal(path, flush_interval=0.01)
+
+        journal.record("start", "a", None)
+        journal.record("finish", "a", None, status="success")
+        await asyncio.sleep(0.05)
+
+        assert [record["event"] for record in read_records(path)] == ["start", "finish"]
+        journal.close()
+
+    def test_load_succeeded(self, tmp_path: Path):
+        """Test that the latest finish of every task decides whether it succeeded."""
+        path = tmp_path / "journal.jsonl"
+        journal = RunJournal(path)
+        journal.start_run()
+        journal.record("finish", "a", "hash", status="success")
+        journal.record("finish", "b", "hash", status="success")
+        journal.record("finish", "b", "hash", status="failed", returncode=1)
+        journal.record("finish", "c", "hash", status="failed", returncode=1)
+        journal.start_run(resume=True)
+        journal.record("finish", "c", "hash", status="success")
+        journal.close()
+
+        assert RunJournal.load_succeeded(path) == {("a", "hash"), ("c", "hash")}
+
+    def test_load_succeeded_since_last_fresh_run(self, tmp_path: Path):
+        """Test that a fresh run forgets what succeeded before it."""
+        path = tmp_path / "journal.jsonl"
+        journal = RunJournal(path)
+        journal.start_run()
+        journal.record("finish", "a", "hash", status="success")
+        journal.start_run()
+        journal.record("finish", "b", "hash", status="success")
+        journal.close()
+
+        assert RunJournal.load_succeeded(path) == {("b", "hash")}
+
+    def test_load_succeeded_ignores_truncated_line(self, tmp_path: Path):
+        """Test that a line cut short by a crash is ignored."""
+        path = tmp_path / "journal.jsonl"
+        journal = RunJournal(path)
+        journal.record("finish", "a", "hash", status="success")
+        journal.close()
+        with path.open("a") as f:
+            f.write('{"event": "finish", "task": "b"')
+
+        assert RunJournal.load_succeeded(path) == {("a", "hash")}
+
+    def test_load_succeeded_missing_file(self, tmp_path: Path):
+        """Test loading a journal that does not exist yet."""
+        assert RunJournal.load_succeeded(tmp_path / "missing.jsonl") == set()
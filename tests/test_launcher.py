@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+from nanoflow.backend import ExecutionBackends, current_backends
+from nanoflow.launcher import STREAM_LIMIT, ForkServer, parse_module_command
+from nanoflow.task import TaskProcessError
+from nanoflow.utils import create_command
+
+MODULE = """
+import os
+import sys
+
+print("argv", *sys.argv[1:])
+print("env", os.environ.get("NANOFLOW_TEST"), file=sys.stderr)
+sys.exit(int(os.environ.get("NANOFLOW_EXIT", "0")))
+"""
+
+
+@pytest.fixture
+def module_dir(tmp_path, monkeypatch):
+    (tmp_path / "launched.py").write_text(MODULE)
+    (tmp_path / "progress.py").write_text(f"import sys\nsys.stdout.write('x' * {STREAM_LIMIT + 10} + '\\r')\n")
+    (tmp_path / "reader.py").write_text("import sys\nprint(repr(sys.stdin.read()))\n")
+    (tmp_path / "sleeper.py").write_text("import time\nopen('started', 'w').close()\ntime.sleep(30)\n")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+class TestParseModuleCommand:
+    def test_interpreter_path(self):
+        """Test that the interpreter of nanoflow can be given by its path."""
+        assert parse_module_command(f"{sys.executable} -m launched a") == ("launched", ["a"])
+
+    def test_shell_commands(self):
+        """Test that commands relying on the shell are left to it."""
+        assert parse_module_command("python -m launched $HOME") is None
+        assert parse_module_command("python -m launched; echo done") is None
+        assert parse_module_command("python -c 'print(1)'") is None
+
+
+class TestForkServer:
+    @pytest.mark.asyncio
+    async def test_run_module(self, module_dir):
+        """Test that a child runs the module with the arguments and environment of the command."""
+        lines = []
+        fork_server = ForkServer(["json"])
+        try:
+            returncode = await fork_server.run(
+                "launched",
+                "launched",
+                ["a", "b c"],
+                environ={**os.environ, "NANOFLOW_TEST": "value"},
+                update_hook=lambda name, line: lines.append((name, line)),
+            )
+        finally:
+            fork_server.close()
+
+        assert returncode == 0
+        assert sorted(lines) == [("launched", b"argv a b c\n"), ("launched", b"env value\n")]
+
+    @pytest.mark.asyncio
+    async def test_return_code(self, module_dir):
+        """Test that the exit code of the module is returned, and the template keeps serving."""
+        fork_server = ForkServer()
+        try:
+            failed = await fork_server.run(
+                "launched", "launched", [], environ={**os.environ, "NANOFLOW_EXIT": "3"}, update_hook=lambda *_: None
+            )
+            succeeded = await fork_server.run("launched", "launched", [], update_hook=lambda *_: None)
+        finally:
+            fork_server.close()
+
+        assert (failed, succeeded) == (3, 0)
+
+    @pytest.mark.asyncio
+    async def test_stdin_detached(self, module_dir):
+        """Test that a child reads an empty stdin instead of the control pipe of the template."""
+        lines = []
+        fork_server = ForkServer()
+        try:
+            first = await fork_server.run("reader", "reader", [], update_hook=lambda _, line: lines.append(line))
+            second = await fork_server.run("reader", "reader", [], update_hook=lambda _, line: lines.append(line))
+        finally:
+            fork_server.close()
+
+        assert (first, second) == (0, 0)
+        assert lines == [b"''\n", b"''\n"]
+
+    @pytest.mark.asyncio
+    async def test_long_line(self, module_dir):
+        """Test that output lines longer than the stream limit are forwarded in pieces."""
+        lines = []
+        fork_server = ForkServer()
+        try:
+            returncode = await fork_server.run(
+                "progress", "progress", [], update_hook=lambda _, line: lines.append(line)
+            )
+        finally:
+            fork_server.close()
+
+        assert returncode == 0
+        assert b"".join(lines) == b"x" * (STREAM_LIMIT + 10) + b"\r"
+        assert max(len(line) for line in lines) <= STREAM_LIMIT
+
+    @pytest.mark.asyncio
+    async def test_cancel_kills_child(self, module_dir):
+        """Test that cancelling a run kills its child."""
+        fork_server = ForkServer()
+        try:
+            run = asyncio.create_task(fork_server.run("sleeper", "sleeper", [], update_hook=lambda *_: None))
+            while not (module_dir / "started").exists():
+                await asyncio.sleep(0.01)
+            run.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await asyncio.wait_for(run, timeout=5)
+        finally:
+            fork_server.close()
+
+
+class TestCreateCommandPreload:
+    @pytest.mark.asyncio
+    async def test_forks_module_commands(self, module_dir):
+        """Test that module commands run in the fork server of the current backends."""
+        backends = ExecutionBackends()
+        token = current_backends.set(backends)
+        lines = []
+        try:
+            command_fn = create_command(
+                "launched",
+                f"{sys.executable} -m launched x",
+                update_hook=lambda name, line: lines.append(line),
+                preload=["json"],
+            )
+            await command_fn()
+            assert list(backends.fork_servers) == [("json",)]
+
+            failing_fn = create_command(
+                "launched",
+                f"{sys.executable} -m launched",
+                update_hook=lambda *_: None,
+                environ={**os.environ, "NANOFLOW_EXIT": "2"},
+                preload=["json"],
+            )
+            with pytest.raises(TaskProcessError) as exc_info:
+                await failing_fn()
+        finally:
+            current_backends.reset(token)
+            backends.shutdown()
+
+        assert b"argv x\n" in lines
+        assert exc_info.value.returncode == 2
+        assert backends.fork_servers == {}
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from nanoflow.config import TaskConfig, WorkflowConfig
+from nanoflow.executor import Executor
+from nanoflow.remote import Coordinator, RemoteResource, Worker, create_remote_task, parse_address
+from nanoflow.retry import RetryPolicy
+from nanoflow.task import TaskProcessError
+
+
+async def start_worker(
+    coordinator: Coordinator, name: str, resources: list[str], token: str | None = None
+) -> asyncio.Task[None]:
+    """Connect a worker to the coordinator and wait until it has joined."""
+    host, port = coordinator.address
+    worker_task = asyncio.create_task(Worker(host, port, resources=resources, name=name, token=token).run())
+    while name not in coordinator.workers:
+        await asyncio.sleep(0.01)
+    return worker_task
+
+
+class TestParseAddress:
+    def test_invalid_address(self):
+        """Test that an address without a port is rejected."""
+        with pytest.raises(ValueError, match="host:port"):
+            parse_address("localhost")
+
+
+class TestCoordinator:
+    @pytest.mark.asyncio
+    async def test_run_streams_logs(self):
+        """Test that the output of a remote command is streamed back to the coordinator."""
+        lines = []
+        async with Coordinator() as coordinator:
+            worker_task = await start_worker(coordinator, "w1", ["r1"])
+            await coordinator.run(
+                RemoteResource("w1", "r1"),
+                "echo",
+                "echo out; echo err >&2",
+                update_hook=lambda name, line: lines.append((name, line)),
+            )
+            worker_task.cancel()
+
+        assert sorted(lines) == [("echo", b"err\n"), ("echo", b"out\n")]
+
+    @pytest.mark.asyncio
+    async def test_run_reports_exit_code(self):
+        """Test that a failing remote command raises with its return code."""
+        async with Coordinator() as coordinator:
+            worker_task = await start_worker(coordinator, "w1", ["r1"])
+            with pytest.raises(TaskProcessError) as exc_info:
+                await coordinator.run(RemoteResource("w1", "r1"), "fail", "exit 3", update_hook=lambda *_: None)
+            worker_task.cancel()
+
+        assert exc_info.value.returncode == 3
+
+    @pytest.mark.asyncio
+    async def test_workers_join_and_leave(self):
+        """Test that the pool follows the resources of the connected workers."""
+        async with Coordinator() as coordinator:
+            first = await start_worker(coordinator, "w1", ["r1", "r2"])
+            second = await start_worker(coordinator, "w2", ["r1"])
+
+            assert set(coordinator.pool.resources) == {
+                RemoteResource("w1", "r1"),
+                RemoteResource("w1", "r2"),
+                RemoteResource("w2", "r1"),
+            }
+
+            first.cancel()
+            while "w1" in coordinator.workers:
+                await asyncio.sleep(0.01)
+
+            assert set(coordinator.pool.resources) == {RemoteResource("w2", "r1")}
+            second.cancel()
+
+    @pytest.mark.asyncio
+    async def test_task_fails_when_worker_leaves(self):
+        """Test that a job fails when its worker disconnects, so that it can be retried elsewhere."""
+        async with Coordinator() as coordinator:
+            worker_task = await start_worker(coordinator, "w1", ["r1"])
+            job = asyncio.create_task(
+                coordinator.run(RemoteResource("w1", "r1"), "sleep", "sleep 30", update_hook=lambda *_: None)
+            )
+            await asyncio.sleep(0.2)
+            worker_task.cancel()
+
+            with pytest.raises(TaskProcessError, match="left while running"):
+                await asyncio.wait_for(job, timeout=5)
+
+    @pytest.mark.asyncio
+    async def test_retry_on_another_worker(self):
+        """Test that a task whose worker leaves is retried on a worker joining later."""
+        lines = []
+        async with Coordinator() as coordinator:
+            leaving = await start_worker(coordinator, "w1", ["r1"])
+            task = create_remote_task(
+                "t",
+                "sleep 0.5; echo done",
+                coordinator=coordinator,
+                update_hook=lambda name, line: lines.append(line),
+                retry=RetryPolicy(interval=0, jitter=0),
+            )
+            running = task.submit()
+            await asyncio.sleep(0.2)
+            leaving.cancel()
+            staying = await start_worker(coordinator, "w2", ["r1"])
+
+            await asyncio.wait_for(running, timeout=5)
+            staying.cancel()
+
+        assert lines == [b"done\n"]
+
+    @pytest.mark.asyncio
+    async def test_token(self):
+        """Test that only workers sending the token of the coordinator are accepted."""
+        async with Coordinator(token="secret") as coordinator:
+            host, port = coordinator.address
+            await asyncio.wait_for(Worker(host, port, resources=["r1"], name="w1", token="guess").run(), timeout=5)
+            assert coordinator.workers == {}
+
+            worker_task = await start_worker(coordinator, "w2", ["r1"], token="secret")
+            worker_task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_invalid_hello(self):
+        """Test that a connection introducing itself with an invalid hello is closed."""
+        async with Coordinator() as coordinator:
+            for hello in (b"not json\n", b'{"type": "hello", "name": "w1"}\n', b'["hello"]\n'):
+                reader, writer = await asyncio.open_connection(*coordinator.address)
+                writer.write(hello)
+                assert await asyncio.wait_for(reader.read(), timeout=5) == b""
+                writer.close()
+            assert coordinator.workers == {}
+
+    @pytest.mark.asyncio
+    async def test_invalid_message(self):
+        """Test that a worker sending an invalid message is dropped along with its resources."""
+        async with Coordinator() as coordinator:
+            for message in (b"not json\n", b'{"kind": "log"}\n', b'["log"]\n'):
+                reader, writer = await asyncio.open_connection(*coordinator.address)
+                writer.write(b'{"type": "hello", "name": "w1", "resources": ["r1"], "token": null}\n')
+                while "w1" not in coordinator.workers:
+                    await asyncio.sleep(0.01)
+                writer.write(message)
+                assert await asyncio.wait_for(reader.read(), timeout=5) == b""
+                writer.close()
+                assert coordinator.workers == {}
+                assert coordinator.pool.resources == {}
+
+    @pytest.mark.asyncio
+    async def test_job_error_fails_the_task(self, monkeypatch):
+        """Test that a job failing with an unexpected error on the worker fails on the coordinator."""
+
+        def broken_command(*args, **kwargs):
+            raise OSError("broken")
+
+        monkeypatch.setattr("nanoflow.remote.create_command", broken_command)
+        async with Coordinator() as coordinator:
+            worker_task = await start_worker(coordinator, "w1", ["r1"])
+            with pytest.raises(TaskProcessError, match="return code None"):
+                await asyncio.wait_for(
+                    coordinator.run(RemoteResource("w1", "r1"), "broken", "true", update_hook=lambda *_: None),
+                    timeout=5,
+                )
+            worker_task.cancel()
+
+
+class TestRemoteExecutor:
+    @pytest.mark.asyncio
+    async def test_from_configs_with_coordinator(self, tmp_path):
+        """Test that a workflow runs on several workers connected to a coordinator."""
+        config = WorkflowConfig(
+            name="remote",
+            resources=["r1"],
+            tasks={
+                "a": TaskConfig(command=f"echo a > {tmp_path / 'a.txt'}"),
+                "b": TaskConfig(command=f"echo b > {tmp_path / 'b.txt'}"),
+                "c": TaskConfig(command=f"cat {tmp_path / 'a.txt'} {tmp_path / 'b.txt'}", deps=["a", "b"]),
+            },
+        )
+        lines = []
+        async with Coordinator() as coordinator:
+            workers = [await start_worker(coordinator, name, ["r1"]) for name in ("w1", "w2")]
+            executor = Executor.from_configs(
+                config, update_hook=lambda name, line: lines.append((name, line)), coordinator=coordinator
+            )
+
+            state = await asyncio.wait_for(executor.run_async(), timeout=10)
+            for worker_task in workers:
+                worker_task.cancel()
+
+        assert state.completed_task_count == 3
+        assert lines == [("0_c", b"a\n"), ("0_c", b"b\n")]
+        assert coordinator.pool.used_resources == set()
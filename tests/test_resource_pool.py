@@ -6,7 +6,13 @@ from unittest.mock import patch
 
 import pytest
 
-from nanoflow.resource_pool import DynamicResourcePool, GPUResourcePool, ResourcePool, UnlimitedPool
+from nanoflow.resource_pool import (
+    ConcurrencyGroup,
+    DynamicResourcePool,
+    GPUResourcePool,
+    ResourcePool,
+    UnlimitedPool,
+)
 
 
 class TestResourcePool:
@@ -66,6 +72,69 @@ class TestResourcePool:
         assert resource2 == 1
         pool.release(resource2)
 
+    @pytest.mark.asyncio
+    async def test_resource_pool_serves_highest_priority_first(self):
+        """Test that a released resource goes to the waiting task with the highest priority."""
+        pool = ResourcePool([1])
+        resource = await pool.acquire()
+        order = []
+
+        async def acquire(name: str, priority: float):
+            res = await pool.acquire(priority)
+            order.append(name)
+            pool.release(res)
+
+        waiting = [
+            asyncio.create_task(acquire("low", 1)),
+            asyncio.create_task(acquire("high", 10)),
+            asyncio.create_task(acquire("first_mid", 5)),
+            asyncio.create_task(acquire("second_mid", 5)),
+        ]
+        await asyncio.sleep(0)
+        pool.release(resource)
+        await asyncio.gather(*waiting)
+
+        assert order == ["high", "first_mid", "second_mid", "low"]
+
+    @pytest.mark.asyncio
+    async def test_resource_pool_cancelled_waiter(self):
+        """Test that a cancelled waiter does not keep a resource."""
+        pool = ResourcePool([1])
+        resource = await pool.acquire()
+
+        cancelled = asyncio.create_task(pool.acquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+
+        pool.release(resource)
+        assert pool.used_resources == set()
+        assert await pool.acquire() == 1
+
+    @pytest.mark.asyncio
+    async def test_resource_pool_avoid(self):
+        """Test that avoided resources are only handed out when nothing else is free."""
+        pool = ResourcePool([1, 2])
+
+        assert await pool.acquire(avoid={1}) == 2
+        assert await pool.acquire(avoid={1}) == 1
+
+        waiter = asyncio.create_task(pool.acquire(avoid={1}))
+        await asyncio.sleep(0)
+        pool.release(1)
+        assert await waiter == 1
+
+    @pytest.mark.asyncio
+    async def test_resource_pool_has_free_resource(self):
+        """Test checking for a free resource outside the avoided ones."""
+        pool = ResourcePool([1, 2])
+
+        assert pool.has_free_resource()
+        assert await pool.acquire() == 1
+        assert pool.has_free_resource(avoid={1})
+        assert not pool.has_free_resource(avoid={2})
+
 
 class TestUnlimitedPool:
     @pytest.mark.asyncio
@@ -281,3 +350,20 @@ class TestGPUResourcePool:
 
         with pytest.raises(subprocess.CalledProcessError):
             pool.get_available_resources()
+
+
+class TestConcurrencyGroup:
+    @pytest.mark.asyncio
+    async def test_concurrency_group_limit(self):
+        """Test that at most `limit` slots are held at once."""
+        group = ConcurrencyGroup("nfs", 2)
+
+        slots = [await group.acquire(), await group.acquire()]
+        assert sorted(slots) == [0, 1]
+
+        waiting = asyncio.create_task(group.acquire())
+        await asyncio.sleep(0)
+        assert not waiting.done()
+
+        group.release(slots[0])
+        assert await waiting == slots[0]
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import pytest
+from pydantic import ValidationError
+
+from nanoflow.retry import RetryPolicy
+
+
+class TestRetryPolicy:
+    def test_default_policy(self):
+        """Test that the default policy retries a few times with growing delays, capped at a minute."""
+        policy = RetryPolicy(jitter=0)
+
+        assert [policy.delay(attempt) for attempt in range(1, policy.max_attempts)] == [10, 30, 60]
+        assert policy.should_retry(3, 1)
+        assert not policy.should_retry(4, 1)
+
+    def test_uncapped_interval(self):
+        """Test that delays keep growing without `max_interval`."""
+        policy = RetryPolicy(max_interval=None, jitter=0)
+
+        assert [policy.delay(attempt) for attempt in range(1, policy.max_attempts)] == [10, 30, 90]
+
+    def test_jitter(self):
+        """Test that jitter keeps the delay within the configured ratio."""
+        policy = RetryPolicy(interval=10, backoff=1, jitter=0.5)
+
+        delays = [policy.delay(1) for _ in range(100)]
+
+        assert all(5 <= delay <= 15 for delay in delays)
+        assert len(set(delays)) > 1
+
+    def test_command_not_found_is_not_retried(self):
+        """Test that commands which cannot be executed or found are not retried by default."""
+        policy = RetryPolicy()
+
+        assert not policy.should_retry(1, 126)
+        assert not policy.should_retry(1, 127)
+        assert policy.should_retry(1, None)
+
+    def test_retry_on_exit_codes(self):
+        """Test that only the listed exit codes are retried."""
+        policy = RetryPolicy(retry_on_exit_codes=[137])
+
+        assert policy.should_retry(1, 137)
+        assert not policy.should_retry(1, 1)
+        assert not policy.should_retry(1, None)
+
+    def test_validation(self):
+        """Test that invalid policies are rejected."""
+        with pytest.raises(ValidationError):
+            RetryPolicy(max_attempts=0)
+        with pytest.raises(ValidationError):
+            RetryPolicy(backoff=0.5)
+        with pytest.raises(ValidationError):
+            RetryPolicy(jitter=2)
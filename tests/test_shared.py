@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import array
+import asyncio
+import gc
+import os
+from multiprocessing.shared_memory import SharedMemory
+
+import pytest
+
+from nanoflow.backend import ExecutionBackends, current_backends
+from nanoflow.shared import SHARED_MIN_SIZE, SharedResult, adopt, share
+from nanoflow.task import Task, task
+
+SIZE = 4 * SHARED_MIN_SIZE
+
+
+def segment_exists(name: str) -> bool:
+    try:
+        SharedMemory(name).close()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+@task(backend="process", shared_result=True)
+def produce(size: int) -> bytes:
+    return bytes(range(256)) * (size // 256)
+
+
+@task(backend="process")
+def consume(data: memoryview) -> tuple[int, int, bool]:
+    return os.getpid(), sum(data[:256]), data.readonly
+
+
+@task(backend="warm")
+def consume_warm(data: memoryview) -> int:
+    return data.nbytes
+
+
+@pytest.fixture
+def backends():
+    backends = ExecutionBackends(max_workers=1)
+    token = current_backends.set(backends)
+    yield backends
+    current_backends.reset(token)
+    backends.shutdown()
+
+
+class TestShare:
+    def test_small_values_are_unchanged(self):
+        """Test that small buffers and other values are returned as is."""
+        data = b"small"
+        assert share(data) is data
+        assert share([1, 2]) == [1, 2]
+
+    def test_format_and_shape(self):
+        """Test that typed buffers keep their item type."""
+        values = array.array("d", range(SIZE // 8))
+        result = adopt(share(values))
+
+        view = result.view()
+        assert (view.format, view.shape) == ("d", (SIZE // 8,))
+        assert view[-1] == SIZE // 8 - 1
+
+    def test_numpy_array(self):
+        """Test that NumPy arrays are viewed as arrays."""
+        np = pytest.importorskip("numpy")
+        values = np.arange(SIZE, dtype=np.float32).reshape(2, -1)
+        result = adopt(share(values))
+
+        view = result.view()
+        assert view.shape == values.shape and view.dtype == values.dtype
+        assert (view == values).all()
+        assert not view.flags.writeable
+
+
+class TestSharedTasks:
+    @pytest.mark.asyncio
+    async def test_result_passed_between_processes(self, backends):
+        """Test that a large result comes back as a handle that downstream tasks see as a view."""
+        result = await produce.submit(SIZE)
+
+        assert isinstance(result, SharedResult)
+        pid, total, readonly = await consume.submit(result)
+        assert pid != os.getpid()
+        assert total == sum(range(256))
+        assert readonly
+        assert await consume_warm.submit(data=result) == SIZE
+
+    @pytest.mark.asyncio
+    async def test_small_result_is_returned(self, backends):
+        """Test that results smaller than the threshold are sent back as usual."""
+        assert await produce.submit(256) == bytes(range(256))
+
+    @pytest.mark.asyncio
+    async def test_thread_and_async_tasks(self, backends):
+        """Test that tasks on the event loop process share and view results too."""
+
+        async def produce_async() -> bytearray:
+            return bytearray(SIZE)
+
+        result = await Task(name="produce", fn=produce_async, shared_result=True).submit()
+        assert await Task(name="consume", fn=lambda data: data.nbytes).submit(result) == SIZE
+
+    @pytest.mark.asyncio
+    async def test_unlinked_after_last_consumer(self, backends):
+        """Test that the segment is unlinked once the handle is dropped and its consumers finished."""
+        started = asyncio.Event()
+        finish = asyncio.Event()
+
+        async def slow_consume(data: memoryview) -> int:
+            started.set()
+            await finish.wait()
+            return data.nbytes
+
+        result = await produce.submit(SIZE)
+        name = result.name
+        running = Task(name="slow", fn=slow_consume).submit(result)
+        await started.wait()
+        del result
+        gc.collect()
+        assert segment_exists(name)
+
+        finish.set()
+        assert await running == SIZE
+        del running
+        gc.collect()
+        assert not segment_exists(name)
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from nanoflow.resource_pool import ResourcePool
+from nanoflow.retry import RetryPolicy
+from nanoflow.speculation import SpeculativeRun
+from nanoflow.task import Task, TaskProcessError
+
+
+def on_resource(delays: dict[str, float], events: list[str], fail_on: set[str] | None = None):
+    """Resource modifier running for a resource-specific time."""
+
+    def modifier(fn, resource: str):
+        async def run():
+            events.append(f"start_{resource}")
+            await asyncio.sleep(delays[resource])
+            if fail_on is not None and resource in fail_on:
+                raise TaskProcessError(f"failed on {resource}", returncode=1)
+            events.append(f"end_{resource}")
+            return resource
+
+        return run
+
+    return modifier
+
+
+class TestSpeculativeRun:
+    @pytest.mark.asyncio
+    async def test_duplicate_wins(self):
+        """Test that a faster duplicate wins and the original is cancelled."""
+        events = []
+        pool = ResourcePool(["slow", "fast"])
+        task = Task(
+            name="t",
+            fn=lambda: None,
+            resource_pool=pool,
+            resource_modifier=on_resource({"slow": 10, "fast": 0}, events),
+        )
+        speculative_run = SpeculativeRun(task)
+
+        running = asyncio.create_task(speculative_run.run())
+        await asyncio.sleep(0.01)
+        speculative_run.duplicate({"slow"})
+
+        assert await asyncio.wait_for(running, timeout=5) == "fast"
+        assert events == ["start_slow", "start_fast", "end_fast"]
+        assert pool.used_resources == set()
+
+    @pytest.mark.asyncio
+    async def test_original_wins(self):
+        """Test that the original keeps its result when it finishes first."""
+        events = []
+        pool = ResourcePool(["a", "b"])
+        task = Task(
+            name="t", fn=lambda: None, resource_pool=pool, resource_modifier=on_resource({"a": 0.05, "b": 10}, events)
+        )
+        speculative_run = SpeculativeRun(task)
+
+        running = asyncio.create_task(speculative_run.run())
+        await asyncio.sleep(0.01)
+        speculative_run.duplicate({"a"})
+
+        assert await asyncio.wait_for(running, timeout=5) == "a"
+        assert "end_b" not in events
+        assert pool.used_resources == set()
+
+    @pytest.mark.asyncio
+    async def test_fails_when_every_attempt_fails(self):
+        """Test that a failed attempt does not fail the run while another one is still running."""
+        events = []
+        pool = ResourcePool(["a", "b"])
+        task = Task(
+            name="t",
+            fn=lambda: None,
+            resource_pool=pool,
+            resource_modifier=on_resource({"a": 0.05, "b": 0.1}, events, fail_on={"a", "b"}),
+            retry=RetryPolicy(max_attempts=1),
+        )
+        speculative_run = SpeculativeRun(task)
+
+        running = asyncio.create_task(speculative_run.run())
+        await asyncio.sleep(0.01)
+        speculative_run.duplicate({"a"})
+
+        with pytest.raises(TaskProcessError, match="failed on b"):
+            await running
+        assert events == ["start_a", "start_b"]
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
 import asyncio
+import threading
+import time
 
 import pytest
 
-from nanoflow.resource_pool import ResourcePool, UnlimitedPool
-from nanoflow.task import Task, TaskProcessError, task
+from nanoflow.resource_pool import ConcurrencyGroup, ResourcePool, UnlimitedPool
+from nanoflow.retry import RetryPolicy
+from nanoflow.task import Task, TaskDependencyError, TaskProcessError, TaskTimeoutError, task
 
 
 class TestTask:
@@ -18,7 +21,7 @@ class TestTask:
         t = Task(name="test_task", fn=simple_fn)
         assert t.name == "test_task"
         assert t.fn == simple_fn
-        assert t.retry_interval == [10, 30, 60]
+        assert t.retry == RetryPolicy()
         assert t.resource_pool is None
         assert t.resource_modifier is None
 
@@ -219,6 +222,290 @@ class TestTask:
         assert "start_2" in execution_order
         assert "end_2" in execution_order
 
+    @pytest.mark.asyncio
+    async def test_task_submit_with_concurrency_group(self):
+        """Test that a concurrency group caps the number of running tasks."""
+        group = ConcurrencyGroup("db", 2)
+        lock = threading.Lock()
+        running = 0
+        max_running = 0
+
+        def tracked_compute():
+            nonlocal running, max_running
+            with lock:
+                running += 1
+                max_running = max(max_running, running)
+            time.sleep(0.01)
+            with lock:
+                running -= 1
+
+        t = Task(name="db_task", fn=tracked_compute, concurrency_group=group)
+        await asyncio.gather(*[t.submit() for _ in range(6)])
+
+        assert max_running == 2
+        assert group.used_resources == set()
+
+    @pytest.mark.asyncio
+    async def test_concurrency_group_is_taken_before_resource(self):
+        """Test that a task waiting for its group does not hold a resource."""
+        group = ConcurrencyGroup("db", 1)
+        pool = ResourcePool(["device1", "device2"])
+        slot = await group.acquire()
+
+        t = Task(name="db_task", fn=lambda: None, resource_pool=pool, concurrency_group=group)
+        future = t.submit()
+        await asyncio.sleep(0.01)
+        assert pool.used_resources == set()
+
+        group.release(slot)
+        await future
+        assert pool.used_resources == set()
+
+
+class TestTaskRetry:
+    @pytest.mark.asyncio
+    async def test_retry_until_success(self):
+        """Test that a failing task is retried until it succeeds."""
+        attempts = 0
+
+        def flaky():
+            nonlocal attempts
+            attempts += 1
+            if attempts < 3:
+                raise TaskProcessError("flaky", returncode=1)
+            return attempts
+
+        t = Task(name="flaky", fn=flaky, retry=RetryPolicy(max_attempts=3, interval=0))
+        assert await t.submit() == 3
+
+    @pytest.mark.asyncio
+    async def test_retry_gives_up(self):
+        """Test that the error escapes once the attempts are exhausted."""
+        attempts = 0
+
+        def fail():
+            nonlocal attempts
+            attempts += 1
+            raise TaskProcessError("failed", returncode=1)
+
+        t = Task(name="fail", fn=fail, retry=RetryPolicy(max_attempts=2, interval=0))
+        with pytest.raises(TaskProcessError):
+            await t.submit()
+        assert attempts == 2
+
+    @pytest.mark.asyncio
+    async def test_no_retry_for_excluded_exit_code(self):
+        """Test that exit codes outside the policy fail immediately."""
+        attempts = 0
+
+        def not_found():
+            nonlocal attempts
+            attempts += 1
+            raise TaskProcessError("not found", returncode=127)
+
+        t = Task(name="not_found", fn=not_found, retry=RetryPolicy(interval=0))
+        with pytest.raises(TaskProcessError):
+            await t.submit()
+        assert attempts == 1
+
+    @pytest.mark.asyncio
+    async def test_retry_on_different_resource(self):
+        """Test that a retry prefers a resource the task did not fail on."""
+        pool = ResourcePool(["device1", "device2"])
+        used = []
+
+        def on_device(fn, resource):
+            def run():
+                used.append(resource)
+                if len(used) == 1:
+                    raise TaskProcessError("out of memory", returncode=1)
+
+            return run
+
+        policy = RetryPolicy(interval=0, retry_on_different_resource=True)
+        t = Task(name="oom", fn=lambda: None, resource_pool=pool, resource_modifier=on_device, retry=policy)
+        await t.submit()
+
+        assert used == ["device1", "device2"]
+
+    @pytest.mark.asyncio
+    async def test_retry_on_same_resource_by_default(self):
+        """Test that retries may reuse the same resource unless asked otherwise."""
+        pool = ResourcePool(["device1", "device2"])
+        used = []
+
+        def on_device(fn, resource):
+            def run():
+                used.append(resource)
+                if len(used) == 1:
+                    raise TaskProcessError("out of memory", returncode=1)
+
+            return run
+
+        policy = RetryPolicy(interval=0)
+        t = Task(name="oom", fn=lambda: None, resource_pool=pool, resource_modifier=on_device, retry=policy)
+        await t.submit()
+
+        assert used == ["device1", "device1"]
+
+
+class TestTaskTimeout:
+    @pytest.mark.asyncio
+    async def test_timeout(self):
+        """Test that a task running past its timeout fails with TaskTimeoutError."""
+
+        async def hang():
+            await asyncio.sleep(30)
+
+        pool = ResourcePool(["device1"])
+        t = Task(name="hang", fn=hang, resource_pool=pool, timeout=0.05, retry=RetryPolicy(max_attempts=1))
+
+        with pytest.raises(TaskTimeoutError):
+            await t.submit()
+        assert pool.used_resources == set()
+
+    @pytest.mark.asyncio
+    async def test_timeout_error_raised_by_task(self):
+        """Test that a TimeoutError raised by the task itself is not mistaken for a timeout."""
+
+        async def fail():
+            raise TimeoutError("connection timed out")
+
+        t = Task(name="fail", fn=fail, timeout=10)
+
+        with pytest.raises(TimeoutError, match="connection timed out") as exc_info:
+            await t.submit()
+        assert not isinstance(exc_info.value, TaskTimeoutError)
+
+
+class TestTaskAfter:
+    @pytest.mark.asyncio
+    async def test_diamond(self):
+        """Test that a diamond of tasks runs without awaiting the submissions in order."""
+        order = []
+
+        async def record(name: str, delay: float = 0):
+            await asyncio.sleep(delay)
+            order.append(name)
+
+        t = Task(name="record", fn=record)
+        top = t.submit("top", 0.05)
+        left = t.submit_after([top], "left", 0.05)
+        right = t.submit_after([top], "right")
+        bottom = t.submit_after([left, right], "bottom")
+
+        await bottom
+        assert order == ["top", "right", "left", "bottom"]
+
+    @pytest.mark.asyncio
+    async def test_resource_taken_once_ready(self):
+        """Test that a waiting task does not hold its resource."""
+        pool = ResourcePool(["device1"])
+        gate = asyncio.Event()
+
+        async def noop():
+            pass
+
+        waiting = Task(name="waiting", fn=noop, resource_pool=pool).submit_after([asyncio.ensure_future(gate.wait())])
+        await asyncio.sleep(0.05)
+        assert pool.used_resources == set()
+        await Task(name="other", fn=noop, resource_pool=pool).submit()
+
+        gate.set()
+        await waiting
+        assert pool.used_resources == set()
+
+    @pytest.mark.asyncio
+    async def test_failed_upstream(self):
+        """Test that a task waiting for a failed task fails without running."""
+        calls = []
+
+        def fail():
+            raise ValueError("upstream failed")
+
+        upstream = Task(name="fail", fn=fail).submit()
+        downstream = Task(name="downstream", fn=lambda: calls.append(1)).submit_after([upstream])
+
+        with pytest.raises(TaskDependencyError) as exc_info:
+            await downstream
+        assert isinstance(exc_info.value.__cause__, ValueError)
+        assert calls == []
+
+
+class TestTaskMap:
+    @pytest.mark.asyncio
+    async def test_bounded_in_flight(self):
+        """Test that items are pulled lazily and at most `max_in_flight` submissions are alive."""
+        pulled = 0
+        running = 0
+        peak = 0
+
+        def items():
+            nonlocal pulled
+            for i in range(1000):
+                pulled += 1
+                yield i
+
+        async def work(x: int) -> int:
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0)
+            running -= 1
+            return x
+
+        yielded = 0
+        async for _ in Task(name="work", fn=work).map(items(), max_in_flight=8):
+            yielded += 1
+            assert pulled - yielded <= 8
+
+        assert yielded == 1000
+        assert peak <= 8
+
+    @pytest.mark.asyncio
+    async def test_ordered_and_unordered(self):
+        """Test that results come in completion order, or in item order when `ordered` is set."""
+
+        async def delayed(delay: float) -> float:
+            await asyncio.sleep(delay)
+            return delay
+
+        t = Task(name="delayed", fn=delayed)
+        delays = [0.1, 0.05, 0]
+
+        assert [result async for result in t.map(delays)] == [0, 0.05, 0.1]
+        assert [result async for result in t.map(delays, ordered=True)] == delays
+
+    @pytest.mark.asyncio
+    async def test_async_iterable(self):
+        """Test that items can come from an async iterable."""
+
+        async def items():
+            for i in range(3):
+                yield i
+
+        t = Task(name="double", fn=lambda x: x * 2)
+        assert [result async for result in t.map(items(), ordered=True)] == [0, 2, 4]
+
+    @pytest.mark.asyncio
+    async def test_failure_cancels_in_flight(self):
+        """Test that a failing submission raises and cancels the other submissions."""
+        cancelled = []
+
+        async def work(x: int):
+            if x == 0:
+                raise ValueError("failed")
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.append(x)
+                raise
+
+        with pytest.raises(ValueError, match="failed"):
+            async for _ in Task(name="work", fn=work).map(range(100), max_in_flight=4):
+                pass
+        assert sorted(cancelled) == [1, 2, 3]
+
 
 class TestTaskDecorator:
     def test_task_decorator_simple(self):
@@ -1,14 +1,16 @@
 from __future__ import annotations
 
+import asyncio
 import os
-import subprocess
-from unittest.mock import Mock, patch
+from unittest.mock import patch
 
 import pytest
 
+from nanoflow.launcher import STREAM_LIMIT
 from nanoflow.resource_pool import ResourcePool, UnlimitedPool
-from nanoflow.task import Task, TaskProcessError
-from nanoflow.utils import create_command, create_gpu_task, create_task, layer_nodes
+from nanoflow.retry import RetryPolicy
+from nanoflow.task import Task, TaskProcessError, TaskTimeoutError
+from nanoflow.utils import create_chunk_task, create_command, create_gpu_task, create_task, layer_nodes
 
 
 class TestLayerNodes:
@@ -94,97 +96,147 @@ class TestLayerNodes:
 
 
 class TestCreateCommand:
-    @patch("subprocess.Popen")
-    def test_create_command_success(self, mock_popen):
+    @pytest.mark.asyncio
+    async def test_create_command_success(self):
         """Test creating and executing a successful command."""
-        # Mock successful process
-        mock_process = Mock()
-        mock_process.wait.return_value = 0
-        mock_popen.return_value = mock_process
-
-        command_fn = create_command("test_task", "echo hello")
+        command_fn = create_command("test_task", "echo hello > /dev/null")
 
         # Should not raise any exception
-        command_fn()
-
-        mock_popen.assert_called_once_with("echo hello", shell=True, env=None)
-        mock_process.wait.assert_called_once()
+        await command_fn()
 
-    @patch("subprocess.Popen")
-    def test_create_command_failure(self, mock_popen):
+    @pytest.mark.asyncio
+    async def test_create_command_failure(self):
         """Test creating and executing a failing command."""
-        # Mock failing process
-        mock_process = Mock()
-        mock_process.wait.return_value = 1
-        mock_popen.return_value = mock_process
-
-        command_fn = create_command("failing_task", "false")
+        command_fn = create_command("failing_task", "exit 1")
 
-        with pytest.raises(TaskProcessError, match="Task `failing_task` failed with return code 1"):
-            command_fn()
+        with pytest.raises(TaskProcessError, match="Task `failing_task` failed with return code 1") as exc_info:
+            await command_fn()
+        assert exc_info.value.returncode == 1
 
-    @patch("subprocess.Popen")
-    def test_create_command_with_environ(self, mock_popen):
+    @pytest.mark.asyncio
+    async def test_create_command_with_environ(self):
         """Test creating command with custom environment."""
-        mock_process = Mock()
-        mock_process.wait.return_value = 0
-        mock_popen.return_value = mock_process
-
         custom_env = {"CUSTOM_VAR": "test_value"}
-        command_fn = create_command("env_task", "env", environ=custom_env)
-
-        command_fn()
+        command_fn = create_command("env_task", 'test "$CUSTOM_VAR" = test_value', environ=custom_env)
 
-        mock_popen.assert_called_once_with("env", shell=True, env=custom_env)
+        await command_fn()
 
-    @patch("subprocess.Popen")
-    def test_create_command_with_update_hook(self, mock_popen):
+    @pytest.mark.asyncio
+    async def test_create_command_with_update_hook(self):
         """Test creating command with update hook."""
-        # Mock process with stdout
-        mock_process = Mock()
-        mock_process.wait.return_value = 0
-        mock_process.stdout = [b"line1\n", b"line2\n"]
-        mock_popen.return_value = mock_process
-
         captured_updates = []
 
         def update_hook(name: str, line: bytes):
             captured_updates.append((name, line))
 
-        command_fn = create_command("hooked_task", "echo test", update_hook=update_hook)
-
-        command_fn()
+        command_fn = create_command("hooked_task", "echo line1; echo line2; echo error >&2", update_hook=update_hook)
 
-        # Should use PIPE for stdout and stderr when update_hook is provided
-        mock_popen.assert_called_once_with(
-            "echo test", shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=None
-        )
+        await command_fn()
 
-        assert len(captured_updates) == 2
-        assert captured_updates[0] == ("hooked_task", b"line1\n")
-        assert captured_updates[1] == ("hooked_task", b"line2\n")
+        # Both stdout and stderr are forwarded to the update hook
+        assert ("hooked_task", b"line1\n") in captured_updates
+        assert ("hooked_task", b"error\n") in captured_updates
+        assert [line for _, line in captured_updates if line != b"error\n"] == [b"line1\n", b"line2\n"]
 
-    @patch("subprocess.Popen")
-    def test_create_command_with_update_hook_and_environ(self, mock_popen):
+    @pytest.mark.asyncio
+    async def test_create_command_with_update_hook_and_environ(self):
         """Test creating command with both update hook and environment."""
-        mock_process = Mock()
-        mock_process.wait.return_value = 0
-        mock_process.stdout = [b"output\n"]
-        mock_popen.return_value = mock_process
+        captured_updates = []
+
+        def update_hook(name: str, line: bytes):
+            captured_updates.append(line)
 
         custom_env = {"TEST": "value"}
+        command_fn = create_command("test", "echo $TEST", update_hook=update_hook, environ=custom_env)
+
+        await command_fn()
+
+        assert captured_updates == [b"value\n"]
+
+    @pytest.mark.asyncio
+    async def test_create_command_long_line(self):
+        """Test that output lines longer than the stream limit are forwarded in pieces."""
+        captured_updates = []
 
         def update_hook(name: str, line: bytes):
-            pass
+            captured_updates.append(line)
+
+        length = STREAM_LIMIT * 2 + 10
+        command_fn = create_command(
+            "progress", f"head -c {length} /dev/zero | tr '\\0' x; printf '\\rdone\\n'", update_hook=update_hook
+        )
+
+        await command_fn()
 
-        command_fn = create_command("test", "cmd", update_hook=update_hook, environ=custom_env)
+        assert b"".join(captured_updates) == b"x" * length + b"\rdone\n"
+        assert max(len(line) for line in captured_updates) <= STREAM_LIMIT
 
-        command_fn()
+    @pytest.mark.asyncio
+    async def test_hook_error_kills_process_group(self, tmp_path):
+        """Test that a command is killed when forwarding its output fails."""
+        done_path = tmp_path / "done"
 
-        mock_popen.assert_called_once_with(
-            "cmd", shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=custom_env
+        def update_hook(name: str, line: bytes):
+            raise RuntimeError("hook failed")
+
+        command_fn = create_command(
+            "test", f"echo start; (sleep 0.3; touch {done_path}) & wait", update_hook=update_hook, kill_grace=0.1
         )
 
+        with pytest.raises(RuntimeError, match="hook failed"):
+            await command_fn()
+        await asyncio.sleep(0.6)
+        assert not done_path.exists()
+
+    @pytest.mark.asyncio
+    async def test_create_command_does_not_use_threads(self):
+        """Test that commands run on the event loop without a thread hop."""
+        command_fn = create_command("test", "true")
+
+        with patch("asyncio.to_thread") as mock_to_thread:
+            await Task(name="test", fn=command_fn).submit()
+
+        mock_to_thread.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_cancel_kills_process_group(self, tmp_path):
+        """Test that cancelling a command terminates the processes it started."""
+        started_path = tmp_path / "started"
+        done_path = tmp_path / "done"
+        command_fn = create_command("test", f"(touch {started_path}; sleep 0.3; touch {done_path}) & wait")
+
+        running = asyncio.create_task(command_fn())
+        while not started_path.exists():
+            await asyncio.sleep(0.01)
+        running.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await running
+
+        await asyncio.sleep(0.6)
+        assert not done_path.exists()
+
+    @pytest.mark.asyncio
+    async def test_cancel_kills_after_grace(self):
+        """Test that a command ignoring SIGTERM is killed once the grace period is over."""
+        command_fn = create_command("test", "trap '' TERM; sleep 30", kill_grace=0.1)
+
+        running = asyncio.create_task(command_fn())
+        await asyncio.sleep(0.1)
+        running.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(running, timeout=5)
+
+    @pytest.mark.asyncio
+    async def test_task_timeout(self):
+        """Test that a command task running past its timeout fails and releases its resource."""
+        pool = ResourcePool([0])
+        timed_task = create_task("slow", "sleep 30", pool=pool, timeout=0.1, kill_grace=0.1)
+        timed_task.retry = RetryPolicy(max_attempts=1)
+
+        with pytest.raises(TaskTimeoutError, match=r"timed out after 0\.1 seconds"):
+            await asyncio.wait_for(timed_task.submit(), timeout=5)
+        assert pool.used_resources == set()
+
 
 class TestCreateGpuTask:
     def test_create_gpu_task_structure(self):
@@ -214,7 +266,7 @@ class TestCreateGpuTask:
         # The modifier should return a create_command function
         assert callable(modified_fn)
         if modified_fn is not None:
-            modified_fn()
+            asyncio.run(modified_fn())  # type: ignore
 
     @patch("nanoflow.utils.create_command")
     def test_create_gpu_task_calls_create_command(self, mock_create_command):
@@ -339,3 +391,52 @@ class TestCreateTask:
         assert "EXISTING_VAR" in environ_arg
         assert environ_arg["EXISTING_VAR"] == "existing_value"
         assert environ_arg["FORCE_COLOR"] == "1"
+
+
+class TestCreateChunkTask:
+    @pytest.mark.asyncio
+    async def test_chunk_runs_members_on_one_resource(self):
+        """Test that the members of a chunk run back to back under their own names."""
+        lines = []
+        pool = ResourcePool(["0", "1"])
+        chunk = create_chunk_task(
+            "chunk",
+            {"a": "echo $CUDA_VISIBLE_DEVICES a", "b": "echo $CUDA_VISIBLE_DEVICES b"},
+            pool=pool,
+            gpus=True,
+            update_hook=lambda name, line: lines.append((name, line)),
+        )
+
+        await chunk.submit()
+
+        assert lines == [("a", b"0 a\n"), ("b", b"0 b\n")]
+        assert pool.used_resources == set()
+
+    @pytest.mark.asyncio
+    async def test_chunk_retries_failed_members(self, tmp_path):
+        """Test that a failing member does not stop the others, and that only it is retried."""
+        marker = tmp_path / "marker"
+        log_path = tmp_path / "log.txt"
+        chunk = create_chunk_task(
+            "chunk",
+            {
+                "flaky": f"echo flaky >> {log_path}; test -e {marker} || (touch {marker}; exit 3)",
+                "ok": f"echo ok >> {log_path}",
+            },
+            retry=RetryPolicy(max_attempts=2, interval=0, jitter=0),
+        )
+
+        await chunk.submit()
+
+        assert log_path.read_text().split() == ["flaky", "ok", "flaky"]
+
+    @pytest.mark.asyncio
+    async def test_chunk_failure(self):
+        """Test that a chunk fails with the return code of its first failing member."""
+        chunk = create_chunk_task(
+            "chunk", {"a": "exit 2", "b": "sleep 30"}, retry=RetryPolicy(max_attempts=1), timeout=0.1, kill_grace=0.1
+        )
+
+        with pytest.raises(TaskProcessError, match="2 of 2 tasks failed") as exc_info:
+            await asyncio.wait_for(chunk.submit(), timeout=5)
+        assert exc_info.value.returncode == 2
@@ -1,12 +1,26 @@
 from __future__ import annotations
 
 import asyncio
+import time
 
 import pytest
 
+from nanoflow.graph import LazyResult
+from nanoflow.task import Task, task
 from nanoflow.workflow import Workflow, workflow
 
 
+@task
+def slow_double(x: int) -> int:
+    time.sleep(0.3)
+    return x * 2
+
+
+@task
+def add(a: int, b: int) -> int:
+    return a + b
+
+
 class TestWorkflow:
     @pytest.mark.asyncio
     async def test_workflow_creation_and_call(self):
@@ -194,3 +208,83 @@ class TestWorkflowDecorator:
         assert workflow1.name == "workflow1"
         assert workflow2.name == "workflow2"
         assert workflow3.name == "custom"
+
+
+class TestLazyWorkflow:
+    @pytest.mark.asyncio
+    async def test_capture_records_graph(self):
+        """Test that capturing records tasks and their dependencies without running them."""
+        calls = []
+        record = Task(name="record", fn=lambda value: calls.append(value))
+
+        @workflow(lazy=True)
+        async def lazy_workflow():
+            left = await slow_double.submit(1)
+            right = slow_double.submit(2)
+            assert isinstance(left, LazyResult)
+            total = await add.submit(left, b=right)
+            record.submit_after([total], "done")
+
+        graph = await lazy_workflow.capture()
+
+        assert graph.dependencies == {
+            "0_slow_double": [],
+            "1_slow_double": [],
+            "2_add": ["0_slow_double", "1_slow_double"],
+            "3_record": ["2_add"],
+        }
+        assert calls == []
+
+    @pytest.mark.asyncio
+    async def test_fan_in_from_containers(self):
+        """Test that results nested in lists and dicts become dependencies and are resolved."""
+        total = Task(name="total", fn=lambda values, weights: sum(values) + sum(weights.values()))
+        results = []
+
+        @workflow(lazy=True)
+        async def lazy_workflow():
+            doubled = [slow_double.submit(i) for i in range(3)]
+            results.append(total.submit(doubled, {"x": slow_double.submit(10)}))
+
+        graph = await lazy_workflow.capture()
+        assert graph.dependencies["4_total"] == ["0_slow_double", "1_slow_double", "2_slow_double", "3_slow_double"]
+
+        await lazy_workflow()
+        assert results[-1].result() == 26
+
+    @pytest.mark.asyncio
+    async def test_independent_tasks_run_in_parallel(self):
+        """Test that tasks awaited one after another still run in parallel when they are independent."""
+        results = []
+
+        @workflow(lazy=True)
+        async def lazy_workflow():
+            left = await slow_double.submit(1)
+            right = await slow_double.submit(2)
+            results.append(await add.submit(left, right))
+
+        start = time.perf_counter()
+        await lazy_workflow()
+        elapsed = time.perf_counter() - start
+
+        assert results[0].result() == 6
+        assert elapsed < 0.55
+
+    @pytest.mark.asyncio
+    async def test_failure_skips_dependents(self):
+        """Test that a failing task skips its dependents and fails the workflow."""
+
+        def fail() -> int:
+            raise ValueError("failed")
+
+        failing = Task(name="fail", fn=fail)
+        results = []
+
+        @workflow(lazy=True)
+        async def lazy_workflow():
+            results.append(add.submit(failing.submit(), 1))
+
+        with pytest.raises(RuntimeError, match="1 tasks failed"):
+            await lazy_workflow()
+        with pytest.raises(asyncio.InvalidStateError):
+            results[0].result()